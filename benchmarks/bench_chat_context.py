@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+bench_chat_context.py
+
+/api/chat のプロンプトの大きさとレイテンシを、会話 1 ターン目と 50 ターン目で比較する。
+GEMINI_BACKEND=fake で、fake モデルにはプロンプト 1000 文字ごとのレイテンシ
+(GEMINI_FAKE_LATENCY_PER_KCHAR) を設定して入力の長さによる遅延を再現する。
+
+- chat_context: 固定の対戦状況 + 要約 + 直近ウィンドウ (現在の実装)
+- 全履歴: 以前の実装と同じく毎ターン全履歴を連結したプロンプト (同じ会話から組み立てて比較)
+
+【実行例】
+  python benchmarks/bench_chat_context.py --turns 50 --latency 0.1 --latency-per-kchar 0.1
+"""
+
+import argparse
+import json
+import os
+import time
+
+import common
+from bench_response_cache import make_capture, upload
+
+QUESTION = "相手が{turn}回目に崖際でジャンプを読んできたとき、どの技で差し返すのが安定しますか？ダメージ状況は考慮してください。"
+# 実際の Gemini の回答に近い長さ (約 300 文字) にする
+ANSWER = "崖際では相手のジャンプ読みに対して、発生の早い空中技で差し返すのが安定します。" * 8
+
+
+def wait_idle(app):
+    # 要約ジョブも含めてキューが空になるまで待つ
+    while True:
+        m = app.llm_jobs.metrics()
+        if m["submitted"] == m["completed"] + m["failed"]:
+            return
+        time.sleep(0.005)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="対話コンテキストのベンチマーク")
+    parser.add_argument("--turns", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.1, help="fake モデルの固定レイテンシ (秒)")
+    parser.add_argument("--latency-per-kchar", type=float, default=0.1, help="プロンプト 1000 文字ごとのレイテンシ (秒)")
+    args = parser.parse_args()
+
+    os.environ["GEMINI_BACKEND"] = "fake"
+    os.environ["GEMINI_FAKE_LATENCY"] = str(args.latency)
+    os.environ["GEMINI_FAKE_LATENCY_PER_KCHAR"] = str(args.latency_per_kchar)
+    workdir = common.make_workdir()
+    common.build_sample_db(workdir)
+    app = common.import_app(workdir)
+    client = app.app.test_client()
+
+    model = app.gemini_models.get(app.GEMINI_MODEL_NAME)
+    generate = model.generate_content
+
+    def generate_with_answer(contents, **kwargs):
+        response = generate(contents, **kwargs)
+        if contents[0].startswith("スマッシュブラザーズのコーチングの対話を要約"):
+            return response
+        response.text = ANSWER
+        return response
+    model.generate_content = generate_with_answer
+
+    prompts = []
+    answer_chat = app.answer_chat
+
+    def recording_answer_chat(conversation_id, prompt):
+        prompts.append(prompt)
+        return answer_chat(conversation_id, prompt)
+    app.answer_chat = recording_answer_chat
+
+    # 画像をアップロードして対戦状況を分析 → その状況が固定コンテキストになる
+    random_key = upload(client, make_capture())
+    data = client.post("/api/calc_distance",
+                       json={"random_key": random_key, "char1": "Mario", "char2": "Link"}).get_json()
+    if data["job_id"]:
+        app.llm_jobs.wait(data["job_id"], timeout=60)
+
+    legacy_history = []
+    rows = []
+    for turn in range(1, args.turns + 1):
+        question = QUESTION.format(turn=turn)
+        start = time.perf_counter()
+        job_id = client.post("/api/chat", json={"conversation_id": random_key, "message": question}).get_json()["job_id"]
+        app.llm_jobs.wait(job_id, timeout=60)
+        elapsed = time.perf_counter() - start
+        wait_idle(app)
+
+        legacy_history.append({"role": "user", "content": question})
+        context = "\n".join(f"{msg['role']}: {msg['content']}" for msg in legacy_history)
+        legacy_prompt = f"以下の対話履歴を参考にして回答してください。\n{context}\nassistant:"
+        start = time.perf_counter()
+        generate([legacy_prompt])
+        legacy_elapsed = time.perf_counter() - start
+        legacy_history.append({"role": "assistant", "content": ANSWER})
+
+        record = app.conversation_history.get(random_key)
+        rows.append({
+            "turn": turn,
+            "prompt_bytes": len(prompts[-1].encode("utf-8")),
+            "latency": elapsed,
+            "stored_bytes": len(json.dumps(record, ensure_ascii=False).encode("utf-8")),
+            "legacy_prompt_bytes": len(legacy_prompt.encode("utf-8")),
+            "legacy_latency": legacy_elapsed,
+            "legacy_stored_bytes": len(json.dumps(legacy_history, ensure_ascii=False).encode("utf-8")),
+        })
+
+    print(f"{'':>6} | {'chat_context':^34} | {'全履歴 (以前の実装)':^30}")
+    print(f"{'turn':>6} | {'prompt':>9} {'latency':>10} {'保存量':>10} | {'prompt':>9} {'latency':>10} {'保存量':>9}")
+    for row in rows:
+        if row["turn"] in (1, 10, 25, args.turns):
+            print(f"{row['turn']:>6} | {row['prompt_bytes']:>8}B {row['latency'] * 1000:>8.0f}ms "
+                  f"{row['stored_bytes']:>9}B | {row['legacy_prompt_bytes']:>8}B "
+                  f"{row['legacy_latency'] * 1000:>8.0f}ms {row['legacy_stored_bytes']:>8}B")
+    first, last = rows[0], rows[-1]
+    print(f"turn {args.turns} / turn 1: chat_context prompt x{last['prompt_bytes'] / first['prompt_bytes']:.2f}, "
+          f"全履歴 prompt x{last['legacy_prompt_bytes'] / first['legacy_prompt_bytes']:.2f}")
+    record = app.conversation_history.get(random_key)
+    print(f"要約に畳み込んだメッセージ {record['summarized']} 件 / 残っている直近メッセージ {len(record['messages'])} 件")
+
+
+if __name__ == "__main__":
+    main()
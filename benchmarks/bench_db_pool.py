@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+bench_db_pool.py
+
+recommend_actions の DB 読み込み (6 テーブルを character_id で SELECT *) の queries/sec を、
+1 / 8 / 32 スレッドで比較する。
+
+- connect  : 以前の iter_recommend_actions と同じく、呼び出しごとに sqlite3.connect -> 6 クエリ -> close
+- pool     : db_pool.ReadOnlyPool (スレッドごとの読み込み専用接続 + mmap + ステートメントキャッシュ)
+- pool+app : プールを使う app.recommend_actions (行の辞書化・距離比較込み)
+
+どちらも同じ結果を返すことを確認してから測る。1 クエリ = 1 キャラ分の 6 テーブル読み込み。
+
+【実行例】
+  python benchmarks/bench_db_pool.py --characters 87 --threads 1 8 32 --queries 20000
+"""
+
+import argparse
+import random
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import common
+from db_pool import ReadOnlyPool
+from move_index import TABLE_LABELS
+
+SQL = [f"SELECT * FROM {table} WHERE character_id=?" for table in TABLE_LABELS]
+
+
+def read_with_connect(db_path, character_id):
+    conn = sqlite3.connect(db_path)
+    try:
+        return [conn.execute(sql, (character_id,)).fetchall() for sql in SQL]
+    finally:
+        conn.close()
+
+
+def read_with_pool(pool, character_id):
+    return [pool.execute(sql, (character_id,)).fetchall() for sql in SQL]
+
+
+def measure(fn, character_ids, threads):
+    # スレッドごとに担当分をまとめて回し、executor のタスク投入コストを測らないようにする
+    chunks = [character_ids[i::threads] for i in range(threads)]
+
+    def worker(chunk):
+        for character_id in chunk:
+            fn(character_id)
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        # 各スレッドの接続を先に開いておく (プールの初回接続は測らない)
+        list(executor.map(worker, [chunk[:1] for chunk in chunks]))
+        start = time.perf_counter()
+        list(executor.map(worker, chunks))
+        elapsed = time.perf_counter() - start
+    return len(character_ids) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="読み込み専用接続プールの queries/sec")
+    parser.add_argument("--characters", type=int, default=87)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--queries", type=int, default=20000)
+    args = parser.parse_args()
+
+    workdir = common.make_workdir()
+    db_path = common.build_sample_db(workdir, n_characters=args.characters)
+    app = common.import_app(workdir)
+    pool = ReadOnlyPool(db_path)
+
+    for character_id in range(args.characters + 1):
+        assert read_with_connect(db_path, character_id) == read_with_pool(pool, character_id)
+    print(f"一致確認: {args.characters + 1} キャラ OK")
+
+    rng = random.Random(0)
+    character_ids = [rng.randint(1, args.characters) for _ in range(args.queries)]
+    variants = (
+        ("connect", lambda cid: read_with_connect(db_path, cid)),
+        ("pool", lambda cid: read_with_pool(pool, cid)),
+        ("pool+app", lambda cid: app.recommend_actions(app.DB_PATH, cid, 10.0)),
+    )
+    for threads in args.threads:
+        qps = {name: measure(fn, character_ids, threads) for name, fn in variants}
+        print(f"threads={threads:2d}  " + "  ".join(f"{name}={value:,.0f} q/s" for name, value in qps.items())
+              + f"  (pool x{qps['pool'] / qps['connect']:.1f})")
+    print(f"プール: {pool.metrics()}")
+
+
+if __name__ == "__main__":
+    main()
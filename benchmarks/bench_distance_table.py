@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+bench_distance_table.py
+
+move_index.DistanceTable (距離 -> Top5 の事前計算テーブル) の検証とベンチマーク。
+
+1) 全キャラ × 盤面上の全 (dx, dy) (負の値を含む) で、MoveIndex.top_moves が
+   get_top5_moves(iter_recommend(...)) と完全に同じ結果を返すことを確認する
+2) calc_distance 1 回分 (2 キャラ) の Top5 取得時間を比較する
+3) テーブルの構築時間・サイズと、DBファイルの更新を検知して自動で作り直すことを確認する
+
+【実行例】
+  python benchmarks/bench_distance_table.py --characters 90 --lookups 20000
+"""
+
+import argparse
+import random
+import sqlite3
+import time
+
+import common
+from move_index import BOARD_COLUMNS, BOARD_ROWS, MoveIndex, grid_distance, select_top_moves
+
+
+def main():
+    parser = argparse.ArgumentParser(description="距離テーブルのベンチマーク")
+    parser.add_argument("--characters", type=int, default=90)
+    parser.add_argument("--lookups", type=int, default=20000)
+    args = parser.parse_args()
+
+    workdir = common.make_workdir()
+    db_path = common.build_sample_db(workdir, n_characters=args.characters)
+
+    start = time.perf_counter()
+    index = MoveIndex(db_path)
+    build = time.perf_counter() - start
+    table = index.distance_table
+    print(f"キャラ {args.characters} 人: 読み込み + テーブル構築 {build * 1000:.0f}ms, "
+          f"距離 {len(table.distances)} 通り, 配列 {table.nbytes / 1024:.1f}KiB")
+
+    # 1) 等価性
+    character_ids = index.character_ids() + [0]
+    checked = 0
+    for cid in character_ids:
+        for dx in range(-(BOARD_COLUMNS - 1), BOARD_COLUMNS):
+            for dy in range(-(BOARD_ROWS - 1), BOARD_ROWS):
+                expected = select_top_moves(index.iter_recommend(cid, grid_distance(dx, dy)), k=5)
+                assert index.top_moves(cid, dx, dy) == expected, (cid, dx, dy)
+                checked += 1
+    print(f"等価性: {checked} 通りすべて一致")
+
+    # 2) calc_distance 1 回分 (2 キャラ) のレイテンシ
+    rng = random.Random(0)
+    queries = [(rng.choice(character_ids), rng.choice(character_ids),
+                rng.randint(-(BOARD_COLUMNS - 1), BOARD_COLUMNS - 1),
+                rng.randint(-(BOARD_ROWS - 1), BOARD_ROWS - 1)) for _ in range(args.lookups)]
+    samples = []
+    for c1, c2, dx, dy in queries:
+        t = time.perf_counter()
+        dist = grid_distance(dx, dy)
+        select_top_moves(index.iter_recommend(c1, dist))
+        select_top_moves(index.iter_recommend(c2, dist))
+        samples.append(time.perf_counter() - t)
+    scan = common.summarize(samples)
+    samples = []
+    for c1, c2, dx, dy in queries:
+        t = time.perf_counter()
+        index.top_moves(c1, dx, dy)
+        index.top_moves(c2, dx, dy)
+        samples.append(time.perf_counter() - t)
+    lookup = common.summarize(samples)
+    print(f"iter_recommend + get_top5_moves p50={scan['p50_ms'] * 1000:.1f}us p99={scan['p99_ms'] * 1000:.1f}us")
+    print(f"DistanceTable.lookup            p50={lookup['p50_ms'] * 1000:.1f}us p99={lookup['p99_ms'] * 1000:.1f}us "
+          f"(x{scan['p50_ms'] / lookup['p50_ms']:.1f})")
+
+    # 3) DB更新の自動検知 (距離 35.3 の直後になる値に書き換える)
+    conn = sqlite3.connect(db_path)
+    conn.execute("UPDATE air_moves SET fair_x = 36 WHERE character_id = 1")
+    conn.commit()
+    conn.close()
+    # 更新の確認は check_interval 秒に 1 回なので、その間隔が過ぎてから引く
+    time.sleep(index.check_interval)
+    before = table
+    moves = index.top_moves(1, 32, 15)
+    assert index.distance_table is not before
+    assert moves[0] == {"カテゴリ": "空中攻撃", "行動": "fair_x", "適用距離": 36}, moves
+    print(f"DB更新から {index.check_interval:.0f} 秒以内の top_moves でテーブルを作り直した")
+
+
+if __name__ == "__main__":
+    main()
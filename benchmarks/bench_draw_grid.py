@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+bench_draw_grid.py
+
+draw_grid_with_relative_coords の 1 アップロードあたりのレイテンシ (読み込み〜保存まで) を、
+オーバーレイキャッシュなし (毎回描画) とキャッシュあり (合成のみ) で比較する。
+cloud-run/draw_grid.py (PIL / NumPy エンジン) と smash-analyzer/backend/draw_grid.py を計測する。
+(NumPy エンジンの hits/misses は PIL 用オーバーレイのものなので参考外)
+
+【実行例】
+  python benchmarks/bench_draw_grid.py --sizes 1920x1080 1280x720 --repeat 20
+"""
+
+import argparse
+import importlib.util
+import os
+import time
+
+import numpy as np
+from PIL import Image
+
+import common
+
+
+def load_backend_draw_grid():
+    # cloud-run/draw_grid.py と同名なのでファイルパスから別名で読み込む
+    path = os.path.join(common.BACKEND_DIR, "draw_grid.py")
+    spec = importlib.util.spec_from_file_location("backend_draw_grid", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_capture(path, width, height, seed=0):
+    """Switch のキャプチャに近い、なだらかなグラデーション + ノイズの JPEG を作る"""
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:height, 0:width]
+    base = np.stack([xx * 255 // max(width - 1, 1), yy * 255 // max(height - 1, 1),
+                     (xx + yy) * 255 // max(width + height - 2, 1)], axis=-1)
+    noise = rng.integers(-20, 20, size=base.shape)
+    Image.fromarray(np.clip(base + noise, 0, 255).astype(np.uint8)).save(path, quality=90)
+
+
+def time_uploads(module, input_path, output_path, repeat, cached, **kwargs):
+    samples = []
+    module.clear_overlay_cache()
+    for _ in range(repeat):
+        if not cached:
+            module.clear_overlay_cache()
+        start = time.perf_counter()
+        module.draw_grid_with_relative_coords(image_path=input_path, output_path=output_path, **kwargs)
+        samples.append(time.perf_counter() - start)
+    if cached:
+        # 1回目はミス (描画) なので除く
+        samples = samples[1:]
+    return common.summarize(samples), module.overlay_cache_info()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="draw_grid のオーバーレイキャッシュのベンチマーク")
+    parser.add_argument("--sizes", nargs="+", default=["1920x1080", "1280x720"])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    # backend 版は保存後に img.show() を呼ぶのでベンチ中は無効にする
+    Image.Image.show = lambda self, *a, **k: None
+
+    import draw_grid as cloud_run_draw_grid
+    variants = (
+        ("cloud-run", cloud_run_draw_grid, {"engine": "pil"}),
+        ("cloud-run numpy", cloud_run_draw_grid, {"engine": "numpy"}),
+        ("backend", load_backend_draw_grid(), {}),
+    )
+
+    workdir = common.make_workdir()
+    for size in args.sizes:
+        width, height = (int(v) for v in size.split("x"))
+        input_path = os.path.join(workdir, f"capture_{size}.jpg")
+        output_path = os.path.join(workdir, f"output_{size}.jpg")
+        make_capture(input_path, width, height)
+        print(f"{size}")
+        for name, module, kwargs in variants:
+            cold, _ = time_uploads(module, input_path, output_path, args.repeat, cached=False, **kwargs)
+            warm, info = time_uploads(module, input_path, output_path, args.repeat, cached=True, **kwargs)
+            print(f"  {name:15s} 毎回描画 p50={cold['p50_ms']:.1f}ms p95={cold['p95_ms']:.1f}ms | "
+                  f"キャッシュ p50={warm['p50_ms']:.1f}ms p95={warm['p95_ms']:.1f}ms "
+                  f"(hits={info.hits} misses={info.misses})")
+
+
+if __name__ == "__main__":
+    main()
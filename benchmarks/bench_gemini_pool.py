@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+bench_gemini_pool.py
+
+リクエストごとに Gemini モデルを作っていた従来の方式と、ModelPool で共有する方式の
+「1リクエストあたりの準備コスト」をオフラインで比較する (generate_content は呼ばない)。
+
+1) 毎回 genai.GenerativeModel(...) を作ってクライアントを取得する vs ModelPool.get()
+2) プロセスで最初のリクエストが払っていたクライアント (gRPC チャネル) 作成コスト
+   (ModelPool.warmup() で起動時に前倒しされる分。別プロセスで計測)
+3) GEMINI_BACKEND=fake で /api/chat をジョブ完了まで回したときの往復時間
+
+【実行例】
+  python benchmarks/bench_gemini_pool.py --requests 2000
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+import warnings
+
+import common
+
+COLD_START_SNIPPET = """
+import time, warnings
+warnings.filterwarnings("ignore")
+import google.generativeai as genai
+from google.generativeai import client
+genai.configure(api_key="benchmark-dummy-key")
+start = time.perf_counter()
+model = genai.GenerativeModel("gemini-1.5-flash")
+model._client = client.get_default_generative_client()
+print(time.perf_counter() - start)
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gemini モデルプールのベンチマーク")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--chat-requests", type=int, default=200)
+    args = parser.parse_args()
+
+    warnings.filterwarnings("ignore")
+    # 3) で import する app が fake バックエンドを使うよう、gemini_pool の import より前に設定する
+    os.environ["GEMINI_BACKEND"] = "fake"
+    import google.generativeai as genai
+    import gemini_pool
+
+    genai.configure(api_key="benchmark-dummy-key")
+
+    # 1) 毎回作る vs プールから取得
+    samples = []
+    for _ in range(args.requests):
+        start = time.perf_counter()
+        model = genai.GenerativeModel(gemini_pool.GEMINI_MODEL_NAME)
+        gemini_pool._warmup_google_model(model)
+        samples.append(time.perf_counter() - start)
+    per_request = common.summarize(samples)
+
+    pool = gemini_pool.ModelPool(backend="google")
+    pool.warmup()
+    samples = []
+    for _ in range(args.requests):
+        start = time.perf_counter()
+        pool.get(gemini_pool.GEMINI_MODEL_NAME)
+        samples.append(time.perf_counter() - start)
+    pooled = common.summarize(samples)
+
+    print("1リクエストあたりのモデル準備")
+    print(f"  毎回生成       p50={per_request['p50_ms'] * 1000:.1f}us p99={per_request['p99_ms'] * 1000:.1f}us")
+    print(f"  ModelPool.get  p50={pooled['p50_ms'] * 1000:.1f}us p99={pooled['p99_ms'] * 1000:.1f}us")
+
+    # 2) プロセス最初のリクエストが払うクライアント作成コスト
+    out = subprocess.run([sys.executable, "-c", COLD_START_SNIPPET], capture_output=True, text=True, check=True)
+    cold_ms = float(out.stdout.strip().splitlines()[-1]) * 1000
+    print(f"初回リクエストのクライアント作成 (warmup で起動時に移動) = {cold_ms:.1f}ms")
+
+    # 3) fake バックエンドでの /api/chat 往復
+    workdir = common.make_workdir()
+    common.build_sample_db(workdir)
+    app = common.import_app(workdir)
+    client = app.app.test_client()
+    samples = []
+    for i in range(args.chat_requests):
+        start = time.perf_counter()
+        job_id = client.post("/api/chat", json={"conversation_id": f"bench{i}", "message": "こんにちは"}).get_json()["job_id"]
+        app.llm_jobs.wait(job_id, timeout=10)
+        samples.append(time.perf_counter() - start)
+    chat = common.summarize(samples)
+    print(f"/api/chat (fake, ジョブ完了まで) p50={chat['p50_ms']:.2f}ms p95={chat['p95_ms']:.2f}ms "
+          f"作成されたモデル数={app.gemini_models.created}")
+
+
+if __name__ == "__main__":
+    main()
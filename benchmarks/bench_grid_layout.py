@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+bench_grid_layout.py
+
+アップロード直後の表示 (POST / と、そのページが読み込む画像) の時間と転送量を、
+マス目の描き方 (GRID_RENDER_MODE) で比べる。
+
+- server : サーバーでマス目を描いた JPEG を作り、それを表示する (以前の方式)
+- client : 元画像をそのまま表示し、マス目は grid_layout の JSON (ページに埋め込み) からブラウザの canvas で描く
+
+どちらも毎回違うスクリーンショット (1920x1080) を使う (同じ画像は保存・描画が省かれるため)。
+あわせて /api/grid_geometry の応答の大きさと時間を出す。
+
+【実行例】
+  python benchmarks/bench_grid_layout.py --uploads 20
+"""
+
+import argparse
+import io
+import random
+import re
+import time
+
+import common
+from bench_position_detector import synthetic_frame
+
+
+def main():
+    parser = argparse.ArgumentParser(description="マス目の描き方 (サーバー / ブラウザ) のベンチマーク")
+    parser.add_argument("--uploads", type=int, default=20)
+    args = parser.parse_args()
+
+    workdir = common.make_workdir()
+    common.build_sample_db(workdir)
+    app = common.import_app(workdir)
+    client = app.app.test_client()
+
+    rng = random.Random(0)
+    screenshots = []
+    for _ in range(args.uploads * 2):
+        buf = io.BytesIO()
+        synthetic_frame(rng)[0].save(buf, "JPEG", quality=90)
+        screenshots.append(buf.getvalue())
+
+    keys = []
+    for i, mode in enumerate(("server", "client")):
+        app.GRID_RENDER_MODE = mode
+        post_samples, page_bytes, image_bytes = [], 0, 0
+        for data in screenshots[i * args.uploads:(i + 1) * args.uploads]:
+            start = time.perf_counter()
+            page = client.post("/", data={"image_file": (io.BytesIO(data), "capture.jpg")},
+                               content_type="multipart/form-data").get_data(as_text=True)
+            post_samples.append(time.perf_counter() - start)
+            page_bytes += len(page.encode("utf-8"))
+            response = client.get(re.search(r'id="clickable-image" src="([^"]+)"', page).group(1))
+            image_bytes += len(response.data)
+            response.close()
+            keys.append(re.search(r'const randomKey = "(\w+)"', page).group(1))
+        timing = common.summarize(post_samples)
+        print(f"{mode:<6} POST / p50={timing['p50_ms']:.0f}ms p95={timing['p95_ms']:.0f}ms  "
+              f"ページ {page_bytes / args.uploads / 1024:.1f}KB + 画像 {image_bytes / args.uploads / 1024:.0f}KB / 回")
+
+    samples, size = [], 0
+    for key in keys:
+        start = time.perf_counter()
+        response = client.get(f"/api/grid_geometry/{key}")
+        samples.append(time.perf_counter() - start)
+        size = len(response.data)
+    timing = common.summarize(samples)
+    print(f"/api/grid_geometry: {size / 1024:.1f}KB p50={timing['p50_ms']:.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+bench_heatmap.py
+
+脅威ヒートマップ (HitboxModel.threat_map: 33 x 16 = 528 マス × 全技のブロードキャスト) の計算時間を、
+マスごとに connecting_moves を呼んで集計する方法と比べる。結果が一致することも確認する。
+あわせて /api/threat_heatmap のキャッシュミス (計算 + 画像作成) とヒットのレイテンシを測る。
+
+【実行例】
+  python benchmarks/bench_heatmap.py --characters 87 --maps 200
+"""
+
+import argparse
+import io
+import random
+import re
+import time
+
+import numpy as np
+from PIL import Image
+
+import common
+from move_index import BOARD_COLUMNS, BOARD_ROWS
+
+
+def per_cell_heatmap(model, attacker_id, defender_id, col, row):
+    count = np.zeros((BOARD_ROWS, BOARD_COLUMNS), dtype=np.int32)
+    damage = np.full((BOARD_ROWS, BOARD_COLUMNS), np.nan)
+    startup = np.full((BOARD_ROWS, BOARD_COLUMNS), np.nan)
+    for r in range(BOARD_ROWS):
+        for c in range(BOARD_COLUMNS):
+            hits = model.connecting_moves(attacker_id, defender_id, c - col, r - row)
+            count[r, c] = len(hits)
+            damages = [h["ダメージ"] for h in hits if h["ダメージ"] is not None]
+            startups = [h["発生"] for h in hits if h["発生"] is not None]
+            if damages:
+                damage[r, c] = max(damages)
+            if startups:
+                startup[r, c] = min(startups)
+    return {"count": count, "best_damage": damage, "fastest_startup": startup}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="脅威ヒートマップのベンチマーク")
+    parser.add_argument("--characters", type=int, default=87)
+    parser.add_argument("--maps", type=int, default=200)
+    args = parser.parse_args()
+
+    workdir = common.make_workdir()
+    common.build_sample_db(workdir, n_characters=args.characters)
+    app = common.import_app(workdir)
+    model = app.move_index.hitbox
+
+    rng = random.Random(0)
+    cases = [(rng.randint(1, args.characters), rng.randint(1, args.characters),
+              rng.randrange(BOARD_COLUMNS), rng.randrange(BOARD_ROWS)) for _ in range(args.maps)]
+
+    for case in cases[:5]:
+        expected = per_cell_heatmap(model, *case)
+        actual = model.threat_map(*case)
+        for name in expected:
+            np.testing.assert_array_equal(expected[name], actual[name])
+    print("一致確認: マスごとの connecting_moves と同じ結果")
+
+    samples = []
+    for case in cases:
+        start = time.perf_counter()
+        model.threat_map(*case)
+        samples.append(time.perf_counter() - start)
+    vectorized = common.summarize(samples)
+    start = time.perf_counter()
+    for case in cases[:5]:
+        per_cell_heatmap(model, *case)
+    loop_ms = (time.perf_counter() - start) / 5 * 1000
+    print(f"threat_map (528 マス × {len(model.moves)} 技) p50={vectorized['p50_ms']:.3f}ms "
+          f"p99={vectorized['p99_ms']:.3f}ms / マスごとの connecting_moves {loop_ms:.1f}ms "
+          f"(x{loop_ms / vectorized['p50_ms']:.0f})")
+
+    # API: 1 回目は計算 + 画像作成、2 回目はキャッシュから
+    client = app.app.test_client()
+    buf = io.BytesIO()
+    Image.new("RGB", (1920, 1080), (90, 120, 90)).save(buf, "JPEG")
+    buf.seek(0)
+    page = client.post("/", data={"image_file": (buf, "capture.jpg"), "columns": "33", "rows": "16",
+                                  "origin_cell": "347"}, content_type="multipart/form-data")
+    random_key = re.search(r'const randomKey = "(\w+)"', page.get_data(as_text=True)).group(1)
+    timings = {False: [], True: []}
+    for attacker_id, defender_id, col, row in cases[:20] * 2:
+        names = {v: k for k, v in app.CHARACTER_IDS.items()}
+        body = {"random_key": random_key, "char": names.get(attacker_id, "Unknown"),
+                "opponent": names.get(defender_id, "Unknown"), "cell": row * BOARD_COLUMNS + col + 1}
+        start = time.perf_counter()
+        response = client.post("/api/threat_heatmap", json=body)
+        timings[response.get_json()["cached"]].append(time.perf_counter() - start)
+    for cached, label in ((False, "ミス (計算 + 画像作成)"), (True, "ヒット")):
+        if timings[cached]:
+            result = common.summarize(timings[cached])
+            print(f"/api/threat_heatmap {label}: n={result['n']} p50={result['p50_ms']:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
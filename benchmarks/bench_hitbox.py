@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+bench_hitbox.py
+
+hitbox.HitboxModel (横・縦のリーチ + キャラの大きさによる 2D の当たり判定) のベンチマーク。
+
+1) 盤面上の全差分 (|dx| < 33, |dy| < 16) × 全キャラの組について、
+   技ごとに箱の重なりを Python で 1 つずつ判定した結果と hit_mask が一致することを確認する
+2) 登録キャラ数を 2 / 10 / 87 と増やしたときの 1 クエリあたりの時間
+   - connecting_moves: 1 キャラの当たる技の一覧 (キャラ数によらず一定のはず)
+   - hit_mask_all    : 全キャラ × 全技の判定 (キャラ数に比例するが 1 回のブロードキャスト)
+   - 従来の recommend (距離と全数値カラムの比較) + Top5
+
+【実行例】
+  python benchmarks/bench_hitbox.py --rosters 2 10 87 --queries 5000
+"""
+
+import argparse
+import random
+import time
+
+import common
+from move_index import MoveIndex, grid_distance, select_top_moves
+
+
+def reference_hits(model, attacker_id, defender_id, dx, dy):
+    # 技ごとに箱の重なりをそのまま判定する
+    r = model.row_of[attacker_id]
+    size_x, size_y = model.defender_size(defender_id)
+    hits = []
+    for j in range(len(model.moves)):
+        reach_x, reach_y = model.reach_x[r, j], model.reach_y[r, j]
+        if reach_x != reach_x:  # NaN: 技が無い
+            hits.append(False)
+            continue
+        hits.append(-reach_x - size_x / 2 <= dx <= reach_x + size_x / 2
+                    and -reach_y - size_y / 2 <= dy <= reach_y + size_y / 2)
+    return hits
+
+
+def per_query_us(fn, queries):
+    start = time.perf_counter()
+    for query in queries:
+        fn(*query)
+    return (time.perf_counter() - start) / len(queries) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="2D 当たり判定モデルのベンチマーク")
+    parser.add_argument("--rosters", type=int, nargs="+", default=[2, 10, 87])
+    parser.add_argument("--queries", type=int, default=5000)
+    args = parser.parse_args()
+
+    for n_characters in args.rosters:
+        workdir = common.make_workdir()
+        index = MoveIndex(common.build_sample_db(workdir, n_characters=n_characters))
+        model = index.hitbox
+
+        if n_characters == min(args.rosters):
+            checked = 0
+            ids = model.character_ids
+            for attacker_id in ids:
+                for defender_id in ids + [0]:
+                    for dx in range(-32, 33):
+                        for dy in range(-15, 16):
+                            expected = reference_hits(model, attacker_id, defender_id, dx, dy)
+                            assert model.hit_mask(attacker_id, defender_id, dx, dy).tolist() == expected
+                            checked += 1
+            print(f"一致確認: {checked} 通り (攻撃側 × 相手 × 差分) OK")
+
+        rng = random.Random(0)
+        queries = [(rng.randint(1, n_characters), rng.randint(1, n_characters),
+                    rng.randint(-32, 32), rng.randint(-15, 15)) for _ in range(args.queries)]
+        hits_us = per_query_us(lambda a, d, dx, dy: model.connecting_moves(a, d, dx, dy, k=5), queries)
+        all_us = per_query_us(lambda a, d, dx, dy: model.hit_mask_all(d, dx, dy), queries)
+        scalar_us = per_query_us(
+            lambda a, d, dx, dy: select_top_moves(index.iter_recommend(a, grid_distance(dx, dy)), k=5), queries)
+        print(f"キャラ {n_characters:3d} 人 (技 {len(model.moves)} 種, 配列 {model.nbytes / 1024:.1f}KiB): "
+              f"connecting_moves {hits_us:.1f}us / hit_mask_all {all_us:.1f}us / 従来の距離比較 Top5 {scalar_us:.1f}us")
+
+
+if __name__ == "__main__":
+    main()
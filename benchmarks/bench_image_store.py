@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+bench_image_store.py
+
+images/ フォルダの保存 (image_store.py: 中身のハッシュの名前・容量の上限・LRU 削除・出力画像の作り直し) のベンチマーク。
+
+IMAGE_STORE_MAX_BYTES を小さくして app.py を import し、重複を含むスクリーンショットを POST / で何度もアップロードして
+- 重複して保存されなかった数と、フォルダの合計サイズが上限を超えないこと
+- url_for('static', ...) の URL の配信時間 (ファイルがあるとき / 消された出力画像を作り直すとき)
+- フォルダの見直し (sweep) の時間
+を測る。
+
+【実行例】
+  python benchmarks/bench_image_store.py --uploads 60 --distinct 20 --max-mb 16
+"""
+
+import argparse
+import io
+import os
+import random
+import re
+import time
+
+import common
+from bench_position_detector import synthetic_frame
+
+
+def main():
+    parser = argparse.ArgumentParser(description="images/ フォルダの保存のベンチマーク")
+    parser.add_argument("--uploads", type=int, default=60)
+    parser.add_argument("--distinct", type=int, default=20, help="異なるスクリーンショットの数")
+    parser.add_argument("--max-mb", type=float, default=16)
+    args = parser.parse_args()
+
+    os.environ["IMAGE_STORE_MAX_BYTES"] = str(int(args.max_mb * 1024 * 1024))
+    # 見直しはベンチマークから呼ぶ
+    os.environ["IMAGE_STORE_SWEEP_INTERVAL"] = "0"
+    workdir = common.make_workdir()
+    common.build_sample_db(workdir)
+    app = common.import_app(workdir)
+    store = app.image_store
+    client = app.app.test_client()
+
+    rng = random.Random(0)
+    screenshots = []
+    for _ in range(args.distinct):
+        buf = io.BytesIO()
+        synthetic_frame(rng)[0].save(buf, "JPEG", quality=90)
+        screenshots.append(buf.getvalue())
+
+    urls = []
+    largest = 0
+    samples = []
+    for i in range(args.uploads):
+        data = screenshots[rng.randrange(args.distinct)]
+        start = time.perf_counter()
+        page = client.post("/", data={"image_file": (io.BytesIO(data), f"capture{i}.jpg")},
+                           content_type="multipart/form-data").get_data(as_text=True)
+        samples.append(time.perf_counter() - start)
+        urls.append(re.search(r'id="clickable-image" src="([^"]+)"', page).group(1))
+        largest = max(largest, sum(e.stat().st_size for e in os.scandir(store.folder) if e.is_file()))
+    metrics = store.metrics()
+    timing = common.summarize(samples)
+    print(f"POST / x{args.uploads} ({args.distinct} 種類): p50={timing['p50_ms']:.0f}ms  "
+          f"重複 {metrics['dedup_hits']}  削除 {metrics['evictions']} ({metrics['evicted_bytes'] / 2**20:.1f}MB)")
+    print(f"フォルダの合計: 最大 {largest / 2**20:.2f}MB / 上限 {args.max_mb:.2f}MB  "
+          f"現在 {metrics['files']} ファイル {metrics['bytes'] / 2**20:.2f}MB")
+
+    # 配信: 最近の URL と古い URL を 2 回ずつ (消された出力画像は 1 回目に作り直し、2 回目はファイルを返すだけ)
+    hits, rebuilds = [], []
+    for url in [u for u in urls[-5:] + urls[:5] for _ in range(2)]:
+        name = url.rsplit("/", 1)[1]
+        exists = os.path.exists(store.path(name))
+        start = time.perf_counter()
+        response = client.get(url)
+        elapsed = time.perf_counter() - start
+        response.close()
+        if response.status_code != 200:
+            print(f"{url}: {response.status_code} (元画像も消されている)")
+            continue
+        (hits if exists else rebuilds).append(elapsed)
+    for label, values in (("ファイルあり", hits), ("作り直し", rebuilds)):
+        if values:
+            result = common.summarize(values)
+            print(f"GET 出力画像 ({label}): n={result['n']} p50={result['p50_ms']:.1f}ms")
+
+    start = time.perf_counter()
+    store.sweep()
+    print(f"sweep ({store.metrics()['files']} ファイル): {(time.perf_counter() - start) * 1000:.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
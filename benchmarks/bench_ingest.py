@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+bench_ingest.py
+
+load_frame_data.py (CSV / JSON のフレームデータ一括取り込み) のベンチマーク。
+
+1) 合成した N 人分のフレームデータを JSON / CSV に書き出し、load_frame_data で取り込む (行/秒)
+2) 同じデータを mario.py / link.py と同じやり方 (insert_* 1 回ごとに接続・INSERT・コミット) で入れた場合
+3) 同じファイルをもう一度取り込んでも行数が変わらない (upsert) ことを確認する
+
+【実行例】
+  python benchmarks/bench_ingest.py --characters 87
+"""
+
+import argparse
+import csv
+import json
+import os
+import random
+import sqlite3
+import time
+
+import common
+from character import create_smash_db
+from load_frame_data import CHARACTER_COLUMNS, load_frame_data
+from moves_table import MOVE_COLUMNS, WIDE_TABLES, group_by_move, wide_columns
+
+
+def synthetic_fighters(db_path, n_characters, seed=0):
+    """character.py のスキーマの技構成で、ランダムな値の N 人分のフレームデータを作る"""
+    conn = sqlite3.connect(db_path)
+    layout = {table: group_by_move(wide_columns(conn.cursor(), table)) for table in WIDE_TABLES}
+    conn.close()
+    rng = random.Random(seed)
+    fighters = []
+    for character_id in range(1, n_characters + 1):
+        moves = []
+        for table, table_moves in layout.items():
+            for name, attrs in table_moves.items():
+                move = {"category": table, "move": name}
+                for col in MOVE_COLUMNS:
+                    if col not in attrs:
+                        move[col] = None
+                    elif col.startswith("range"):
+                        move[col] = rng.randint(1, 60)
+                    elif col == "damage":
+                        move[col] = round(rng.uniform(0, 25), 1)
+                    elif col == "startup":
+                        move[col] = rng.randint(1, 30)
+                    else:
+                        move[col] = rng.randint(0, 1)
+                moves.append(move)
+        fighters.append({"id": character_id, "name": f"Fighter{character_id:03d}", "size_x": rng.randint(4, 12),
+                         "size_y": rng.randint(8, 24), "weight": rng.randint(70, 135), "moves": moves})
+    return fighters, layout
+
+
+def write_csv(fighters, path):
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["character_id", *CHARACTER_COLUMNS[1:], "category", "move", *MOVE_COLUMNS])
+        for fighter in fighters:
+            for move in fighter["moves"]:
+                writer.writerow([fighter["id"], *(fighter[c] for c in CHARACTER_COLUMNS[1:]),
+                                 move["category"], move["move"],
+                                 *("" if move[c] is None else move[c] for c in MOVE_COLUMNS)])
+
+
+def per_function_inserts(db_path, fighters, layout):
+    """mario.py と同じく、キャラ 1 人・テーブル 1 つごとに接続して INSERT / コミットする"""
+    for fighter in fighters:
+        conn = sqlite3.connect(db_path)
+        conn.execute("INSERT INTO characters (id, name, size_x, size_y, weight) VALUES (?, ?, ?, ?, ?)",
+                     [fighter[c] for c in CHARACTER_COLUMNS])
+        conn.commit()
+        conn.close()
+        by_table = {}
+        for move in fighter["moves"]:
+            by_table.setdefault(move["category"], {})[move["move"]] = move
+        for table, moves in by_table.items():
+            columns, values = [], []
+            for name, attrs in layout[table].items():
+                for col, wide_col in attrs.items():
+                    columns.append(wide_col)
+                    values.append(moves[name][col])
+            conn = sqlite3.connect(db_path)
+            conn.execute(f"INSERT INTO {table} (character_id, {', '.join(columns)}) "
+                         f"VALUES ({', '.join('?' for _ in range(len(columns) + 1))})", [fighter["id"], *values])
+            conn.commit()
+            conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="フレームデータ取り込みのベンチマーク")
+    parser.add_argument("--characters", type=int, default=87)
+    args = parser.parse_args()
+
+    workdir = common.make_workdir()
+    layout_db = os.path.join(workdir, "layout.db")
+    create_smash_db(layout_db)
+    fighters, layout = synthetic_fighters(layout_db, args.characters)
+    json_path = os.path.join(workdir, "fighters.json")
+    csv_path = os.path.join(workdir, "fighters.csv")
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump(fighters, f, ensure_ascii=False)
+    write_csv(fighters, csv_path)
+    n_moves = sum(len(f["moves"]) for f in fighters)
+    print(f"{args.characters} キャラ / 技 {n_moves} 行")
+
+    for label, path in (("JSON", json_path), ("CSV", csv_path)):
+        db_path = os.path.join(workdir, f"load_{label}.db")
+        start = time.perf_counter()
+        result = load_frame_data(db_path, [path])
+        total = time.perf_counter() - start
+        rows = result["characters"] + result["moves"]
+        print(f"  load_frame_data ({label}) 書き込み {result['seconds'] * 1000:.1f}ms "
+              f"({rows / result['seconds']:,.0f} 行/秒), 読み込み・スキーマ作成込み {total * 1000:.1f}ms")
+
+        load_frame_data(db_path, [path])
+        conn = sqlite3.connect(db_path)
+        counts = (conn.execute("SELECT COUNT(*) FROM characters").fetchone()[0],
+                  conn.execute("SELECT COUNT(*) FROM moves").fetchone()[0])
+        conn.close()
+        assert counts == (args.characters, n_moves), counts
+        print(f"    2 回目の取り込み後も characters={counts[0]} moves={counts[1]} (upsert)")
+
+    db_path = os.path.join(workdir, "per_function.db")
+    create_smash_db(db_path)
+    start = time.perf_counter()
+    per_function_inserts(db_path, fighters, layout)
+    elapsed = time.perf_counter() - start
+    commits = args.characters * (1 + len(layout))
+    print(f"  insert_* 方式 ({commits} 回の接続・コミット) {elapsed * 1000:.1f}ms "
+          f"({(args.characters + n_moves) / elapsed:,.0f} 行/秒相当)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+bench_move_index.py
+
+recommend_actions (毎回SQLite全走査) と MoveIndex.recommend (起動時に構築した二分探索インデックス) の
+結果一致を確認したうえで、calc_distance 相当 (2キャラ分の推奨行動 + Top5) の
+1リクエストあたりレイテンシを、スレッド並列の負荷下で比較する。
+
+【実行例】
+  python benchmarks/bench_move_index.py --characters 87 --threads 1 8 --requests 2000
+"""
+
+import argparse
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import common
+
+
+def _run_load(handler, pairs, threads):
+    latencies = []
+
+    def one(pair):
+        start = time.perf_counter()
+        handler(*pair)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        latencies.extend(pool.map(one, pairs))
+    elapsed = time.perf_counter() - start
+    result = common.summarize(latencies)
+    result["req_per_sec"] = len(pairs) / elapsed
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="recommend_actions と MoveIndex の比較ベンチマーク")
+    parser.add_argument("--characters", type=int, default=87)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    workdir = common.make_workdir()
+    common.build_sample_db(workdir, n_characters=args.characters)
+    app = common.import_app(workdir)
+
+    # 結果が完全一致することを確認
+    checked = 0
+    for character_id in range(0, args.characters + 1):
+        for step in range(0, 161):
+            distance = step * 0.25
+            expected = app.recommend_actions(app.DB_PATH, character_id, distance)
+            actual = app.move_index.recommend(character_id, distance)
+            assert expected == actual, (character_id, distance)
+            checked += 1
+    print(f"一致確認: {checked} クエリ OK")
+
+    rng = random.Random(0)
+    pairs = [
+        (rng.randint(1, args.characters), rng.randint(1, args.characters), rng.uniform(0, 40))
+        for _ in range(args.requests)
+    ]
+
+    def legacy(char1_id, char2_id, dist):
+        app.get_top5_moves(app.recommend_actions(app.DB_PATH, char1_id, dist))
+        app.get_top5_moves(app.recommend_actions(app.DB_PATH, char2_id, dist))
+
+    def indexed(char1_id, char2_id, dist):
+        app.get_top5_moves(app.move_index.recommend(char1_id, dist))
+        app.get_top5_moves(app.move_index.recommend(char2_id, dist))
+
+    for threads in args.threads:
+        before = _run_load(legacy, pairs, threads)
+        after = _run_load(indexed, pairs, threads)
+        print(f"threads={threads}")
+        for name, r in (("recommend_actions", before), ("MoveIndex", after)):
+            print(f"  {name:18s} p50={r['p50_ms']:.3f}ms p95={r['p95_ms']:.3f}ms "
+                  f"p99={r['p99_ms']:.3f}ms {r['req_per_sec']:.0f} req/s")
+        print(f"  p50 speedup x{before['p50_ms'] / max(after['p50_ms'], 1e-9):.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+bench_moves_table.py
+
+横持ちの技テーブルと、縦持ちの moves テーブル (smash-analyzer/backend/moves_table.py) で
+「距離 -> 推奨行動 Top5」のクエリレイテンシを比較する。
+
+- 横持ち: recommend_actions と同じく 6 テーブルを SELECT * して全数値カラムを距離と比較し、上位 5 件を選ぶ
+- moves : (character_id, range_x / range_y) のカバリングインデックスへの範囲検索 1 回 (recommend_moves)
+
+どちらも接続は使い回し、クエリ + Top5 選択の時間だけを測る。
+あわせて移行にかかる時間と、互換ビュー経由の SELECT * が元のテーブルと同じ結果を返すことを確認する。
+
+【実行例】
+  python benchmarks/bench_moves_table.py --characters 90 --queries 5000
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import time
+
+import common
+import moves_table
+from move_index import TABLE_LABELS, MoveCandidate, MoveIndex, select_top_moves
+
+
+def wide_top5(conn, character_id, distance):
+    # app.iter_recommend_actions と同じ走査 (接続だけ使い回す)
+    candidates = []
+    for table, label in TABLE_LABELS.items():
+        cur = conn.execute(f"SELECT * FROM {table} WHERE character_id=?", (character_id,))
+        columns = [d[0] for d in cur.description]
+        for row in cur.fetchall():
+            for col, val in zip(columns, row):
+                if col in ("id", "character_id") or not isinstance(val, (int, float)):
+                    continue
+                if distance <= val:
+                    candidates.append(MoveCandidate(label, col, val, None, None))
+    return select_top_moves(candidates, k=5)
+
+
+def measure(fn, conn, queries):
+    samples = []
+    for character_id, distance in queries:
+        start = time.perf_counter()
+        fn(conn, character_id, distance)
+        samples.append(time.perf_counter() - start)
+    return common.summarize(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="moves テーブルのクエリレイテンシ")
+    parser.add_argument("--characters", type=int, default=90)
+    parser.add_argument("--queries", type=int, default=5000)
+    args = parser.parse_args()
+
+    workdir = common.make_workdir()
+    wide_db = common.build_sample_db(workdir, n_characters=args.characters)
+    long_db = os.path.join(workdir, "smash_characters_moves.db")
+    shutil.copy(wide_db, long_db)
+
+    start = time.perf_counter()
+    copied = moves_table.migrate(long_db)
+    print(f"移行: {sum(copied.values())} 行 {(time.perf_counter() - start) * 1000:.1f}ms")
+
+    # 互換ビューは元のテーブルと同じ結果を返す
+    wide_index, view_index = MoveIndex(wide_db), MoveIndex(long_db)
+    for character_id in range(args.characters + 1):
+        for distance in (0, 3.5, 10, 25, 60):
+            assert wide_index.recommend(character_id, distance) == view_index.recommend(character_id, distance)
+    print("互換ビュー: SELECT * の結果が元のテーブルと一致")
+
+    rng = random.Random(0)
+    queries = [(rng.randint(1, args.characters), round(rng.uniform(0, 36), 2)) for _ in range(args.queries)]
+    wide_conn = sqlite3.connect(wide_db)
+    long_conn = sqlite3.connect(long_db)
+    wide = measure(wide_top5, wide_conn, queries)
+    long = measure(moves_table.recommend_moves, long_conn, queries)
+    print(f"横持ち SELECT * + 全カラム比較 p50={wide['p50_ms'] * 1000:.1f}us p95={wide['p95_ms'] * 1000:.1f}us "
+          f"p99={wide['p99_ms'] * 1000:.1f}us")
+    print(f"moves インデックス範囲検索     p50={long['p50_ms'] * 1000:.1f}us p95={long['p95_ms'] * 1000:.1f}us "
+          f"p99={long['p99_ms'] * 1000:.1f}us (x{wide['p50_ms'] / long['p50_ms']:.1f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+bench_position_detector.py
+
+position_detector (プレイヤー色のタグからの位置の自動検出) の精度と速度のベンチマーク。
+
+合成した 1080p の試合画面 (背景のノイズ・くすんだ色の足場・ファイター・1P 赤 / 2P 青のタグ・
+画面下部の同じ色のダメージ表示) を JPEG で書き出し、フォルダのバッチ検出で
+- 1 枚あたりの時間 (JPEG の縮小デコード込み、1 コア)
+- 正解位置からのずれ (px) と、33 x 16 のマス目で同じマスになった割合
+を測る。
+
+【実行例】
+  python benchmarks/bench_position_detector.py --frames 50
+"""
+
+import argparse
+import os
+import random
+import time
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+import common
+from position_detector import DETECT_MARKER_OFFSET, detect_file, iter_image_files
+
+WIDTH, HEIGHT = 1920, 1080
+COLUMNS, ROWS = 33, 16
+TAG_COLORS = {"P1": (235, 40, 40), "P2": (40, 90, 235)}
+
+
+def synthetic_frame(rng):
+    """
+    合成の試合画面と、各プレイヤーのファイターの位置 (正解) を返す。
+    """
+    np_rng = np.random.default_rng(rng.randrange(1 << 30))
+    gradient = np.linspace(40, 120, HEIGHT, dtype=np.float32)[:, None, None]
+    base = np.concatenate([gradient * 0.6, gradient * 0.8, gradient], axis=2).repeat(WIDTH, axis=1)
+    noise = np_rng.normal(0, 12, (HEIGHT, WIDTH, 3))
+    img = Image.fromarray(np.clip(base + noise, 0, 255).astype(np.uint8))
+    draw = ImageDraw.Draw(img)
+
+    # 足場 (彩度の低い色)
+    for _ in range(4):
+        x, y = rng.randrange(0, WIDTH - 400), rng.randrange(300, 800)
+        draw.rectangle([x, y, x + rng.randrange(200, 600), y + 30], fill=(120, 100, 90))
+    # 画面下部のダメージ表示 (タグと同じ色のパネル)
+    for i, color in enumerate(TAG_COLORS.values()):
+        x = 560 + i * 520
+        draw.rectangle([x, 930, x + 280, 1060], fill=color)
+
+    truth = {}
+    for player, color in TAG_COLORS.items():
+        fx, fy = rng.randrange(100, WIDTH - 100), rng.randrange(200, 820)
+        truth[player] = (fx, fy)
+        # ファイター (くすんだ色の人型の箱)
+        draw.rectangle([fx - 30, fy - 50, fx + 30, fy + 50], fill=(170, 150, 130))
+        # タグ (ファイターの上、marker_offset ぶん上)
+        ty = fy - DETECT_MARKER_OFFSET * HEIGHT
+        draw.rectangle([fx - 22, ty - 14, fx + 22, ty + 14], fill=color)
+        draw.text((fx - 8, ty - 6), player[::-1], fill=(255, 255, 255))
+        draw.polygon([(fx - 8, ty + 14), (fx + 8, ty + 14), (fx, ty + 24)], fill=color)
+    return img, truth
+
+
+def cell_of(x, y):
+    return int(y // (HEIGHT / ROWS)) * COLUMNS + int(x // (WIDTH / COLUMNS))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="プレイヤー位置の自動検出のベンチマーク")
+    parser.add_argument("--frames", type=int, default=50)
+    args = parser.parse_args()
+
+    workdir = common.make_workdir()
+    rng = random.Random(0)
+    truths = {}
+    for i in range(args.frames):
+        img, truth = synthetic_frame(rng)
+        path = os.path.join(workdir, f"frame_{i:04d}.jpg")
+        img.save(path, quality=90)
+        truths[path] = truth
+
+    samples, errors = [], []
+    same_cell = missing = 0
+    for path in iter_image_files(workdir):
+        start = time.perf_counter()
+        positions = detect_file(path)
+        samples.append(time.perf_counter() - start)
+        for player, (x, y) in truths[path].items():
+            found = positions.get(player)
+            if found is None:
+                missing += 1
+                continue
+            errors.append(((found.x - x) ** 2 + (found.y - y) ** 2) ** 0.5)
+            same_cell += cell_of(found.x, found.y) == cell_of(x, y)
+    timing = common.summarize(samples)
+    total = args.frames * len(TAG_COLORS)
+    print(f"{args.frames} 枚 (1920x1080 JPEG): p50={timing['p50_ms']:.1f}ms p95={timing['p95_ms']:.1f}ms "
+          f"p99={timing['p99_ms']:.1f}ms / 枚 (デコード込み)")
+    if errors:
+        print(f"検出 {total - missing}/{total}  ずれ p50={np.percentile(errors, 50):.1f}px "
+              f"最大={max(errors):.1f}px  同じマス {same_cell}/{total}")
+
+
+if __name__ == "__main__":
+    main()
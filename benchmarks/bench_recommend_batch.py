@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+bench_recommend_batch.py
+
+MoveIndex.recommend_batch (NumPy 一括計算) と、
+1組ずつ recommend_actions + get_top5_moves を呼ぶ従来経路の結果一致と処理時間を比較する。
+/api/recommend_batch も Flask のテストクライアント経由で計測する。
+
+【実行例】
+  python benchmarks/bench_recommend_batch.py --characters 87 --pairs 5000
+"""
+
+import argparse
+import random
+import time
+
+import common
+
+
+def main():
+    parser = argparse.ArgumentParser(description="バッチ推奨APIのベンチマーク")
+    parser.add_argument("--characters", type=int, default=87)
+    parser.add_argument("--pairs", type=int, default=5000)
+    parser.add_argument("--k", type=int, default=5)
+    args = parser.parse_args()
+
+    workdir = common.make_workdir()
+    common.build_sample_db(workdir, n_characters=args.characters)
+    app = common.import_app(workdir)
+
+    rng = random.Random(0)
+    character_ids = [rng.randint(0, args.characters) for _ in range(args.pairs)]
+    distances = [rng.choice([rng.uniform(0, 40), float(rng.randint(0, 40))]) for _ in range(args.pairs)]
+
+    start = time.perf_counter()
+    expected = [
+        app.get_top5_moves(app.recommend_actions(app.DB_PATH, cid, d))
+        for cid, d in zip(character_ids, distances)
+    ]
+    legacy_sec = time.perf_counter() - start
+
+    start = time.perf_counter()
+    actual = app.move_index.recommend_batch(character_ids, distances, k=5)
+    batch_sec = time.perf_counter() - start
+    assert expected == actual
+    print(f"一致確認: {args.pairs} 組 OK")
+
+    start = time.perf_counter()
+    app.move_index.matrix.top_k(character_ids, distances, k=args.k)
+    raw_sec = time.perf_counter() - start
+
+    client = app.app.test_client()
+    start = time.perf_counter()
+    res = client.post("/api/recommend_batch",
+                      json={"character_ids": character_ids, "distances": distances, "k": args.k})
+    http_sec = time.perf_counter() - start
+    assert res.status_code == 200
+
+    for name, sec in (("1組ずつ recommend_actions", legacy_sec),
+                      ("recommend_batch", batch_sec),
+                      ("MoveMatrix.top_k (配列のみ)", raw_sec),
+                      ("/api/recommend_batch", http_sec)):
+        print(f"  {name:28s} {sec * 1000:9.1f}ms  {args.pairs / sec:10.0f} 組/s")
+
+
+if __name__ == "__main__":
+    main()
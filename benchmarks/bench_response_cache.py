@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+bench_response_cache.py
+
+response_cache.py (状況分析の回答キャッシュ) のベンチマーク。GEMINI_BACKEND=fake で Gemini には接続しない。
+
+1) /api/calc_distance: キャッシュミス (fake モデルの疑似レイテンシ込みでジョブ完了まで) と
+   キャッシュヒット (その場で回答を返す) の往復時間
+2) 同じ画像を縮小・再エンコードしてアップロードし直しても知覚ハッシュが一致してヒットすること
+3) ResponseCache.get 単体の memory 段 / sqlite 段のレイテンシとヒット率
+
+【実行例】
+  python benchmarks/bench_response_cache.py --latency 1.0 --requests 200
+"""
+
+import argparse
+import io
+import os
+import re
+import time
+
+import common
+
+
+def make_capture(width=1920, height=1080):
+    # ステージ風のグラデーション + 矩形 (知覚ハッシュが単色画像で退化しないように)
+    from PIL import Image, ImageDraw
+    img = Image.linear_gradient("L").rotate(90).resize((width, height)).convert("RGB")
+    draw = ImageDraw.Draw(img)
+    draw.rectangle((width // 4, height * 2 // 3, width * 3 // 4, height * 3 // 4), fill=(90, 60, 30))
+    draw.ellipse((width // 3, height // 3, width // 3 + 80, height // 3 + 120), fill=(220, 30, 30))
+    return img
+
+
+def upload(client, img, quality=95):
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=quality)
+    buf.seek(0)
+    res = client.post("/", data={"image_file": (buf, "capture.jpg"), "columns": "33", "rows": "16",
+                                 "origin_cell": "347", "line_color": "255,255,255", "line_width": "1"},
+                      content_type="multipart/form-data")
+    random_key = re.search(r'const randomKey = "(\w+)"', res.get_data(as_text=True)).group(1)
+    for i, (x, y) in enumerate([(300, 500), (700, 540)], 1):
+        client.post("/api/record_click", json={"random_key": random_key, "click_number": i, "x": x, "y": y})
+    return random_key
+
+
+def calc_distance(app, client, random_key):
+    start = time.perf_counter()
+    data = client.post("/api/calc_distance",
+                       json={"random_key": random_key, "char1": "Mario", "char2": "Link"}).get_json()
+    if data["job_id"]:
+        app.llm_jobs.wait(data["job_id"], timeout=60)
+    return time.perf_counter() - start, data["cached"]
+
+
+def bench_tiers(requests):
+    from response_cache import ResponseCache, situation_key
+    workdir = common.make_workdir()
+    cache = ResponseCache(db_path=os.path.join(workdir, "llm_cache.db"))
+    keys = [situation_key({"distance": d / 10}) for d in range(requests)]
+    for key in keys:
+        cache.set(key, "回答" * 200)
+
+    samples = []
+    for key in keys:
+        start = time.perf_counter()
+        cache.get(key)
+        samples.append(time.perf_counter() - start)
+    memory = common.summarize(samples)
+
+    # 再起動後を想定して memory 段だけ空にする
+    disk_only = ResponseCache(db_path=cache.disk.db_path)
+    samples = []
+    for key in keys:
+        start = time.perf_counter()
+        disk_only.get(key)
+        samples.append(time.perf_counter() - start)
+    disk = common.summarize(samples)
+    print(f"  memory 段 get p50={memory['p50_ms']:.3f}ms p99={memory['p99_ms']:.3f}ms")
+    print(f"  sqlite 段 get p50={disk['p50_ms']:.3f}ms p99={disk['p99_ms']:.3f}ms "
+          f"(ヒット率 {disk_only.metrics()['hit_ratio']:.2f})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="状況分析キャッシュのベンチマーク")
+    parser.add_argument("--latency", type=float, default=1.0, help="fake モデルの疑似レイテンシ (秒)")
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    os.environ["GEMINI_BACKEND"] = "fake"
+    os.environ["GEMINI_FAKE_LATENCY"] = str(args.latency)
+    workdir = common.make_workdir()
+    common.build_sample_db(workdir)
+    app = common.import_app(workdir)
+    client = app.app.test_client()
+
+    capture = make_capture()
+    random_key = upload(client, capture)
+    miss, cached = calc_distance(app, client, random_key)
+    assert not cached
+    samples = []
+    for _ in range(args.requests):
+        elapsed, cached = calc_distance(app, client, random_key)
+        assert cached
+        samples.append(elapsed)
+    hit = common.summarize(samples)
+    print("/api/calc_distance")
+    print(f"  キャッシュミス (Gemini 疑似 {args.latency:.1f}s 込み) {miss * 1000:.1f}ms")
+    print(f"  キャッシュヒット p50={hit['p50_ms']:.2f}ms p95={hit['p95_ms']:.2f}ms p99={hit['p99_ms']:.2f}ms")
+
+    # 縮小 + 低画質で再エンコードした同じ場面 → 知覚ハッシュが同じなのでヒットする
+    resized = capture.resize((1280, 720))
+    random_key = upload(client, resized.resize((1920, 1080)), quality=60)
+    _, cached = calc_distance(app, client, random_key)
+    print(f"  再エンコードした同じ場面: {'ヒット' if cached else 'ミス'}")
+
+    stats = client.get("/api/session_stats").get_json()["situation_cache"]
+    print(f"  hit_ratio={stats['hit_ratio']:.3f} memory_hits={stats['memory_hits']} "
+          f"disk_hits={stats['disk_hits']} misses={stats['misses']}")
+
+    print("ResponseCache.get")
+    bench_tiers(args.requests)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+bench_session_store.py
+
+session_store.py の負荷試験。
+
+1) SQLiteSessionStore を複数プロセスで共有し、同じセッションへ同時に record_click 相当の
+   update を投げても 1 件も取りこぼさないことと、ops/sec を確認する
+2) MemorySessionStore に上限を超える件数・バイト数を入れ、TTL / 容量超過で
+   削除された件数 (metrics) と保持量が上限内に収まることを確認する
+
+【実行例】
+  python benchmarks/bench_session_store.py --processes 1 4 8 --ops 500
+"""
+
+import argparse
+import multiprocessing
+import os
+import time
+
+import common
+from session_store import MemorySessionStore, SQLiteSessionStore
+
+N_SESSIONS = 8
+
+
+def _worker(db_path, worker_id, ops):
+    store = SQLiteSessionStore("clicks", db_path=db_path)
+    latencies = []
+    for i in range(ops):
+        key = f"session{i % N_SESSIONS}"
+        click = {"click_number": i, "x": worker_id, "y": i}
+        start = time.perf_counter()
+        store.update(key, lambda record: {**record, "clicks": record["clicks"] + [click]})
+        store.get(key)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def bench_sqlite(processes, ops, workdir):
+    db_path = os.path.join(workdir, f"sessions_{processes}.db")
+    store = SQLiteSessionStore("clicks", db_path=db_path)
+    for s in range(N_SESSIONS):
+        store.set(f"session{s}", {"clicks": [], "image_payload": {"data": b"\0" * 100_000}})
+
+    start = time.perf_counter()
+    with multiprocessing.Pool(processes) as pool:
+        results = pool.starmap(_worker, [(db_path, w, ops) for w in range(processes)])
+    elapsed = time.perf_counter() - start
+
+    total = sum(len(store.get(f"session{s}")["clicks"]) for s in range(N_SESSIONS))
+    assert total == processes * ops, (total, processes * ops)
+    latencies = [lat for worker in results for lat in worker]
+    summary = common.summarize(latencies)
+    print(f"  processes={processes:2d} update+get p50={summary['p50_ms']:.2f}ms "
+          f"p95={summary['p95_ms']:.2f}ms p99={summary['p99_ms']:.2f}ms "
+          f"{processes * ops / elapsed:.0f} ops/s (クリック {total} 件すべて保存)")
+
+
+def bench_memory_caps():
+    store = MemorySessionStore("clicks", ttl_seconds=3600, max_entries=200, max_bytes=10 * 1024 * 1024)
+    payload = b"\0" * 100_000
+    start = time.perf_counter()
+    for i in range(2000):
+        store.set(f"session{i}", {"clicks": [], "image_payload": {"data": payload}})
+        store.update(f"session{i}", lambda record: {**record, "clicks": record["clicks"] + [{"x": 1, "y": 2}]})
+    elapsed = time.perf_counter() - start
+    m = store.metrics()
+    assert m["bytes"] <= 10 * 1024 * 1024 and m["entries"] <= 200
+    print(f"  容量上限: 2000 件投入 → entries={m['entries']} bytes={m['bytes']} "
+          f"capacity_evictions={m['capacity_evictions']} ({4000 / elapsed:.0f} ops/s)")
+
+    store = MemorySessionStore("clicks", ttl_seconds=0.05, max_entries=1000)
+    for i in range(100):
+        store.set(f"session{i}", {"clicks": []})
+    time.sleep(0.1)
+    store.set("fresh", {"clicks": []})
+    m = store.metrics()
+    assert m["entries"] == 1
+    print(f"  TTL: 100 件が期限切れ → entries={m['entries']} expired_evictions={m['expired_evictions']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="セッションストアの負荷試験")
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--ops", type=int, default=300)
+    args = parser.parse_args()
+
+    workdir = common.make_workdir()
+    print("SQLiteSessionStore (複数プロセス共有)")
+    for processes in args.processes:
+        bench_sqlite(processes, args.ops, workdir)
+    print("MemorySessionStore (LRU + TTL)")
+    bench_memory_caps()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+bench_streaming.py
+
+Gemini の回答のストリーミング (/api/jobs/<id>/stream) の効果を測る。GEMINI_BACKEND=fake で、
+fake モデルは生成時間 (GEMINI_FAKE_LATENCY) を回答の断片に均等に割り振って返す。
+
+/api/chat と /api/calc_distance のそれぞれについて、リクエスト送信から
+  - 最初の token イベントを受け取るまで (TTFB。ストリーミングでユーザーが待つ時間)
+  - done イベントを受け取るまで (以前の実装でユーザーが待っていた時間)
+を計測する。サーバー側で記録した ttfb_ms (ジョブ受け付け〜最初の断片) も表示する。
+
+【実行例】
+  python benchmarks/bench_streaming.py --latency 2.0 --requests 10
+"""
+
+import argparse
+import json
+import os
+import time
+
+import common
+from bench_response_cache import make_capture, upload
+
+
+def read_stream(client, job_id, start):
+    """SSE を読み、(最初の token までの秒数, done までの秒数, done のデータ) を返す"""
+    res = client.get(f"/api/jobs/{job_id}/stream", buffered=False)
+    first = None
+    for data in res.response:
+        text = data.decode("utf-8") if isinstance(data, bytes) else data
+        if text.startswith("event: token") and first is None:
+            first = time.perf_counter() - start
+        if text.startswith("event: done"):
+            done = time.perf_counter() - start
+            return first, done, json.loads(text.split("data: ", 1)[1])
+        if text.startswith("event: failed"):
+            raise RuntimeError(text)
+    raise RuntimeError("done イベントを受け取れませんでした")
+
+
+def report(name, rows):
+    ttfb = common.summarize([r[0] for r in rows])
+    done = common.summarize([r[1] for r in rows])
+    server = sorted(r[2]["ttfb_ms"] for r in rows)
+    print(f"{name}")
+    print(f"  最初の断片まで (TTFB) p50={ttfb['p50_ms']:.0f}ms p95={ttfb['p95_ms']:.0f}ms "
+          f"(サーバー側 ttfb_ms p50={server[len(server) // 2]:.0f}ms)")
+    print(f"  回答全体まで           p50={done['p50_ms']:.0f}ms p95={done['p95_ms']:.0f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ストリーミング応答のベンチマーク")
+    parser.add_argument("--latency", type=float, default=2.0, help="fake モデルの生成時間 (秒)")
+    parser.add_argument("--requests", type=int, default=10)
+    args = parser.parse_args()
+
+    os.environ["GEMINI_BACKEND"] = "fake"
+    os.environ["GEMINI_FAKE_LATENCY"] = str(args.latency)
+    # 同じ状況がキャッシュから返らないようにする
+    os.environ["LLM_CACHE_TIERS"] = ""
+    workdir = common.make_workdir()
+    common.build_sample_db(workdir)
+    app = common.import_app(workdir)
+    client = app.app.test_client()
+
+    random_key = upload(client, make_capture())
+    rows = []
+    for i in range(args.requests):
+        start = time.perf_counter()
+        job_id = client.post("/api/chat", json={"conversation_id": f"bench{i}", "message": "崖際の攻め方は？"}).get_json()["job_id"]
+        rows.append(read_stream(client, job_id, start))
+    report("/api/chat", rows)
+
+    rows = []
+    for _ in range(args.requests):
+        start = time.perf_counter()
+        job_id = client.post("/api/calc_distance",
+                             json={"random_key": random_key, "char1": "Mario", "char2": "Link"}).get_json()["job_id"]
+        rows.append(read_stream(client, job_id, start))
+    report("/api/calc_distance", rows)
+
+
+if __name__ == "__main__":
+    main()
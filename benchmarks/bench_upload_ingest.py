@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+bench_upload_ingest.py
+
+画像アップロード (POST /) の取り込みの、大きな入力でのレイテンシとメモリのベンチマーク。
+
+- raw    : 以前の index() と同じく、元のファイルをそのまま保存 -> 全体をデコード -> マス目描画・位置の自動検出・
+           Gemini 送信用データを元の大きさで作る
+- ingest : ingest.py (draft() で縮小デコード -> 向きの補正 -> INGEST_MAX_SIDE に縮小 -> 作業用のコピー) の後に同じ処理
+
+入力は 12MP (4000x3000) の JPEG / PNG と 4K の JPEG (スマホで撮った TV の写真を想定)。
+メモリは方式ごとに別プロセスで測る (Pillow の画像バッファは tracemalloc に出ないので、最大 RSS の増分を使う)。
+あわせてアプリ全体 (test_client で POST /) のレイテンシと、保存されるファイルの大きさを出す
+(アプリは同じ画像を 1 回しか保存・描画しないので、POST / の数字は 2 回目以降のアップロードを含む)。
+
+【実行例】
+  python benchmarks/bench_upload_ingest.py --repeat 5
+"""
+
+import argparse
+import io
+import json
+import os
+import random
+import re
+import resource
+import subprocess
+import sys
+import time
+
+from PIL import Image
+
+import common
+from bench_position_detector import synthetic_frame
+
+INPUTS = {
+    "12MP JPEG": ((4000, 3000), "JPEG"),
+    "12MP PNG": ((4000, 3000), "PNG"),
+    "4K JPEG": ((3840, 2160), "JPEG"),
+}
+
+
+def make_input(workdir, name, size, image_format):
+    path = os.path.join(workdir, re.sub(r"\W", "_", name) + "." + image_format.lower())
+    if not os.path.exists(path):
+        img, _ = synthetic_frame(random.Random(0))
+        img.resize(size, Image.BICUBIC).save(path, format=image_format, quality=92)
+    return path
+
+
+def process_raw(path, workdir):
+    """以前の index(): 元のファイルを保存して全体をデコードし、元の大きさのまま使う"""
+    from app import encode_image_payload
+    from draw_grid import draw_grid_with_relative_coords
+    from position_detector import detect_positions
+
+    ext = os.path.splitext(path)[1]
+    input_path = os.path.join(workdir, f"raw_input{ext}")
+    with open(path, "rb") as src, open(input_path, "wb") as dst:
+        dst.write(src.read())
+    # 以前の app.load_upload と同じく、元の大きさのまま全体をデコードする
+    with Image.open(input_path) as decoded:
+        decoded.load()
+        img = decoded.convert("RGB") if decoded.mode != "RGB" else decoded.copy()
+    output_path = os.path.join(workdir, f"raw_output{ext}")
+    draw_grid_with_relative_coords(input_path, output_path, 33, 16, 347, image=img)
+    detect_positions(img)
+    encode_image_payload(img)
+    return input_path, output_path
+
+
+def process_ingest(path, workdir):
+    """ingest.py で作業用のコピーを作ってから同じ処理をする"""
+    from app import encode_image_payload
+    from draw_grid import draw_grid_with_relative_coords
+    from image_store import ImageStore
+    from ingest import ingest_upload
+    from position_detector import detect_positions
+
+    # 毎回書き込むよう、保存先は空のフォルダにする (同じ画像の 2 回目以降は書き込みが省かれるため)
+    store = ImageStore(common.make_workdir("ssbu_bench_store_"))
+    with open(path, "rb") as f:
+        upload = ingest_upload(f, store)
+    output_path = os.path.join(workdir, "ingest_output" + os.path.splitext(upload.path)[1])
+    draw_grid_with_relative_coords(upload.path, output_path, 33, 16, 347, image=upload.image)
+    detect_positions(upload.image)
+    encode_image_payload(upload.image)
+    return upload.path, output_path
+
+
+PROCESSES = {"raw": process_raw, "ingest": process_ingest}
+
+
+def worker(mode, path, workdir, repeat):
+    """別プロセスで 1 方式を測り、JSON で結果を出力する"""
+    common.import_app(workdir)
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        stored = PROCESSES[mode](path, workdir)
+        samples.append(time.perf_counter() - start)
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({
+        "timing": common.summarize(samples),
+        "rss_mb": (peak_kb - baseline_kb) / 1024,
+        "stored_kb": sum(os.path.getsize(p) for p in stored) / 1024,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="アップロード画像の取り込みのベンチマーク")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--worker", nargs=3, metavar=("MODE", "PATH", "WORKDIR"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        worker(*args.worker, args.repeat)
+        return
+
+    workdir = common.make_workdir()
+    common.build_sample_db(workdir)
+    for name, (size, image_format) in INPUTS.items():
+        path = make_input(workdir, name, size, image_format)
+        print(f"{name} ({os.path.getsize(path) / 2**20:.1f}MB)")
+        for mode in PROCESSES:
+            out = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--repeat", str(args.repeat), "--worker", mode, path, workdir],
+                capture_output=True, text=True, check=True
+            ).stdout
+            result = json.loads(out.strip().splitlines()[-1])
+            timing = result["timing"]
+            print(f"  {mode:<7} p50={timing['p50_ms']:.0f}ms p95={timing['p95_ms']:.0f}ms  "
+                  f"最大 RSS +{result['rss_mb']:.0f}MB  保存 {result['stored_kb']:.0f}KB")
+
+    # アプリ全体 (POST /)
+    app = common.import_app(workdir)
+    client = app.app.test_client()
+    for name, (size, image_format) in INPUTS.items():
+        with open(make_input(workdir, name, size, image_format), "rb") as f:
+            data = f.read()
+        samples = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            response = client.post("/", data={"image_file": (io.BytesIO(data), "upload." + image_format.lower())},
+                                   content_type="multipart/form-data")
+            samples.append(time.perf_counter() - start)
+            assert response.status_code == 200
+        timing = common.summarize(samples)
+        print(f"POST / {name}: p50={timing['p50_ms']:.0f}ms p95={timing['p95_ms']:.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
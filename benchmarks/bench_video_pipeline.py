@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+bench_video_pipeline.py
+
+動画解析パイプライン (video_pipeline.py) のベンチマーク。
+
+bench_position_detector の合成画面を数フレームごとに切り替えたアニメーション画像 (PIL バックエンドで読む) を
+長さを変えて作り、
+- 解析したフレーム数 / 秒 (デコード・位置検出・マス目・推奨行動込み)
+- キーフレーム数とコメント数 (コメントは一定時間待つだけのダミー)
+- tracemalloc のピークメモリ (動画が長くなっても増えないこと)
+を測る。
+
+【実行例】
+  python benchmarks/bench_video_pipeline.py --lengths 20 80 --scene-frames 4
+"""
+
+import argparse
+import os
+import random
+import time
+import tracemalloc
+
+from PIL import Image
+
+import common
+from bench_position_detector import synthetic_frame
+from move_index import MoveIndex
+from video_pipeline import VideoPipeline
+
+FRAME_SIZE = (960, 540)
+FRAME_MS = 100
+
+
+def build_video(path, n_frames, scene_frames, seed=0):
+    """scene_frames フレームごとに両者の位置が変わる n_frames フレームのアニメーション GIF を作る"""
+    rng = random.Random(seed)
+    scenes = [synthetic_frame(rng)[0].resize(FRAME_SIZE, Image.BILINEAR)
+              for _ in range((n_frames + scene_frames - 1) // scene_frames)]
+    frames = []
+    for i in range(n_frames):
+        # 同じ画像が続くと GIF では 1 フレームにまとめられるので、フレームごとに隅の四角の明るさを変える
+        frame = scenes[i // scene_frames].copy()
+        frame.paste((0, 0, 0) if i % 2 else (255, 255, 255), (0, 0, 8, 8))
+        frames.append(frame)
+    frames[0].save(path, save_all=True, append_images=frames[1:], duration=FRAME_MS, loop=0)
+
+
+def slow_commentator(delay):
+    def commentator(situation_text, image_payload):
+        time.sleep(delay)
+        return f"({len(situation_text)} 文字の状況へのコメント)"
+    return commentator
+
+
+def main():
+    parser = argparse.ArgumentParser(description="動画解析パイプラインのベンチマーク")
+    parser.add_argument("--lengths", type=int, nargs="+", default=[20, 80], help="動画のフレーム数")
+    parser.add_argument("--scene-frames", type=int, default=4, help="何フレームごとに位置が変わるか")
+    parser.add_argument("--fps", type=float, default=10, help="1 秒あたりに解析するフレーム数")
+    parser.add_argument("--comment-delay", type=float, default=0.05, help="ダミーのコメント 1 件の時間 (秒)")
+    args = parser.parse_args()
+
+    workdir = common.make_workdir()
+    db_path = common.build_sample_db(workdir)
+    move_index = MoveIndex(db_path)
+
+    for n_frames in args.lengths:
+        path = os.path.join(workdir, f"match_{n_frames}.gif")
+        build_video(path, n_frames, args.scene_frames)
+        pipeline = VideoPipeline(move_index, 1, 2, sample_fps=args.fps, min_keyframe_interval=0,
+                                 commentator=slow_commentator(args.comment_delay), backend="pil")
+        tracemalloc.start()
+        comments = 0
+        for event in pipeline.run(path):
+            comments += event["type"] == "commentary"
+            summary = event
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"{n_frames} フレーム ({FRAME_SIZE[0]}x{FRAME_SIZE[1]} GIF): 解析 {summary['frames']} "
+              f"(検出 {summary['detected']}) {summary['frames_per_second']} フレーム/秒  "
+              f"キーフレーム {summary['keyframes']} コメント {comments}  ピークメモリ {peak / 2**20:.1f}MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+common.py
+
+ベンチマーク共通のヘルパー。
+
+- cloud-run/ と smash-analyzer/backend/ を import パスに追加する
+- character.py のスキーマで合成 smash_characters.db を作る (Mario/Link + ダミーキャラ)
+- GOOGLE_API_KEY をダミー値にして app.py をオフラインで import する
+- レイテンシのパーセンタイル集計
+"""
+
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLOUD_RUN_DIR = os.path.join(ROOT_DIR, "cloud-run")
+BACKEND_DIR = os.path.join(ROOT_DIR, "smash-analyzer", "backend")
+
+# app.py / draw_grid.py は cloud-run/ 側を優先し、backend/ は character.py 等のためだけに追加する
+if CLOUD_RUN_DIR not in sys.path:
+    sys.path.insert(0, CLOUD_RUN_DIR)
+if BACKEND_DIR not in sys.path:
+    sys.path.append(BACKEND_DIR)
+
+# 技テーブルの各カラムに入れる値の範囲 (カラム名の接尾辞ごと)
+_VALUE_RANGES = {
+    "_x": (2, 120),
+    "_y": (1, 60),
+    "_damage": (0, 25),
+    "_startup": (1, 30),
+    "_weapon": (0, 1),
+    "_tobi": (0, 1),
+}
+# throw_moves / dash_moves は接尾辞なしのカラム名
+_PLAIN_COLUMNS = {"x": "_x", "y": "_y", "damage": "_damage", "startup": "_startup", "weapon": "_weapon"}
+
+MOVE_TABLES = ["B_moves", "air_moves", "dash_moves", "kyou_zyaku_moves", "smash_moves", "throw_moves"]
+
+
+def _value_for(column, rng):
+    suffix = _PLAIN_COLUMNS.get(column)
+    if suffix is None:
+        suffix = next((s for s in _VALUE_RANGES if column.endswith(s)), None)
+    if suffix is None:
+        return None
+    low, high = _VALUE_RANGES[suffix]
+    if suffix in ("_weapon", "_tobi"):
+        return rng.randint(low, high)
+    if suffix == "_damage":
+        return round(rng.uniform(low, high), 1)
+    return rng.randint(low, high)
+
+
+def build_sample_db(directory, n_characters=2, seed=0):
+    """
+    directory/smash_characters.db を character.py のスキーマで作成し、
+    Mario (id=1) / Link (id=2) の実データと、id=3以降の合成キャラを登録する。
+
+    Returns:
+        str: 作成したDBファイルのパス
+    """
+    import character
+    import link
+    import mario
+
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        db_path = os.path.join(directory, "smash_characters.db")
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        character.create_smash_db()
+        for module, insert_character in ((mario, mario.insert_mario_data), (link, link.insert_link_data)):
+            insert_character()
+            module.insert_B_moves()
+            module.insert_tilt_moves()
+            module.insert_smash_moves()
+            module.insert_air_moves()
+            module.insert_dash_moves()
+            module.insert_throw_moves()
+    finally:
+        os.chdir(cwd)
+
+    rng = random.Random(seed)
+    conn = sqlite3.connect(db_path)
+    try:
+        for character_id in range(3, n_characters + 1):
+            conn.execute(
+                "INSERT INTO characters (id, name, size_x, size_y, weight) VALUES (?, ?, ?, ?, ?)",
+                (character_id, f"Fighter{character_id:03d}", rng.randint(4, 12), rng.randint(8, 24), rng.randint(70, 135)),
+            )
+            for table in MOVE_TABLES:
+                columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")
+                           if row[1] not in ("id", "character_id")]
+                values = [_value_for(col, rng) for col in columns]
+                placeholders = ", ".join("?" for _ in range(len(columns) + 1))
+                conn.execute(
+                    f"INSERT INTO {table} (character_id, {', '.join(columns)}) VALUES ({placeholders})",
+                    [character_id] + values,
+                )
+        conn.commit()
+    finally:
+        conn.close()
+    return db_path
+
+
+def make_workdir(prefix="ssbu_bench_"):
+    return tempfile.mkdtemp(prefix=prefix)
+
+
+def import_app(workdir):
+    """
+    workdir をカレントにした状態で app.py を import する (DB_PATH は相対パスのため)。
+    Gemini には接続しないので API キーはダミーでよい。
+    """
+    os.environ.setdefault("GOOGLE_API_KEY", "benchmark-dummy-key")
+    os.chdir(workdir)
+    import app
+    return app
+
+
+def percentile(samples, p):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    k = (len(ordered) - 1) * p / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def summarize(samples_sec):
+    """秒単位のサンプル列を ms 単位の p50/p95/p99 に集計する"""
+    return {
+        "n": len(samples_sec),
+        "p50_ms": percentile(samples_sec, 50) * 1000,
+        "p95_ms": percentile(samples_sec, 95) * 1000,
+        "p99_ms": percentile(samples_sec, 99) * 1000,
+    }
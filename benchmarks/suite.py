@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+suite.py
+
+バックエンドの主な処理をまとめて測る、オフラインで決定的なベンチマーク。
+個別の bench_*.py は 1 つの改善の前後を比べるためのもの、こちらは同じ条件で毎回流して退行を見つけるためのもの。
+
+- draw_grid   : draw_grid_with_relative_coords (cloud-run の PIL / NumPy エンジン、backend 版) を
+                解像度 × マス目の大きさごとに。オーバーレイキャッシュなし (毎回描画) とあり (2 回目以降) の両方
+- recommend   : recommend_actions + get_top5_moves と MoveIndex.top_moves を、キャラ数 (ロスター) ごとの
+                合成 DB (character.py のスキーマ) で
+- calc_distance : POST /api/calc_distance (Gemini は GEMINI_BACKEND=fake) のレスポンスまでと、
+                  ジョブのストリームが done になるまで
+
+入力 (画像・DB・クリック位置・キャラと距離) はすべて固定の乱数の種から作るので、何度流しても同じ処理を測る。
+結果はケースごとの p50/p95/p99 (ms) と throughput (ops/sec) で、--json で JSON に書き出す。
+--baseline で保存済みの結果と比べ、p50 が --threshold の割合以上遅くなったケースがあれば終了コード 1 を返す。
+数字は実行するマシンに依存するので、baseline.json は比べるマシンで --save-baseline して作り直すこと。
+
+【実行例】
+  python benchmarks/suite.py --quick --baseline benchmarks/baseline.json
+  python benchmarks/suite.py --only recommend calc_distance --json /tmp/result.json
+  python benchmarks/suite.py --quick --save-baseline benchmarks/baseline.json
+"""
+
+import argparse
+import gc
+import io
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+# app.py の import 前に設定する: Gemini はネットワークに出ない fake、遅延なし。
+# 回答のキャッシュは 2 回目以降ヒットしてしまうので無効、images/ の見直しスレッドも止める
+os.environ["GEMINI_BACKEND"] = "fake"
+os.environ["GEMINI_FAKE_LATENCY"] = "0"
+os.environ["GEMINI_FAKE_LATENCY_PER_KCHAR"] = "0"
+os.environ["LLM_CACHE_TIERS"] = ""
+os.environ["IMAGE_STORE_SWEEP_INTERVAL"] = "0"
+# 応答までの計測ではジョブを待たずに次々投入するので、待ち行列の上限で 429 にならないようにする
+os.environ["LLM_MAX_PENDING"] = "1024"
+
+from PIL import Image
+
+import common
+from bench_draw_grid import load_backend_draw_grid, make_capture
+
+SUITES = ("draw_grid", "recommend", "calc_distance")
+
+# (通常, --quick)
+DRAW_GRID_SIZES = (["1280x720", "1920x1080", "3840x2160"], ["1280x720", "1920x1080"])
+# (columns, rows, origin_cell)。33x16 / 347 がアプリのデフォルト
+DRAW_GRID_GRIDS = ([(17, 8, 93), (33, 16, 347), (66, 32, 1089)], [(17, 8, 93), (33, 16, 347)])
+ROSTER_SIZES = ([2, 20, 87], [2, 20])
+REPEAT = (15, 5)
+RECOMMEND_QUERIES = (300, 100)
+CALC_DISTANCE_REQUESTS = (150, 40)
+
+# 退行とみなす p50 の差の下限 (ms)。これより短い差は計測の揺れとして扱う
+MIN_REGRESSION_MS = 0.1
+
+
+###############################################################################
+# 計測
+###############################################################################
+def measure(fn, inputs, warmup=2, rounds=5):
+    """
+    inputs の各要素で fn を呼び、1 回ごとの時間を集計する。
+    inputs 全体を rounds 回繰り返し、p50 が最も短い回を使う (timeit と同じく、他のプロセスなどによる揺れを除くため)。
+
+    Returns:
+        dict: common.summarize の結果 + ops_per_sec
+    """
+    for args in inputs[:warmup]:
+        fn(*args)
+    best = None
+    for _ in range(rounds):
+        gc.collect()
+        samples = []
+        total_start = time.perf_counter()
+        for args in inputs:
+            start = time.perf_counter()
+            fn(*args)
+            samples.append(time.perf_counter() - start)
+        total = time.perf_counter() - total_start
+        result = common.summarize(samples)
+        result["ops_per_sec"] = len(samples) / total if total > 0 else 0.0
+        if best is None or result["p50_ms"] < best["p50_ms"]:
+            best = result
+    return best
+
+
+def bench_draw_grid(workdir, quick):
+    import draw_grid as cloud_run_draw_grid
+
+    backend_draw_grid = load_backend_draw_grid()
+    variants = (
+        ("pil", cloud_run_draw_grid, {"engine": "pil"}),
+        ("numpy", cloud_run_draw_grid, {"engine": "numpy"}),
+        ("backend", backend_draw_grid, {"show": False}),
+    )
+    repeat = REPEAT[quick]
+    results = {}
+    for size in DRAW_GRID_SIZES[quick]:
+        width, height = (int(v) for v in size.split("x"))
+        input_path = os.path.join(workdir, f"capture_{size}.jpg")
+        output_path = os.path.join(workdir, f"output_{size}.jpg")
+        make_capture(input_path, width, height)
+        for columns, rows, origin_cell in DRAW_GRID_GRIDS[quick]:
+            for name, module, kwargs in variants:
+                def draw(cold, module=module, kwargs=kwargs):
+                    if cold:
+                        module.clear_overlay_cache()
+                    module.draw_grid_with_relative_coords(
+                        image_path=input_path, output_path=output_path,
+                        columns=columns, rows=rows, origin_cell=origin_cell, **kwargs
+                    )
+                for label, cold in (("cold", True), ("warm", False)):
+                    key = f"draw_grid/{name}/{size}/{columns}x{rows}/{label}"
+                    results[key] = measure(draw, [(cold,)] * repeat, warmup=1)
+                    report(key, results[key])
+    return results
+
+
+def bench_recommend(workdir, quick):
+    from app import get_top5_moves, recommend_actions
+    from move_index import BOARD_COLUMNS, BOARD_ROWS, MoveIndex
+
+    results = {}
+    for roster in ROSTER_SIZES[quick]:
+        db_dir = os.path.join(workdir, f"roster_{roster}")
+        os.makedirs(db_dir, exist_ok=True)
+        db_path = common.build_sample_db(db_dir, n_characters=roster)
+        rng = random.Random(roster)
+        queries = [(rng.randint(1, roster), rng.randint(1, 60)) for _ in range(RECOMMEND_QUERIES[quick])]
+
+        key = f"recommend/recommend_actions/roster={roster}"
+        results[key] = measure(lambda cid, d: recommend_actions(db_path, cid, d), queries)
+        report(key, results[key])
+
+        key = f"recommend/get_top5_moves/roster={roster}"
+        results[key] = measure(lambda cid, d: get_top5_moves(recommend_actions(db_path, cid, d)), queries)
+        report(key, results[key])
+
+        index = MoveIndex(db_path)
+        offsets = [(cid, rng.randint(-BOARD_COLUMNS + 1, BOARD_COLUMNS - 1), rng.randint(-BOARD_ROWS + 1, BOARD_ROWS - 1))
+                   for cid, _ in queries]
+        key = f"recommend/move_index_top_moves/roster={roster}"
+        results[key] = measure(index.top_moves, offsets)
+        report(key, results[key])
+    return results
+
+
+def bench_calc_distance(workdir, quick):
+    import app
+    from bench_position_detector import synthetic_frame
+
+    client = app.app.test_client()
+    buf = io.BytesIO()
+    synthetic_frame(random.Random(0))[0].save(buf, "JPEG", quality=90)
+    page = client.post("/", data={"image_file": (io.BytesIO(buf.getvalue()), "capture.jpg")},
+                       content_type="multipart/form-data").get_data(as_text=True)
+    template_key = page.split('const randomKey = "', 1)[1].split('"', 1)[0]
+    template = app.click_data_storage.get(template_key)
+    width, height = template["width"], template["height"]
+
+    # リクエストごとに別のセッションを作り、クリック位置を変える (同じ位置だと同じ状況の繰り返しになるため)
+    rng = random.Random(1)
+    requests = []
+    for i in range(CALC_DISTANCE_REQUESTS[quick] + 2):
+        key = f"bench{i:05d}"
+        clicks = [{"click_number": n, "x": rng.uniform(0, width - 1), "y": rng.uniform(0, height - 1)} for n in (1, 2)]
+        app.click_data_storage.set(key, {**template, "clicks": clicks})
+        app.conversation_history.set(key, app.new_conversation())
+        requests.append(({"random_key": key, "char1": "Mario", "char2": "Link"},))
+
+    def post(body):
+        response = client.post("/api/calc_distance", json=body)
+        assert response.status_code == 200, response.get_data(as_text=True)
+        return response.get_json()
+
+    def post_and_stream(body):
+        job_id = post(body)["job_id"]
+        events = client.get(f"/api/jobs/{job_id}/stream").get_data(as_text=True)
+        assert "event: done" in events, events
+
+    results = {}
+    key = "calc_distance/response"
+    jobs = []
+    results[key] = measure(lambda body: jobs.append(post(body)["job_id"]), requests)
+    report(key, results[key])
+    # 後の計測に影響しないよう、投入したジョブが終わるのを待つ
+    for job_id in jobs:
+        client.get(f"/api/jobs/{job_id}/stream").get_data()
+
+    key = "calc_distance/until_done"
+    results[key] = measure(post_and_stream, requests)
+    report(key, results[key])
+    return results
+
+
+BENCHMARKS = {
+    "draw_grid": bench_draw_grid,
+    "recommend": bench_recommend,
+    "calc_distance": bench_calc_distance,
+}
+
+
+###############################################################################
+# 出力と比較
+###############################################################################
+def report(key, result):
+    print(f"  {key:<52} p50={result['p50_ms']:9.3f}ms p95={result['p95_ms']:9.3f}ms "
+          f"p99={result['p99_ms']:9.3f}ms {result['ops_per_sec']:10.1f} ops/s", flush=True)
+
+
+def compare(results, baseline, threshold):
+    """
+    baseline と比べて p50 が threshold の割合以上 (かつ MIN_REGRESSION_MS 以上) 遅くなったケースを返す。
+    片方にしかないケースは比べない。
+    """
+    regressions = []
+    for key, result in results.items():
+        base = baseline.get(key)
+        if base is None:
+            continue
+        ratio = result["p50_ms"] / base["p50_ms"] if base["p50_ms"] > 0 else float("inf")
+        if ratio > 1 + threshold and result["p50_ms"] - base["p50_ms"] > MIN_REGRESSION_MS:
+            regressions.append((key, base["p50_ms"], result["p50_ms"], ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="バックエンドの主な処理のベンチマーク (オフライン・決定的)")
+    parser.add_argument("--quick", action="store_true", help="ケースと回数を減らす")
+    parser.add_argument("--only", nargs="+", choices=SUITES, default=list(SUITES))
+    parser.add_argument("--json", help="結果を書き出す JSON ファイル")
+    parser.add_argument("--baseline", help="比べる結果の JSON ファイル (--json / --save-baseline で作ったもの)")
+    parser.add_argument("--save-baseline", metavar="PATH", help="結果を baseline として保存する")
+    parser.add_argument("--threshold", type=float, default=0.25, help="p50 がこの割合以上遅くなったら退行とする")
+    args = parser.parse_args()
+    if args.baseline:
+        args.baseline = os.path.abspath(args.baseline)
+    for name in ("json", "save_baseline"):
+        if getattr(args, name):
+            setattr(args, name, os.path.abspath(getattr(args, name)))
+
+    # backend 版の draw_grid は show=False でも念のため表示しない
+    Image.Image.show = lambda self, *a, **k: None
+    workdir = common.make_workdir()
+    # app.py の DB (calc_distance 用) はアプリのデフォルトと同じ Mario / Link の 2 キャラ
+    common.build_sample_db(workdir)
+    common.import_app(workdir)
+
+    results = {}
+    for name in args.only:
+        print(name, flush=True)
+        results.update(BENCHMARKS[name](workdir, args.quick))
+
+    output = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "quick": args.quick,
+            "suites": args.only,
+        },
+        "results": results,
+    }
+    for path in (args.json, args.save_baseline):
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(output, f, ensure_ascii=False, indent=2, sort_keys=True)
+                f.write("\n")
+            print(f"結果を保存しました: {path}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline["meta"].get("quick") != args.quick:
+            print("注意: baseline と --quick の指定が違います (共通のケースだけ比べます)")
+        regressions = compare(results, baseline["results"], args.threshold)
+        compared = sum(1 for key in results if key in baseline["results"])
+        if regressions:
+            print(f"退行 {len(regressions)} / {compared} ケース (p50 が +{args.threshold:.0%} 以上):")
+            for key, before, after, ratio in regressions:
+                print(f"  {key}: {before:.3f}ms -> {after:.3f}ms (x{ratio:.2f})")
+            sys.exit(1)
+        print(f"退行なし ({compared} ケースを比較, しきい値 +{args.threshold:.0%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -25,29 +25,83 @@ app.py
 
 import os
 import io
+import json
 import uuid
 import sqlite3
+import tempfile
 
 from dotenv import load_dotenv
-from flask import Flask, request, render_template_string, jsonify, url_for
+from flask import Flask, Response, request, render_template_string, jsonify, url_for
 from PIL import Image
+import numpy as np
 import google.generativeai as genai
 
-# draw_grid.py からマス目描画関数をインポート
-from draw_grid import draw_grid_with_relative_coords
-
 ###############################################################################
 # .envの読み込み (GOOGLE_API_KEYなど)
+# 各モジュールは import 時に環境変数を読むので、先に読み込んでおく
 ###############################################################################
 load_dotenv()
+
+# draw_grid.py からマス目描画関数をインポート
+from draw_grid import DARKEN_ALPHA, draw_grid_with_relative_coords
+# session_store.py からセッションストアをインポート
+from session_store import MemorySessionStore, create_session_store
+# llm_jobs.py から Gemini 呼び出し用のジョブキューをインポート
+from llm_jobs import LLMJobQueue, JobQueueFull
+# gemini_pool.py から共有モデルプールをインポート
+from gemini_pool import ModelPool, GEMINI_BACKEND, GEMINI_MODEL_NAME, iter_text
+# response_cache.py から状況分析の回答キャッシュをインポート
+from response_cache import ResponseCache, image_dhash, situation_key
+# chat_context.py から対話コンテキスト (トークン予算・直近ウィンドウ・要約) の管理をインポート
+from chat_context import ChatContext, new_conversation, normalize as normalize_conversation
+# grid_geometry.py からピクセル座標 -> マス目の変換と、ブラウザで描くマス目の JSON をインポート
+from grid_geometry import cell_offset, grid_layout, locate_cell
+# position_detector.py からプレイヤー位置の自動検出をインポート
+from position_detector import detect_positions, positions_to_clicks
+# image_store.py から images/ フォルダの保存 (中身のハッシュの名前・容量の上限・作り直し) をインポート
+from image_store import ImageStore
+# ingest.py からアップロード画像の取り込み (縮小デコード・向きの補正・作業用のコピー) をインポート
+from ingest import IngestError, ingest_upload
+# video_pipeline.py から動画の解析パイプラインをインポート
+from video_pipeline import VIDEO_SAMPLE_FPS, VideoPipeline, gemini_commentator, supported_extensions
+# 動画解析のジョブ (LLM のジョブキューとは別のスレッドプールで実行し、結果はファイルに書き出す)
+from video_jobs import VideoJobs, queued_commentator
+# db_pool.py から読み込み専用の SQLite 接続プールをインポート
+from db_pool import get_pool
+# move_index.py から推奨行動インデックスをインポート
+from move_index import (
+    MoveIndex, MoveCandidate, TABLE_LABELS, attribute_column, move_name, select_top_moves
+)
+
 API_KEY = os.getenv("GOOGLE_API_KEY")
-if not API_KEY:
+if not API_KEY and GEMINI_BACKEND != "fake":
     raise ValueError("環境変数 GOOGLE_API_KEY が設定されていません (.env を確認してください)")
 
 ###############################################################################
 # Gemini API の初期化
+# モデルはプロセス全体で 1 つを共有し、起動時にクライアントまで作っておく
+###############################################################################
+if GEMINI_BACKEND != "fake":
+    genai.configure(api_key=API_KEY)
+gemini_models = ModelPool()
+
+###############################################################################
+# アップロード画像の読み込みと Gemini 送信用データの作成
+# (アップロード時に 1 回だけデコードし、以降のリクエストでは使い回す)
 ###############################################################################
-genai.configure(api_key=API_KEY)
+# Gemini に送る画像の長辺の上限 (px) と JPEG 品質
+GEMINI_IMAGE_MAX_SIDE = int(os.getenv("GEMINI_IMAGE_MAX_SIDE", "1024"))
+GEMINI_IMAGE_QUALITY = int(os.getenv("GEMINI_IMAGE_QUALITY", "85"))
+
+def encode_image_payload(img, max_side=GEMINI_IMAGE_MAX_SIDE, quality=GEMINI_IMAGE_QUALITY):
+    """
+    縮小して JPEG にエンコード済みの、generate_content にそのまま渡せる画像データを作る。
+    """
+    preview = img.copy()
+    preview.thumbnail((max_side, max_side))
+    buf = io.BytesIO()
+    preview.save(buf, format='JPEG', quality=quality)
+    return {"mime_type": "image/jpeg", "data": buf.getvalue()}
 
 ###############################################################################
 # Geminiのみを利用する ImageAnalyzer クラス
@@ -55,86 +109,181 @@ genai.configure(api_key=API_KEY)
 class ImageAnalyzer:
     def __init__(self):
         # ※ モデル名は環境に合わせて調整してください
-        self.gemini_model = genai.GenerativeModel('gemini-1.5-flash')
+        self.gemini_model = gemini_models.get(GEMINI_MODEL_NAME)
     
-    def analyze_with_gemini(self, image_path, prompt="この画像について詳しく説明してください。"):
-        img = Image.open(image_path)
+    def analyze_with_gemini(self, image_path, prompt="この画像について詳しく説明してください。", image_payload=None):
+        # アップロード時に作った image_payload があればファイルを開き直さない
+        img = image_payload if image_payload is not None else Image.open(image_path)
         response = self.gemini_model.generate_content([prompt, img])
         return response.text
 
+    def stream_with_gemini(self, image_path, prompt="この画像について詳しく説明してください。", image_payload=None):
+        # analyze_with_gemini と同じ内容を、生成された断片ごとに返す (GEMINI_STREAM=0 なら一括)
+        img = image_payload if image_payload is not None else Image.open(image_path)
+        return iter_text(self.gemini_model, [prompt, img])
+
     def comprehensive_analysis(self, image_path):
         gemini_description = self.analyze_with_gemini(image_path)
         return {'Geminiによる説明': gemini_description}
 
+# リクエストごとに作らず、この 1 つを使い回す
+image_analyzer = ImageAnalyzer()
+gemini_models.warmup()
+
 ###############################################################################
 # DBから推奨行動を取得する関数
 # 各テーブルの全行について、数値カラムで distance <= 値 のものを抽出
+# (リクエスト処理では同じ結果を返す MoveIndex.iter_recommend を使う)
 ###############################################################################
-def recommend_actions(db_path, character_id, distance):
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    
-    # テーブル名と日本語の対応付け
-    table_labels = {
-        "B_moves": "必殺技",
-        "air_moves": "空中攻撃",
-        "dash_moves": "ダッシュ攻撃",
-        "kyou_zyaku_moves": "通常攻撃",
-        "smash_moves": "スマッシュ攻撃",
-        "throw_moves": "投げ技"
-    }
-    
-    recommended = []
-    
-    for table, label in table_labels.items():
-        c.execute(f"SELECT * FROM {table} WHERE character_id=?", (character_id,))
-        rows = c.fetchall()
-        if not rows:
-            continue
-        
-        for row in rows:
-            for col in row.keys():
+RECOMMEND_SQL = {table: f"SELECT * FROM {table} WHERE character_id=?" for table in TABLE_LABELS}
+
+
+def iter_recommend_actions(db_path, character_id, distance):
+    """
+    distance <= 値 を満たす候補を MoveCandidate として 1 件ずつ返すジェネレータ。
+    辞書は作らないので、get_top5_moves と組み合わせればメモリは k 件分で済む。
+    """
+    # 接続はスレッドごとに使い回す (close しない)。SQL はテーブルごとに固定なのでコンパイル済みの文が再利用される
+    c = get_pool(db_path).connection().cursor()
+    c.row_factory = sqlite3.Row
+    for table, label in TABLE_LABELS.items():
+        c.execute(RECOMMEND_SQL[table], (character_id,))
+        for row in c.fetchall():
+            keys = row.keys()
+            for col in keys:
                 if col in ("id", "character_id"):
                     continue
-                
+
                 val = row[col]
                 if val is None or not isinstance(val, (int, float)):
                     continue
-                
+
                 if distance <= val:
-                    # 推奨行動に日本語ラベルを追加
-                    recommended.append({
-                        "カテゴリ": label,
-                        "行動": col,
-                        "適用距離": val
-                    })
+                    name = move_name(col)
+                    startup_col = attribute_column(name, "startup")
+                    damage_col = attribute_column(name, "damage")
+                    yield MoveCandidate(
+                        label, col, val,
+                        row[startup_col] if startup_col in keys else None,
+                        row[damage_col] if damage_col in keys else None
+                    )
 
-    conn.close()
 
-    
-    return recommended
+def recommend_actions(db_path, character_id, distance):
+    # 推奨行動に日本語ラベルを追加した辞書のリストを返す
+    return [c.to_dict() for c in iter_recommend_actions(db_path, character_id, distance)]
+
 
+def get_top5_moves(recommended, k=5, sort_key="range"):
+    """
+    推奨行動の上位 k 件を返す (デフォルトは「適用距離」の昇順で 5 件)。
+    全件ソートせず、サイズ k のヒープで選ぶ。
 
-def get_top5_moves(recommended_list):
-    # 推奨行動を「適用距離」で昇順にソート
-    sorted_list = sorted(recommended_list, key=lambda x: x.get("適用距離", float('inf')))
-    return sorted_list[:5]
+    Args:
+        recommended: iter_recommend_actions / MoveIndex.iter_recommend のジェネレータ、
+                     または recommend_actions のリスト
+        k (int): 件数
+        sort_key (str): "range" (適用距離) / "startup" (発生フレーム) / "damage" (ダメージ)
+    """
+    return select_top_moves(recommended, k=k, sort_key=sort_key)
 
 ###############################################################################
 # Flaskアプリ設定
 ###############################################################################
 app = Flask(__name__, static_folder="images")
 IMAGES_FOLDER = os.path.join(app.root_path, "images")
-os.makedirs(IMAGES_FOLDER, exist_ok=True)
+
+# images/ の中身は中身のハッシュの名前で保存し、合計サイズの上限を超えたら古いものから消す (IMAGE_STORE_* 環境変数)
+image_store = ImageStore(IMAGES_FOLDER)
+image_store.start_sweeper()
+
+# url_for('static', ...) の URL はそのまま使い、消された出力画像は要求されたときに作り直す
+_send_static_file = app.view_functions["static"]
+
+def send_image(filename):
+    image_store.ensure(filename)
+    return _send_static_file(filename=filename)
+
+app.view_functions["static"] = send_image
+
+def register_grid_image(input_name, columns, rows, origin_cell, line_color, line_width, heatmap=None, variant=None):
+    """
+    アップロード画像 input_name にマス目 (と heatmap) を描いた出力画像の名前を返し、作り方を image_store に登録する。
+    同じ画像・同じ設定なら同じ名前になる。variant は heatmap の中身を区別する文字列。
+    """
+    ext = os.path.splitext(input_name)[1]
+    name = image_store.derived_name(
+        input_name, ext, "grid", columns, rows, origin_cell, list(line_color), line_width, variant
+    )
+
+    def build(path, image=None):
+        draw_grid_with_relative_coords(
+            image_path=image_store.path(input_name),
+            output_path=path,
+            columns=columns,
+            rows=rows,
+            origin_cell=origin_cell,
+            line_color=tuple(line_color),
+            line_width=line_width,
+            image=image,
+            heatmap=heatmap
+        )
+
+    image_store.register(name, input_name, build)
+    return name
 
 DB_PATH = "smash_characters.db"
 
-# グローバルにクリック情報を管理する辞書
-click_data_storage = {}
+# 技データは起動時に一度だけ読み込んでおく (DBファイルが更新されたら自動で読み直す)
+move_index = MoveIndex(DB_PATH)
+
+# クリック情報を管理するセッションストア (random_keyをキーに)
+# SESSION_STORE=sqlite にすると複数ワーカーで共有できる。TTL・上限を超えた古いものは自動で削除
+click_data_storage = create_session_store("clicks")
+
+# Gemini に送る画像データ (縮小済み JPEG、100〜300KB) はクリックの記録とは別に、画像の名前 (中身のハッシュ) をキーに
+# 保存する。クリックのたびに記録を書き直しても画像データは書き直さない
+image_payloads = create_session_store("image_payloads")
+
+# 対話用の会話履歴ストア（会話IDをキーに）
+# 値は chat_context の会話レコード (固定の対戦状況・古いターンの要約・直近メッセージ)
+conversation_history = create_session_store("conversations")
+chat_context = ChatContext()
+
+# Gemini 呼び出しはジョブキューで非同期に実行する (同時実行数・待ち行列の上限は LLM_* 環境変数)
+llm_jobs = LLMJobQueue(create_session_store("llm_jobs"))
+
+# 動画解析のジョブ (同時実行数・待ちの上限・結果の保存時間は VIDEO_* 環境変数)
+video_jobs = VideoJobs()
+
+# 同じ状況 (キャラ・位置・Top5・距離 + 画像の知覚ハッシュ) への Gemini の回答キャッシュ (LLM_CACHE_* 環境変数)
+situation_cache = ResponseCache()
+
+# 脅威ヒートマップの計算結果 ((攻撃側, 相手, 攻撃側のマス) ごと)。1 件は 528 マス × 3 値なので小さい
+heatmap_cache = MemorySessionStore(
+    "heatmaps", max_entries=int(os.getenv("HEATMAP_CACHE_MAX_ENTRIES", "2048"))
+)
+
+# アップロード時にプレイヤーのタグ (1P 赤 / 2P 青) から位置を自動検出し、2 回のクリックの代わりにする
+AUTO_DETECT_POSITIONS = os.getenv("AUTO_DETECT_POSITIONS", "1") == "1"
+
+# マス目の表示方法: client (元画像の上にブラウザの canvas で描く) / server (マス目を描いた画像をサーバーで作る)
+# client でもマス目入りの画像は「画像として保存」のリンクから要求されたときに作る
+GRID_RENDER_MODE = os.getenv("GRID_RENDER_MODE", "client")
 
-# 対話用の会話履歴グローバル辞書（会話IDをキーに）
-conversation_history = {}
+# ページが Gemini の回答を受け取る方法: poll (/api/jobs/<id> を JOB_POLL_INTERVAL_MS ごとに取得。生成途中の文は partial) /
+# sse (/api/jobs/<id>/stream の EventSource)。SSE は接続中ずっとリクエストスレッドを 1 本使うので、
+# gunicorn の同期スレッド (--threads 8) のままでは同時に 8 人で埋まる。gevent などの非同期ワーカーのときだけ sse にする
+JOB_STREAM_MODE = os.getenv("JOB_STREAM_MODE", "poll")
+JOB_POLL_INTERVAL_MS = int(os.getenv("JOB_POLL_INTERVAL_MS", "500"))
+
+@app.context_processor
+def job_stream_settings():
+    # HTML_FORM の JavaScript が Gemini の回答を受け取る方法 (JOB_STREAM_MODE)
+    return {"job_stream_mode": JOB_STREAM_MODE, "job_poll_interval_ms": JOB_POLL_INTERVAL_MS}
+
+# 画面で選ぶキャラ名 -> characters.id
+CHARACTER_IDS = {"Mario": 1, "Link": 2, "Unknown": 0}
 
 # UI部分：スタイルを水色と赤を基調に、エフェクトやロード中表示も追加
 HTML_FORM = """
@@ -201,6 +350,13 @@ HTML_FORM = """
       border: 3px solid #1565c0;
       border-radius: 6px;
     }
+    #grid-stage {
+      position: relative;
+    }
+    #grid-canvas {
+      position: absolute;
+      pointer-events: none;
+    }
     #click-info, #distance-result, #chat-history {
       background-color: #bbdefb;
       padding: 10px;
@@ -235,6 +391,7 @@ HTML_FORM = """
 <body>
 <div class="container">
   <h1>Gemini+マス目座標アプリ</h1>
+  {% if error %}<p style="color: #d32f2f; font-weight: bold;">{{ error }}</p>{% endif %}
   <form method="POST" enctype="multipart/form-data">
     <label>画像を選択:</label>
     <input type="file" name="image_file" accept="image/*" required>
@@ -254,10 +411,17 @@ HTML_FORM = """
   <hr>
   <h2>生成結果</h2>
   <p>画像上で2回クリックしてください。<br>
+     {% if auto_clicks %}
+     <span id="auto-detect-message">1P・2P の位置を自動検出しました。そのまま計算できます (違う場合は2回クリックしてください)。</span><br>
+     {% endif %}
      <span id="loading-message" style="color: #d32f2f; font-weight: bold; display: none;">ロード中...</span>
   </p>
-  <img id="clickable-image" src="{{ url_for('static', filename=output_filename) }}" alt="Result Image">
-  <div id="click-info"></div>
+  <div id="grid-stage">
+    <img id="clickable-image" src="{{ url_for('static', filename=image_filename) }}" alt="Result Image">
+    {% if grid %}<canvas id="grid-canvas"></canvas>{% endif %}
+  </div>
+  <p><a href="{{ url_for('static', filename=output_filename) }}" download>マス目を描いた画像を保存</a></p>
+  <div id="click-info">{% if auto_clicks %}{% for click in auto_clicks %}自動検出{{ click.click_number }}: (x={{ click.x|round(1) }}, y={{ click.y|round(1) }})<br>{% endfor %}{% endif %}</div>
   <form id="characterForm">
     <label>1回目のクリックはどのキャラか:</label>
     <select name="char1">
@@ -289,11 +453,58 @@ HTML_FORM = """
   const clickInfoDiv = document.getElementById('click-info');
   const imgEl = document.getElementById('clickable-image');
   const randomKey = "{{ random_key }}";
+  const jobStreamMode = "{{ job_stream_mode }}";
+  const jobPollIntervalMs = {{ job_poll_interval_ms }};
+  // マス目 (grid_layout) を画像と同じピクセル座標の canvas に描き、表示中の画像の上に重ねる
+  const gridLayout = {{ grid|tojson if grid else 'null' }};
+  const gridCanvas = document.getElementById('grid-canvas');
+  function drawGrid() {
+    if (!gridLayout || !gridCanvas) return;
+    const g = gridLayout;
+    const color = `rgb({{ line_color|join(',') if line_color else '255,255,255' }})`;
+    gridCanvas.width = g.width;
+    gridCanvas.height = g.height;
+    const ctx = gridCanvas.getContext('2d');
+    // 暗幕 (draw_grid.py の DARKEN_ALPHA と同じ濃さ)
+    ctx.fillStyle = 'rgba(0, 0, 0, {{ darken_alpha }})';
+    ctx.fillRect(0, 0, g.width, g.height);
+    ctx.strokeStyle = color;
+    ctx.lineWidth = {{ line_width or 1 }};
+    ctx.beginPath();
+    g.x_lines.forEach(x => { ctx.moveTo(x, 0); ctx.lineTo(x, g.height); });
+    g.y_lines.forEach(y => { ctx.moveTo(0, y); ctx.lineTo(g.width, y); });
+    ctx.stroke();
+    ctx.fillStyle = color;
+    ctx.font = '11px sans-serif';
+    ctx.textAlign = 'center';
+    ctx.textBaseline = 'middle';
+    g.labels.forEach((label, i) => {
+      const col = i % g.columns, row = Math.floor(i / g.columns);
+      ctx.fillText(label, (g.x_lines[col] + g.x_lines[col + 1]) / 2, (g.y_lines[row] + g.y_lines[row + 1]) / 2);
+    });
+    placeGrid();
+  }
+  // canvas を画像の枠線の内側にぴったり重ねる (表示サイズが変わるたびに合わせ直す)
+  function placeGrid() {
+    if (!gridCanvas) return;
+    gridCanvas.style.left = `${imgEl.offsetLeft + imgEl.clientLeft}px`;
+    gridCanvas.style.top = `${imgEl.offsetTop + imgEl.clientTop}px`;
+    gridCanvas.style.width = `${imgEl.clientWidth}px`;
+    gridCanvas.style.height = `${imgEl.clientHeight}px`;
+  }
+  if (gridCanvas) {
+    if (imgEl.complete) { drawGrid(); } else { imgEl.addEventListener('load', drawGrid); }
+    window.addEventListener('resize', placeGrid);
+  }
   if (imgEl) {
     imgEl.addEventListener('click', function(e) {
+      // 表示の大きさ (CSS で縮小される) ではなく、画像そのもののピクセル座標で送る (枠線の内側が画像)
       const rect = imgEl.getBoundingClientRect();
-      const x = e.clientX - rect.left;
-      const y = e.clientY - rect.top;
+      const x = (e.clientX - rect.left - imgEl.clientLeft) * imgEl.naturalWidth / imgEl.clientWidth;
+      const y = (e.clientY - rect.top - imgEl.clientTop) * imgEl.naturalHeight / imgEl.clientHeight;
+      if (clickCount === 0) {
+        clickInfoDiv.innerHTML = "";
+      }
       clickCount++;
       fetch('/api/record_click', {
         method: 'POST',
@@ -303,7 +514,58 @@ HTML_FORM = """
       .then(res => res.json())
       .then(data => { console.log('Server response:', data); })
       .catch(err => console.error(err));
-      clickInfoDiv.innerHTML = `クリック${clickCount}: (x=${x}, y=${y})<br>` + clickInfoDiv.innerHTML;
+      clickInfoDiv.innerHTML = `クリック${clickCount}: (x=${x.toFixed(1)}, y=${y.toFixed(1)})<br>` + clickInfoDiv.innerHTML;
+    });
+  }
+  // Geminiジョブの完了をポーリングで待つ (生成途中なら onText(ここまでの全文) を呼ぶ)
+  function waitForJob(jobId, onText) {
+    return new Promise((resolve, reject) => {
+      const poll = () => {
+        fetch(`/api/jobs/${jobId}`)
+          .then(res => res.json())
+          .then(job => {
+            if (job.status === 'done') {
+              resolve(job.result);
+            } else if (job.status === 'error' || job.error) {
+              reject(new Error(job.error));
+            } else {
+              if (job.partial && onText) onText(job.partial);
+              setTimeout(poll, jobPollIntervalMs);
+            }
+          })
+          .catch(reject);
+      };
+      poll();
+    });
+  }
+  // Geminiの回答を受け取り、onText(ここまでの全文) を呼ぶ。
+  // 既定はポーリング。JOB_STREAM_MODE=sse のときだけ EventSource で断片ごとに受け取り、使えない・切れたらポーリングにする
+  function streamJob(jobId, onText) {
+    const fallback = () => waitForJob(jobId, onText).then(text => { onText(text); return text; });
+    if (jobStreamMode !== 'sse' || !window.EventSource) {
+      return fallback();
+    }
+    return new Promise((resolve, reject) => {
+      const source = new EventSource(`/api/jobs/${jobId}/stream`);
+      let text = "";
+      source.addEventListener('token', e => {
+        text += JSON.parse(e.data).text;
+        onText(text);
+      });
+      source.addEventListener('done', e => {
+        source.close();
+        const job = JSON.parse(e.data);
+        onText(job.result);
+        resolve(job.result);
+      });
+      source.addEventListener('failed', e => {
+        source.close();
+        reject(new Error(JSON.parse(e.data).error));
+      });
+      source.onerror = () => {
+        source.close();
+        fallback().then(resolve, reject);
+      };
     });
   }
   function submitCharacter() {
@@ -323,6 +585,14 @@ HTML_FORM = """
        if (data.message) {
            distanceResultDiv.innerHTML = data.message;
        }
+       if (data.job_id) {
+           const commentDiv = document.getElementById('gemini-comment');
+           streamJob(data.job_id, text => { commentDiv.innerHTML = text; })
+             .catch(err => {
+               console.error(err);
+               document.getElementById('gemini-comment').innerHTML = "コメントの生成に失敗しました。";
+             });
+       }
     })
     .catch(err => {
       console.error(err);
@@ -343,9 +613,21 @@ HTML_FORM = """
     })
     .then(res => res.json())
     .then(data => {
-      chatLoading.style.display = "none";
       chatHistoryDiv.innerHTML += "<p><b>ユーザー:</b> " + userMessage + "</p>";
-      chatHistoryDiv.innerHTML += "<p><b>Gemini:</b> " + data.answer + "</p>";
+      if (!data.job_id) {
+        chatLoading.style.display = "none";
+        chatHistoryDiv.innerHTML += "<p><b>Gemini:</b> " + data.error + "</p>";
+        return;
+      }
+      const answerEl = document.createElement('p');
+      answerEl.innerHTML = "<b>Gemini:</b> ";
+      const answerText = document.createElement('span');
+      answerEl.appendChild(answerText);
+      chatHistoryDiv.appendChild(answerEl);
+      return streamJob(data.job_id, text => {
+        chatLoading.style.display = "none";
+        answerText.innerHTML = text;
+      }).then(() => { chatLoading.style.display = "none"; });
     })
     .catch(err => {
       console.error(err);
@@ -376,32 +658,50 @@ def index():
         except:
             line_color = (255,255,255)
         if file:
-            ext = os.path.splitext(file.filename)[1]
             random_key = uuid.uuid4().hex[:8]
-            input_filename = f"input_{random_key}{ext}"
-            output_filename = f"output_{random_key}{ext}"
-            input_path = os.path.join(IMAGES_FOLDER, input_filename)
-            output_path = os.path.join(IMAGES_FOLDER, output_filename)
-            file.save(input_path)
-            draw_grid_with_relative_coords(
-                image_path=input_path,
-                output_path=output_path,
-                columns=columns,
-                rows=rows,
-                origin_cell=origin_cell,
-                line_color=line_color,
-                line_width=line_width
-            )
-            click_data_storage[random_key] = {
+            # 元のファイルは保存せず、作業用の大きさでデコードしたコピーだけを残す (ingest.py)。
+            # デコードはここで 1 回だけ行い、マス目描画・位置の自動検出・Gemini 送信用データで共有する
+            # 同じスクリーンショットは 1 回だけ保存され、同じ設定のマス目画像も作り直さない
+            try:
+                upload = ingest_upload(file, image_store)
+            except IngestError as e:
+                return render_template_string(HTML_FORM, error=str(e)), 400
+            img, input_path = upload.image, upload.path
+            width, height = img.size
+            output_filename = register_grid_image(upload.name, columns, rows, origin_cell, line_color, line_width)
+            output_path = image_store.path(output_filename)
+            if GRID_RENDER_MODE == "server":
+                image_store.ensure(output_filename, image=img)
+                image_filename, layout = output_filename, None
+            else:
+                # 元画像をそのまま表示し、マス目は grid_layout の JSON からブラウザで描く (サーバーでのエンコードなし)
+                image_filename = upload.name
+                layout = grid_layout(width, height, columns, rows, origin_cell, show_cell_numbers=True)
+            # 1P / 2P が両方見つかれば、それを 1 回目・2 回目のクリックとして保存しておく
+            auto_clicks = positions_to_clicks(detect_positions(img)) if AUTO_DETECT_POSITIONS else None
+            click_data_storage.set(random_key, {
                 "input_path": input_path,
                 "output_path": output_path,
                 "columns": columns,
                 "rows": rows,
                 "origin_cell": origin_cell,
-                "clicks": []
-            }
-            conversation_history[random_key] = []
-            return render_template_string(HTML_FORM, output_filename=output_filename, random_key=random_key)
+                "line_color": line_color,
+                "line_width": line_width,
+                "width": width,
+                "height": height,
+                # 作業用のコピーの大きさ / 元画像の大きさ (元画像の座標で来たクリックを直すのに使う)
+                "scale": upload.scale,
+                "original_size": upload.original_size,
+                "payload_key": upload.name,
+                "image_hash": image_dhash(img),
+                "clicks": auto_clicks or []
+            })
+            image_payloads.set(upload.name, encode_image_payload(img))
+            conversation_history.set(random_key, new_conversation())
+            return render_template_string(HTML_FORM, output_filename=output_filename, image_filename=image_filename,
+                                          grid=layout, line_color=line_color, line_width=line_width,
+                                          darken_alpha=round(DARKEN_ALPHA / 255, 3),
+                                          random_key=random_key, auto_clicks=auto_clicks)
     return render_template_string(HTML_FORM)
 
 @app.route("/api/record_click", methods=["POST"])
@@ -411,12 +711,57 @@ def record_click():
     click_number = data.get("click_number")
     x = data.get("x")
     y = data.get("y")
-    if random_key not in click_data_storage:
-        return jsonify({"error": "Invalid random_key"}), 400
+    # クリック座標はマス目を描いた画像 (作業用のコピー) のピクセル座標で保存する。
+    # coords="original" なら元画像の座標として取り込み時の縮小率を掛ける
+    if data.get("coords") == "original":
+        if not all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in (x, y)):
+            return jsonify({"error": "x / y は数値で指定してください"}), 400
+        stored_data = click_data_storage.get(random_key)
+        if stored_data is None:
+            return jsonify({"error": "Invalid random_key"}), 400
+        x, y = x * stored_data.get("scale", 1.0), y * stored_data.get("scale", 1.0)
     click_info = {"click_number": click_number, "x": x, "y": y}
-    click_data_storage[random_key]["clicks"].append(click_info)
+    # 手動でクリックしたら自動検出した位置は使わない
+    updated = click_data_storage.update(
+        random_key, lambda record: {
+            **record, "clicks": [c for c in record["clicks"] if c.get("source") != "auto"] + [click_info]
+        }
+    )
+    if updated is None:
+        return jsonify({"error": "Invalid random_key"}), 400
     return jsonify({"status": "ok", "message": "クリック座標を保存したします！"})
 
+@app.route("/api/grid_geometry/<random_key>", methods=["GET"])
+def grid_geometry(random_key):
+    """
+    アップロード画像のマス目を、ブラウザで描くための JSON で返すAPI (画像は作らない)。
+    マス (col, row) の矩形は x_lines[col]〜x_lines[col + 1], y_lines[row]〜y_lines[row + 1]、
+    labels はマス番号順のラベル。座標は image_url の画像のピクセル座標。
+    マス目を描いた画像が必要なら grid_image_url (要求されたときにサーバーで作る) を使う。
+
+    レスポンス: {"width", "height", "columns", "rows", "origin_cell", "origin": {"col", "row", "rect"},
+                 "x_lines", "y_lines", "labels", "style": {"line_color", "line_width", "darken_alpha"},
+                 "image_url", "grid_image_url"}
+    """
+    stored_data = click_data_storage.get(random_key)
+    if stored_data is None:
+        return jsonify({"error": "Invalid random_key"}), 400
+    layout = grid_layout(stored_data["width"], stored_data["height"], stored_data["columns"], stored_data["rows"],
+                         stored_data["origin_cell"], show_cell_numbers=True)
+    response = jsonify({
+        **layout,
+        "style": {
+            "line_color": list(stored_data.get("line_color", (255, 255, 255))),
+            "line_width": stored_data.get("line_width", 1),
+            "darken_alpha": round(DARKEN_ALPHA / 255, 3)
+        },
+        "image_url": url_for("static", filename=os.path.basename(stored_data["input_path"])),
+        "grid_image_url": url_for("static", filename=os.path.basename(stored_data["output_path"]))
+    })
+    # アップロードごとに中身は変わらない
+    response.headers["Cache-Control"] = "private, max-age=3600"
+    return response
+
 @app.route("/api/calc_distance", methods=["POST"])
 def calc_distance():
     """
@@ -428,46 +773,34 @@ def calc_distance():
     random_key = data.get("random_key")
     char1 = data.get("char1")
     char2 = data.get("char2")
-    char_map = {"Mario": 1, "Link": 2, "Unknown": 0}
-    char1_id = char_map.get(char1, 0)
-    char2_id = char_map.get(char2, 0)
-    if random_key not in click_data_storage:
+    char1_id = CHARACTER_IDS.get(char1, 0)
+    char2_id = CHARACTER_IDS.get(char2, 0)
+    stored_data = click_data_storage.get(random_key)
+    if stored_data is None:
         return jsonify({"message": "random_keyが不正します"}), 400
-    stored_data = click_data_storage[random_key]
     clicks = stored_data["clicks"]
     if len(clicks) < 2:
         return jsonify({"message": "クリックが2回未満します"}), 400
     columns = stored_data["columns"]
     rows = stored_data["rows"]
     origin_cell = stored_data["origin_cell"]
-    with Image.open(stored_data["input_path"]) as im:
-        width, height = im.size
-    cell_width = width / columns
-    cell_height = height / rows
-    origin_index = origin_cell - 1
-    origin_row = origin_index // columns
-    origin_col = origin_index % columns
+    width, height = stored_data["width"], stored_data["height"]
     clicks_sorted = sorted(clicks, key=lambda c: c["click_number"])
     x1, y1 = clicks_sorted[0]["x"], clicks_sorted[0]["y"]
     x2, y2 = clicks_sorted[1]["x"], clicks_sorted[1]["y"]
-    col1 = int(x1 // cell_width)
-    row1 = int(y1 // cell_height)
-    col2 = int(x2 // cell_width)
-    row2 = int(y2 // cell_height)
-    rel_x1 = col1 - origin_col
-    rel_y1 = row1 - origin_row
-    rel_x2 = col2 - origin_col
-    rel_y2 = row2 - origin_row
-    cell_num1 = row1 * columns + col1 + 1
-    cell_num2 = row2 * columns + col2 + 1
-    dx = rel_x2 - rel_x1
-    dy = rel_y2 - rel_y1
-    dist = (dx**2 + dy**2) ** 0.5
-
-    recommended1 = recommend_actions(DB_PATH, char1_id, dist)
-    top5_1 = get_top5_moves(recommended1)
-    recommended2 = recommend_actions(DB_PATH, char2_id, dist)
-    top5_2 = get_top5_moves(recommended2)
+    # ピクセル座標 -> マス番号・相対座標 -> 差分と距離 (動画解析と同じ grid_geometry の式)
+    p1 = locate_cell(x1, y1, width, height, columns, rows, origin_cell)
+    p2 = locate_cell(x2, y2, width, height, columns, rows, origin_cell)
+    cell_num1, rel_x1, rel_y1 = p1.cell, p1.rel_x, p1.rel_y
+    cell_num2, rel_x2, rel_y2 = p2.cell, p2.rel_x, p2.rel_y
+    dx, dy, dist = cell_offset(p1, p2)
+
+    # 盤面上の差分 (dx, dy) から事前計算済みの Top5 を引く (get_top5_moves(iter_recommend(...)) と同じ結果)
+    top5_1 = move_index.top_moves(char1_id, dx, dy)
+    top5_2 = move_index.top_moves(char2_id, dx, dy)
+    # 横・縦のリーチとキャラの大きさで判定して、相手に実際に当たる技 (発生の早い順に 5 件)
+    hits_1 = move_index.connecting_moves(char1_id, char2_id, dx, dy)
+    hits_2 = move_index.connecting_moves(char2_id, char1_id, -dx, -dy)
     
 
     def moves_to_html(moves):
@@ -499,6 +832,12 @@ def calc_distance():
         f"<li>{move['カテゴリ']} - {move_descriptions.get(move['行動'], move['行動'])} (有効距離: {move['適用距離']}マス以下)</li>" 
         for move in moves
     ) + "</ul>"
+    def moves_to_text(moves):
+      return "、".join(f"{move['カテゴリ']} {move['行動']} ({move['適用距離']}マス)" for move in moves) or "(該当なし)"
+    def hits_to_text(hits):
+      return "、".join(
+        f"{hit['カテゴリ']} {hit['行動']} (発生 {hit['発生']}F, {hit['ダメージ']}%)".replace("  ", " ") for hit in hits
+      ) or "(当たる技なし)"
     # Geminiへの質問プロンプトを作成
     situation_prompt = f"""
 スマッシュブラザーズの対戦状況を分析してください。
@@ -511,46 +850,417 @@ def calc_distance():
 システムの推奨行動:
 {moves_to_html(top5_1)} (for {char1})
 {moves_to_html(top5_2)} (for {char2})
+この位置で相手に当たる技 (横・縦のリーチとキャラの大きさで判定、発生の早い順):
+  {char1}: {hits_to_text(hits_1)}
+  {char2}: {hits_to_text(hits_2)}
 ユークリッド距離: {dist:.2f} (マス単位)
 上記の情報に基づいて、最も効果的な戦略とその理由を具体的に提案してください。
 """
-    analyzer = ImageAnalyzer()
-    gemini_explanation = analyzer.analyze_with_gemini(stored_data["input_path"], prompt=situation_prompt)
-    
+    # この画像のチャットでは、分析した対戦状況を固定コンテキストとして毎回プロンプトに入れる
+    situation = (
+        f"プレイヤー: {char1} (マス {cell_num1}, 相対座標 ({rel_x1}, {rel_y1}))\n"
+        f"対戦相手: {char2} (マス {cell_num2}, 相対座標 ({rel_x2}, {rel_y2}))\n"
+        f"ユークリッド距離: {dist:.2f} マス\n"
+        f"{char1} の推奨行動: {moves_to_text(top5_1)}\n"
+        f"{char2} の推奨行動: {moves_to_text(top5_2)}\n"
+        f"{char1} の当たる技: {hits_to_text(hits_1)}\n"
+        f"{char2} の当たる技: {hits_to_text(hits_2)}"
+    )
+    if conversation_history.update(random_key, lambda record: chat_context.pin(record, situation)) is None:
+        conversation_history.set(random_key, new_conversation(pinned=situation))
+    # 同じ状況・同じ画像の回答がキャッシュにあれば Gemini を呼ばない
+    cache_key = situation_key({
+        "model": GEMINI_MODEL_NAME,
+        "characters": [char1, char2],
+        "cells": [cell_num1, cell_num2],
+        "relative": [[rel_x1, rel_y1], [rel_x2, rel_y2]],
+        "top5": [top5_1, top5_2],
+        "hits": [hits_1, hits_2],
+        "distance": dist
+    }, stored_data["image_hash"])
     msg = f"""
     [1回目クリック] {char1} → ピクセル({x1:.1f},{y1:.1f}) → マス {cell_num1} → 相対({rel_x1},{rel_y1})<br>
     [2回目クリック] {char2} → ピクセル({x2:.1f},{y2:.1f}) → マス {cell_num2} → 相対({rel_x2},{rel_y2})<br>
     <br>
     ユークリッド距離 = {dist:.2f} (マス単位)<br><br>
     <b>{char1} のTop5推奨行動</b>: {moves_to_html(top5_1)}<br>
-    <b>{char2} のTop5推奨行動</b>: {moves_to_html(top5_2)}<br><br>
+    <b>{char2} のTop5推奨行動</b>: {moves_to_html(top5_2)}<br>
+    <b>この位置で当たる技</b>: {char1}: {hits_to_text(hits_1)} / {char2}: {hits_to_text(hits_2)}<br><br>
     <hr>
     <b>Geminiからのコメント</b>:<br>
-    {gemini_explanation}
     """
-    return jsonify({"message": msg})
+    cached = situation_cache.get(cache_key)
+    if cached is not None:
+        msg += f"<div id=\"gemini-comment\">{cached}</div>"
+        return jsonify({"message": msg, "job_id": None, "cached": True})
+    # ここまでの計算結果はすぐに返し、Gemini のコメントはジョブIDで後から取得してもらう
+    try:
+        job_id = llm_jobs.submit(
+            "calc_distance", analyze_situation, cache_key,
+            # 画像データが期限切れなどで消えていれば、ジョブの中で作業用のコピーを開き直す
+            stored_data["input_path"], situation_prompt, image_payloads.get(stored_data["payload_key"])
+        )
+    except JobQueueFull:
+        msg += "<div id=\"gemini-comment\">混雑しているためコメントを生成できませんでした。時間をおいて再度お試しください。</div>"
+        return jsonify({"message": msg, "job_id": None}), 429, {"Retry-After": "5"}
+    msg += "<div id=\"gemini-comment\">コメントを生成中...</div>"
+    return jsonify({"message": msg, "job_id": job_id, "cached": False})
+
+def analyze_situation(cache_key, image_path, prompt, image_payload):
+    """
+    calc_distance のジョブ本体 (ストリーミング)。Gemini のコメントを断片ごとに返し、
+    全文が揃ったらキャッシュに保存する。
+    """
+    parts = []
+    for chunk in image_analyzer.stream_with_gemini(image_path, prompt=prompt, image_payload=image_payload):
+        parts.append(chunk)
+        yield chunk
+    situation_cache.set(cache_key, "".join(parts))
+
+@app.route("/api/recommend_batch", methods=["POST"])
+def recommend_batch():
+    """
+    (キャラID, 距離) の組をまとめて受け取り、組ごとの Top-k 推奨行動を返すAPI。
+    試合映像のリプレイ解析など、大量の位置関係を一度に評価する用途向け。
+
+    リクエスト: {"character_ids": [1, 2, ...], "distances": [3.5, 12.0, ...], "k": 5}
+    レスポンス: {"results": [[{"カテゴリ", "行動", "適用距離"}, ...], ...]}
+    """
+    data = request.get_json() or {}
+    character_ids = data.get("character_ids")
+    distances = data.get("distances")
+    k = data.get("k", 5)
+    if not isinstance(character_ids, list) or not isinstance(distances, list):
+        return jsonify({"error": "character_ids と distances は配列で指定してください"}), 400
+    if len(character_ids) != len(distances):
+        return jsonify({"error": "character_ids と distances の長さが一致しません"}), 400
+    try:
+        character_ids = [int(cid) for cid in character_ids]
+        distances = [float(d) for d in distances]
+        k = int(k)
+    except (TypeError, ValueError):
+        return jsonify({"error": "character_ids / distances / k は数値で指定してください"}), 400
+    results = move_index.recommend_batch(character_ids, distances, k=k)
+    return jsonify({"results": results})
+
+def _grid_to_list(values):
+    # NaN (当たる技が無いマス) は JSON で null にする
+    return [[None if v != v else (int(v) if float(v).is_integer() else float(v)) for v in row]
+            for row in values.tolist()]
+
+def _heatmap_strength(heat, metric):
+    """オーバーレイの濃さ (0〜1)。count / best_damage は大きいほど、fastest_startup は小さいほど濃い"""
+    values = np.asarray(heat[metric], dtype=float)
+    if np.all(np.isnan(values)) or np.nanmax(values) <= 0:
+        return np.zeros(values.shape)
+    if metric == "fastest_startup":
+        return np.nanmin(values) / np.maximum(values, 1e-9)
+    return values / np.nanmax(values)
+
+HEATMAP_METRICS = ("count", "best_damage", "fastest_startup")
+
+@app.route("/api/threat_heatmap", methods=["POST"])
+def threat_heatmap():
+    """
+    攻撃側のキャラがあるマスにいるとき、盤面の全マスについて「そこにいる相手に当たる技の数・
+    最大ダメージ・最速の発生フレーム」を返し、アップロード画像に重ねたヒートマップ画像を作るAPI。
+    計算結果は (攻撃側, 相手, 攻撃側のマス) ごとにキャッシュする。
+
+    リクエスト: {"random_key": "...", "char": "Mario", "opponent": "Link",
+                 "cell": 347 (攻撃側のマス番号。省略時は 1 回目のクリックのマス),
+                 "metric": "count" | "best_damage" | "fastest_startup" (画像の濃さに使う値)}
+    レスポンス: {"count": [[...]], "best_damage": [[...]], "fastest_startup": [[...]],
+                 "image_url": "...", "cached": true/false, ...}  (配列は rows x columns)
+    """
+    data = request.get_json() or {}
+    random_key = data.get("random_key")
+    stored_data = click_data_storage.get(random_key)
+    if stored_data is None:
+        return jsonify({"error": "random_keyが不正です"}), 400
+    metric = data.get("metric", "count")
+    if metric not in HEATMAP_METRICS:
+        return jsonify({"error": f"metric は {', '.join(HEATMAP_METRICS)} のいずれかを指定してください"}), 400
+    columns, rows = stored_data["columns"], stored_data["rows"]
+    cell = data.get("cell")
+    if cell is None:
+        if not stored_data["clicks"]:
+            return jsonify({"error": "cell を指定するか、先に画像をクリックしてください"}), 400
+        first = min(stored_data["clicks"], key=lambda c: c["click_number"])
+        cell = locate_cell(first["x"], first["y"], stored_data["width"], stored_data["height"],
+                           columns, rows, stored_data["origin_cell"]).cell
+    try:
+        cell = int(cell)
+    except (TypeError, ValueError):
+        return jsonify({"error": "cell はマス番号 (数値) で指定してください"}), 400
+    if not 1 <= cell <= columns * rows:
+        return jsonify({"error": f"cell は 1〜{columns * rows} で指定してください"}), 400
+    attacker_id = CHARACTER_IDS.get(data.get("char"), 0)
+    defender_id = CHARACTER_IDS.get(data.get("opponent"), 0)
+    attacker_row, attacker_col = divmod(cell - 1, columns)
+
+    move_index.refresh_if_changed()
+    cache_key = f"{move_index.generation}:{attacker_id}:{defender_id}:{cell}:{columns}x{rows}"
+    heat = heatmap_cache.get(cache_key)
+    cached = heat is not None
+    if not cached:
+        generation, heat = move_index.threat_map(attacker_id, defender_id, attacker_col, attacker_row, columns, rows)
+        cache_key = f"{generation}:{attacker_id}:{defender_id}:{cell}:{columns}x{rows}"
+        heatmap_cache.set(cache_key, heat)
+
+    # 同じ条件の画像は作り直さない (DB を読み直したら世代が変わるので別のファイルになる)
+    output_filename = register_grid_image(
+        os.path.basename(stored_data["input_path"]), columns, rows, stored_data["origin_cell"],
+        stored_data.get("line_color", (255, 255, 255)), stored_data.get("line_width", 1),
+        heatmap=_heatmap_strength(heat, metric), variant=f"heatmap:{cache_key}:{metric}"
+    )
+    if not image_store.ensure(output_filename):
+        return jsonify({"error": "アップロード画像の保存期間が切れました。もう一度アップロードしてください"}), 410
+    return jsonify({
+        "columns": columns,
+        "rows": rows,
+        "cell": cell,
+        "metric": metric,
+        "count": _grid_to_list(heat["count"]),
+        "best_damage": _grid_to_list(heat["best_damage"]),
+        "fastest_startup": _grid_to_list(heat["fastest_startup"]),
+        "image_url": url_for("static", filename=output_filename),
+        "cached": cached
+    })
+
+@app.route("/api/analyze_video", methods=["POST"])
+def analyze_video():
+    """
+    試合の動画 (video_file) をアップロードすると、一定間隔のフレームごとに位置の自動検出・マス目・
+    推奨行動を計算し、状況が変わったキーフレームにだけ Gemini のコメントを付けるジョブを登録するAPI。
+    結果は /api/video_jobs/<job_id> から 1 件ずつの JSON (キーフレーム・コメント・最後に集計) として読む。
+
+    フォーム: video_file, char1, char2 (キャラ名), fps (1 秒あたりに解析するフレーム数),
+              columns, rows, origin_cell, commentary ("0" でコメントなし)
+    レスポンス: {"job_id": "..."}
+    """
+    file = request.files.get("video_file")
+    if file is None or file.filename == "":
+        return jsonify({"error": "video_file を指定してください"}), 400
+    try:
+        fps = float(request.form.get("fps", VIDEO_SAMPLE_FPS))
+        columns = int(request.form.get("columns", 33))
+        rows = int(request.form.get("rows", 16))
+        origin_cell = int(request.form.get("origin_cell", 347))
+    except ValueError:
+        return jsonify({"error": "fps / columns / rows / origin_cell は数値で指定してください"}), 400
+    if fps <= 0:
+        return jsonify({"error": "fps は正の数で指定してください"}), 400
+
+    ext = os.path.splitext(file.filename)[1].lower()
+    # 読めない形式は保存・ジョブ登録の前に断る (opencv が無い環境では .mp4 などは読めない)
+    extensions = supported_extensions()
+    if ext not in extensions:
+        return jsonify({"error": f"対応していない動画の形式です ({', '.join(extensions)} のいずれか)"}), 400
+    # images/ は公開フォルダ (/images/...) なので、動画はその外の一時ファイルに保存する (解析が終わったら消す)
+    fd, video_path = tempfile.mkstemp(prefix="video_", suffix=ext)
+    with os.fdopen(fd, "wb") as f:
+        file.save(f)
+    commentator = None
+    if request.form.get("commentary", "1") != "0":
+        # コメントはキーフレームごとに 1 件ずつ llm_jobs に投入する (他の Gemini 呼び出しと同時実行数を共有する)
+        commentator = queued_commentator(llm_jobs, gemini_commentator(gemini_models.get()))
+    pipeline = VideoPipeline(
+        move_index, CHARACTER_IDS.get(request.form.get("char1"), 0), CHARACTER_IDS.get(request.form.get("char2"), 0),
+        columns=columns, rows=rows, origin_cell=origin_cell, sample_fps=fps, commentator=commentator
+    )
+    try:
+        job_id = video_jobs.submit(pipeline, video_path)
+    except JobQueueFull:
+        return jsonify({"error": "混雑しているため解析できませんでした。時間をおいて再度お試しください。"}), 429, {"Retry-After": "5"}
+    return jsonify({"job_id": job_id})
+
+@app.route("/api/video_jobs/<job_id>", methods=["GET"])
+def video_job(job_id):
+    """
+    動画解析の結果を offset (前回の next_offset) の続きから返すAPI (ポーリング用)。
+    finished が true になるまで next_offset を渡して繰り返し読む。
+
+    レスポンス: {"status": queued / running / done / error, "events": [...], "next_offset", "finished", "error"}
+    """
+    try:
+        offset = max(int(request.args.get("offset", 0)), 0)
+    except ValueError:
+        return jsonify({"error": "offset は整数で指定してください"}), 400
+    result = video_jobs.read(job_id, offset)
+    if result is None:
+        return jsonify({"error": "Invalid job_id"}), 404
+    return jsonify({"job_id": job_id, **result})
+
+@app.route("/api/session_stats", methods=["GET"])
+def session_stats():
+    """
+    セッションストアの件数・ヒット率・削除数 (期限切れ/容量超過)、LLM ジョブの件数、
+    状況分析キャッシュのヒット率、DB 接続プールの接続数、images/ の使用量 (ファイル数・バイト数・削除数) を返すAPI
+    """
+    return jsonify({
+        "clicks": click_data_storage.metrics(),
+        "image_payloads": image_payloads.metrics(),
+        "conversations": conversation_history.metrics(),
+        "llm_jobs": llm_jobs.metrics(),
+        "video_jobs": video_jobs.metrics(),
+        "situation_cache": situation_cache.metrics(),
+        "db_pool": get_pool(DB_PATH).metrics(),
+        "heatmaps": heatmap_cache.metrics(),
+        "images": image_store.metrics()
+    })
 
 @app.route("/api/chat", methods=["POST"])
 def chat():
     """
     ユーザーからのメッセージを受け取り、対話形式でGeminiに質問するAPI。
-    会話履歴はグローバルな conversation_history に保存する。
+    会話履歴はセッションストア conversation_history に保存し、プロンプトは chat_context で
+    トークン予算内 (固定の対戦状況 + 古いターンの要約 + 直近のメッセージ) に収める。
     """
     data = request.get_json()
     conversation_id = data.get("conversation_id")
     user_message = data.get("message")
     if not conversation_id:
         conversation_id = uuid.uuid4().hex
-        conversation_history[conversation_id] = []
-    if conversation_id not in conversation_history:
-        conversation_history[conversation_id] = []
-    conversation_history[conversation_id].append({"role": "user", "content": user_message})
-    context = "\n".join(f"{msg['role']}: {msg['content']}" for msg in conversation_history[conversation_id])
-    prompt = f"以下の対話履歴を参考にして回答してください。\n{context}\nassistant:"
-    response = genai.GenerativeModel('gemini-1.5-flash').generate_content([prompt])
-    answer = response.text
-    conversation_history[conversation_id].append({"role": "assistant", "content": answer})
-    return jsonify({"conversation_id": conversation_id, "answer": answer})
+    # 回答の追加・要約の畳み込みはワーカースレッドが同じレコードを書き換えるので、get -> set ではなく update で追加する
+    record = conversation_history.update(
+        conversation_id, lambda record: chat_context.append(record, "user", user_message)
+    )
+    if record is None:
+        record = chat_context.append(None, "user", user_message)
+        conversation_history.set(conversation_id, record)
+    prompt = chat_context.build_prompt(record)
+    try:
+        job_id = llm_jobs.submit("chat", answer_chat, conversation_id, prompt)
+    except JobQueueFull:
+        # 追加したメッセージだけを取り消す (その間に追加された回答や要約は残す)
+        conversation_history.update(
+            conversation_id, lambda record: chat_context.discard(record, "user", user_message)
+        )
+        return jsonify({"conversation_id": conversation_id, "error": "混雑しています。時間をおいて再度お試しください。"}), 429, {"Retry-After": "5"}
+    # 回答はジョブIDで /api/jobs/<job_id> から取得する
+    return jsonify({"conversation_id": conversation_id, "job_id": job_id})
+
+def answer_chat(conversation_id, prompt):
+    """
+    チャットのジョブ本体 (ストリーミング)。回答を断片ごとに返し、
+    全文が揃ったら会話履歴に追加する。
+    """
+    parts = []
+    for chunk in iter_text(gemini_models.get(GEMINI_MODEL_NAME), [prompt]):
+        parts.append(chunk)
+        yield chunk
+    answer = "".join(parts)
+    record = conversation_history.update(
+        conversation_id, lambda record: chat_context.append(record, "assistant", answer)
+    )
+    if record is None:
+        record = chat_context.append(None, "assistant", answer)
+        conversation_history.set(conversation_id, record)
+    # ウィンドウからあふれた古いメッセージは別ジョブで要約に畳み込む (回答は待たせない)
+    if chat_context.messages_to_fold(record):
+        try:
+            llm_jobs.submit("chat_summary", summarize_chat, conversation_id)
+        except JobQueueFull:
+            pass  # 次のターンでまた畳み込む
+
+def summarize_chat(conversation_id):
+    """
+    古いメッセージを会話の要約に畳み込むジョブ。
+    要約は 1 回だけ作って保存し、以降のターンでは作り直さない。
+    """
+    record = conversation_history.get(conversation_id)
+    if record is None:
+        return None
+    record = normalize_conversation(record)
+    folded = chat_context.messages_to_fold(record)
+    if not folded:
+        return record["summary"]
+    response = gemini_models.get(GEMINI_MODEL_NAME).generate_content(
+        [chat_context.summary_prompt(record["summary"], folded)]
+    )
+    summary = response.text.strip()
+    conversation_history.update(
+        conversation_id,
+        lambda latest: chat_context.apply_fold(latest, record["summarized"], len(folded), summary)
+    )
+    return summary
+
+@app.route("/api/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    """
+    Gemini ジョブの状態を返すAPI (ポーリング用)。
+    status: queued / running / done (result に回答) / error (error にメッセージ)
+    ttfb_ms: 受け付けから最初の断片が生成されるまでの時間 (ストリーミングジョブのみ)
+    partial: 実行中のストリーミングジョブの、ここまでに生成された全文 (このワーカーで実行中のときのみ)
+    """
+    job = llm_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Invalid job_id"}), 404
+    summary = {"job_id": job_id, **job_summary(job)}
+    if job["status"] == "running":
+        partial = llm_jobs.partial_text(job_id)
+        if partial:
+            summary["partial"] = partial
+    return jsonify(summary)
+
+def job_summary(job):
+    summary = {k: job[k] for k in ("kind", "status", "result", "error") if k in job}
+    if "first_chunk_at" in job:
+        summary["ttfb_ms"] = round((job["first_chunk_at"] - job["created_at"]) * 1000, 1)
+    return summary
+
+@app.route("/api/jobs/<job_id>/events", methods=["GET"])
+def job_events(job_id):
+    """
+    Gemini ジョブの完了を server-sent events で通知するAPI。
+    完了すると done (失敗時は failed) イベントを 1 回送って閉じる。
+    待っている間はリクエストスレッドを 1 本使うので、多数のクライアントはポーリングを使うこと。
+    """
+    def stream():
+        while True:
+            job = llm_jobs.wait(job_id, timeout=15)
+            if job is None:
+                yield f"event: failed\ndata: {json.dumps({'error': 'Invalid job_id'})}\n\n"
+                return
+            if job["status"] == "done":
+                yield f"event: done\ndata: {json.dumps({'result': job['result']}, ensure_ascii=False)}\n\n"
+                return
+            if job["status"] == "error":
+                yield f"event: failed\ndata: {json.dumps({'error': job['error']}, ensure_ascii=False)}\n\n"
+                return
+            # 接続維持用のコメント行
+            yield ": waiting\n\n"
+    return Response(stream(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route("/api/jobs/<job_id>/stream", methods=["GET"])
+def job_stream(job_id):
+    """
+    Gemini の回答を生成された断片ごとに server-sent events で送るAPI。
+      token  … {"text": 断片}  (生成されるたびに送る)
+      done   … {"result": 全文, "ttfb_ms": ...}  (最後に 1 回)
+      failed … {"error": メッセージ}
+    他のワーカーで実行中のジョブや、ストリーミングでないジョブは完了時に全文を token で 1 回送る。
+    接続中はリクエストスレッドを 1 本使うので、ページがこれを使うのは JOB_STREAM_MODE=sse のときだけ。
+    """
+    def stream():
+        if llm_jobs.get(job_id) is None:
+            yield f"event: failed\ndata: {json.dumps({'error': 'Invalid job_id'})}\n\n"
+            return
+        for chunk in llm_jobs.iter_stream(job_id, timeout=15):
+            if chunk is None:
+                # 接続維持用のコメント行
+                yield ": waiting\n\n"
+                continue
+            yield f"event: token\ndata: {json.dumps({'text': chunk}, ensure_ascii=False)}\n\n"
+        job = llm_jobs.get(job_id)
+        if job is not None and job["status"] == "done":
+            yield f"event: done\ndata: {json.dumps(job_summary(job), ensure_ascii=False)}\n\n"
+        else:
+            error = job.get("error") if job is not None else "Invalid job_id"
+            yield f"event: failed\ndata: {json.dumps({'error': error}, ensure_ascii=False)}\n\n"
+    return Response(stream(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 if __name__ == "__main__":
     # Cloud Run用の設定
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+chat_context.py
+
+/api/chat に渡す対話コンテキストの管理。
+
+以前は毎ターン会話履歴の全文を "\n".join していたため、プロンプトの大きさ・トークン代・
+レイテンシが会話の長さに比例して増え、履歴もメモリに溜まり続けていた。ここでは会話を
+
+  pinned     … calc_distance で分析した対戦状況 (常にプロンプトに入れる固定コンテキスト)
+  summary    … 古いターンの要約 (畳み込むたびに 1 回だけ作って保存する。毎ターン作り直さない)
+  messages   … 直近のメッセージ (スライディングウィンドウ)
+
+の 3 つに分けて保存し、プロンプトはトークン予算の範囲に収まるように組み立てる。
+ウィンドウからあふれたメッセージは CHAT_SUMMARY_CHUNK 件ずつ要約に畳み込んで履歴から捨てるので、
+保存量もプロンプトも会話の長さによらずほぼ一定になる。
+
+【設定 (環境変数)】
+  CHAT_TOKEN_BUDGET       プロンプト全体のトークン予算 (推定値)
+  CHAT_WINDOW_MESSAGES    そのまま残す直近メッセージの件数 (user / assistant それぞれ 1 件)
+  CHAT_SUMMARY_CHUNK      1 回の要約で畳み込むメッセージの件数
+  CHAT_SUMMARY_MAX_CHARS  要約の最大文字数
+"""
+
+import os
+
+###############################################################################
+# 設定 (環境変数)
+###############################################################################
+CHAT_TOKEN_BUDGET = int(os.getenv("CHAT_TOKEN_BUDGET", "2000"))
+CHAT_WINDOW_MESSAGES = int(os.getenv("CHAT_WINDOW_MESSAGES", "8"))
+CHAT_SUMMARY_CHUNK = int(os.getenv("CHAT_SUMMARY_CHUNK", "4"))
+CHAT_SUMMARY_MAX_CHARS = int(os.getenv("CHAT_SUMMARY_MAX_CHARS", "600"))
+
+PROMPT_HEADER = "以下の対話履歴を参考にして回答してください。"
+
+
+def estimate_tokens(text):
+    """
+    トークン数のおおよその見積もり。
+    英数字は 4 文字で 1 トークン、日本語などの非 ASCII 文字は 1 文字 1 トークンとして数える。
+    """
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+
+def new_conversation(pinned=None):
+    """空の会話レコードを作る"""
+    return {"pinned": pinned, "summary": "", "summarized": 0, "messages": []}
+
+
+def normalize(record):
+    """以前のメッセージのリスト形式で保存された会話も会話レコードとして扱う"""
+    if record is None:
+        return new_conversation()
+    if isinstance(record, list):
+        return {**new_conversation(), "messages": list(record)}
+    return record
+
+
+def _format_message(message):
+    return f"{message['role']}: {message['content']}"
+
+
+class ChatContext:
+    def __init__(self, token_budget=CHAT_TOKEN_BUDGET, window_messages=CHAT_WINDOW_MESSAGES,
+                 summary_chunk=CHAT_SUMMARY_CHUNK, summary_max_chars=CHAT_SUMMARY_MAX_CHARS):
+        """
+        Args:
+            token_budget (int): プロンプト全体のトークン予算
+            window_messages (int): 要約せずに残す直近メッセージの件数
+            summary_chunk (int): ウィンドウを何件あふれたら要約に畳み込むか
+            summary_max_chars (int): 要約の最大文字数
+        """
+        self.token_budget = token_budget
+        self.window_messages = window_messages
+        self.summary_chunk = max(1, summary_chunk)
+        self.summary_max_chars = summary_max_chars
+
+    ###########################################################################
+    # 会話レコードの更新 (どれも新しいレコードを返し、引数は書き換えない)
+    ###########################################################################
+    def append(self, record, role, content):
+        record = normalize(record)
+        return {**record, "messages": record["messages"] + [{"role": role, "content": content}]}
+
+    def discard(self, record, role, content):
+        """append で追加したメッセージを取り消す (後ろから探して最初に一致した 1 件だけ取り除く)"""
+        record = normalize(record)
+        messages = record["messages"]
+        for i in range(len(messages) - 1, -1, -1):
+            if messages[i] == {"role": role, "content": content}:
+                return {**record, "messages": messages[:i] + messages[i + 1:]}
+        return record
+
+    def pin(self, record, situation):
+        """対戦状況を固定コンテキストとして設定する (新しい分析で上書き)"""
+        return {**normalize(record), "pinned": situation}
+
+    def messages_to_fold(self, record):
+        """
+        要約に畳み込むべき古いメッセージを返す。
+        ウィンドウを summary_chunk 件以上あふれたときだけ返し、それ以外は空リスト。
+        """
+        record = normalize(record)
+        overflow = len(record["messages"]) - self.window_messages
+        if overflow < self.summary_chunk:
+            return []
+        return record["messages"][:overflow - overflow % self.summary_chunk]
+
+    def apply_fold(self, record, summarized, n_messages, summary):
+        """
+        messages_to_fold で取り出した n_messages 件を要約 summary に置き換える。
+        要約の作成中に別の畳み込みが済んでいた (summarized が変わっていた) ら何もしない。
+
+        Args:
+            record (dict): 最新の会話レコード
+            summarized (int): 要約を作り始めたときの record["summarized"]
+            n_messages (int): 畳み込んだメッセージの件数
+            summary (str): 新しい要約 (それまでの要約を含む)
+        """
+        record = normalize(record)
+        if record["summarized"] != summarized:
+            return record
+        return {
+            **record,
+            "summary": summary[:self.summary_max_chars],
+            "summarized": summarized + n_messages,
+            "messages": record["messages"][n_messages:]
+        }
+
+    def summary_prompt(self, summary, messages):
+        """それまでの要約に古いメッセージを追加で畳み込むための要約プロンプト"""
+        lines = "\n".join(_format_message(m) for m in messages)
+        return (
+            f"スマッシュブラザーズのコーチングの対話を要約してください。\n"
+            f"これまでの要約:\n{summary or '(なし)'}\n"
+            f"要約に追加する対話:\n{lines}\n"
+            f"話題・質問・助言の要点を残し、{self.summary_max_chars}文字以内の日本語で要約だけを出力してください。"
+        )
+
+    ###########################################################################
+    # プロンプトの組み立て
+    ###########################################################################
+    def build_prompt(self, record):
+        """
+        固定コンテキスト + 要約 + 予算に収まる範囲の直近メッセージでプロンプトを作る。
+        最新のメッセージ (今回の質問) は予算を超えても必ず入れる。
+        """
+        record = normalize(record)
+        head = [PROMPT_HEADER]
+        if record["pinned"]:
+            head.append(f"[分析中の対戦状況]\n{record['pinned']}")
+        if record["summary"]:
+            head.append(f"[これまでの対話の要約]\n{record['summary']}")
+        tail = "assistant:"
+
+        remaining = self.token_budget - sum(estimate_tokens(part) for part in head) - estimate_tokens(tail)
+        recent = []
+        for message in reversed(record["messages"]):
+            line = _format_message(message)
+            cost = estimate_tokens(line)
+            if recent and cost > remaining:
+                break
+            recent.append(line)
+            remaining -= cost
+        recent.reverse()
+        return "\n".join(head + recent + [tail])
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+db_pool.py
+
+smash_characters.db を読み込み専用で開く、スレッドごとの SQLite 接続プール。
+
+recommend_actions などは呼ばれるたびに sqlite3.connect -> close していたため、
+gunicorn のスレッド (--threads 8) ごとに毎回ファイルを開き、スキーマを読み、SQL をコンパイルし直していた。
+ReadOnlyPool はスレッドごとに 1 本の接続を開いたまま使い回す。
+
+- URI の mode=ro で開き、誤って書き込むことがないようにする
+- immutable=1 でロックと変更確認を省く (-wal が残っているときは WAL を読むために付けない)
+- PRAGMA mmap_size / cache_size でページをメモリマップ・キャッシュから読む
+- 接続ごとのステートメントキャッシュ (cached_statements) で、同じ SQL 文字列はコンパイル済みの文を再利用する
+
+immutable で開いた接続は DB ファイルが書き換わっても気づかないので、
+ファイルの更新 (mtime / サイズ) を check_interval 秒に 1 回確認し、変わっていたら世代を進める。
+各スレッドは次に接続を取るときに古い世代の接続を自分で閉じて開き直す (他スレッドの接続は閉じない)。
+
+【使い方】
+  pool = get_pool("smash_characters.db")     # 同じパスには同じプールを返す
+  rows = pool.execute("SELECT * FROM air_moves WHERE character_id=?", (1,)).fetchall()
+  conn = pool.connection()                   # 現在のスレッドの接続 (close しない)
+  pool.invalidate()                          # DB を差し替えたときに全スレッドの接続を開き直させる
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from urllib.request import pathname2url
+
+###############################################################################
+# 設定 (環境変数)
+###############################################################################
+DB_POOL_MMAP_SIZE = int(os.getenv("DB_POOL_MMAP_SIZE", str(64 * 1024 * 1024)))
+# 負の値は KiB 単位 (SQLite の cache_size と同じ)
+DB_POOL_CACHE_SIZE = int(os.getenv("DB_POOL_CACHE_SIZE", "-16384"))
+DB_POOL_CACHED_STATEMENTS = int(os.getenv("DB_POOL_CACHED_STATEMENTS", "256"))
+DB_POOL_IMMUTABLE = os.getenv("DB_POOL_IMMUTABLE", "1") == "1"
+# DBファイルが更新されていないか確認する間隔 (秒)
+DB_POOL_CHECK_INTERVAL = float(os.getenv("DB_POOL_CHECK_INTERVAL", "1.0"))
+
+
+def db_stamp(db_path):
+    """DB ファイルと -wal の (mtime, サイズ)。WAL の書き込みは本体より先に -wal に入るので両方見る"""
+    stamp = []
+    for path in (db_path, db_path + "-wal"):
+        try:
+            st = os.stat(path)
+            stamp.append((st.st_mtime_ns, st.st_size))
+        except OSError:
+            stamp.append(None)
+    return tuple(stamp)
+
+
+def readonly_uri(db_path, immutable=True):
+    """読み込み専用で開く URI (immutable は -wal にコミット済みの書き込みが残っていないときだけ付ける)"""
+    uri = "file:" + pathname2url(os.path.abspath(db_path)) + "?mode=ro"
+    wal_size = os.path.getsize(db_path + "-wal") if os.path.exists(db_path + "-wal") else 0
+    if immutable and wal_size == 0:
+        uri += "&immutable=1"
+    return uri
+
+
+class ReadOnlyPool:
+    """
+    スレッドごとに読み込み専用の接続を 1 本ずつ持つプール。
+
+    接続はそのスレッドでしか使わないので、接続どうしの排他は要らない。
+    """
+
+    def __init__(self, db_path, mmap_size=DB_POOL_MMAP_SIZE, cache_size=DB_POOL_CACHE_SIZE,
+                 cached_statements=DB_POOL_CACHED_STATEMENTS, immutable=DB_POOL_IMMUTABLE,
+                 check_interval=DB_POOL_CHECK_INTERVAL):
+        self.db_path = db_path
+        self.mmap_size = mmap_size
+        self.cache_size = cache_size
+        self.cached_statements = cached_statements
+        self.immutable = immutable
+        self.check_interval = check_interval
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._stamp = db_stamp(db_path)
+        self._next_check = time.monotonic() + check_interval
+        self._stats = {"opened": 0, "reopened": 0, "invalidations": 0}
+
+    def _open(self):
+        conn = sqlite3.connect(readonly_uri(self.db_path, self.immutable), uri=True,
+                               cached_statements=self.cached_statements)
+        conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        conn.execute(f"PRAGMA cache_size={int(self.cache_size)}")
+        return conn
+
+    def _check_changed(self):
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        self._next_check = now + self.check_interval
+        stamp = db_stamp(self.db_path)
+        if stamp != self._stamp:
+            with self._lock:
+                self._stamp = stamp
+                self._generation += 1
+                self._stats["invalidations"] += 1
+
+    def invalidate(self):
+        """全スレッドの接続を、次に使うときに開き直させる"""
+        with self._lock:
+            self._stamp = db_stamp(self.db_path)
+            self._generation += 1
+            self._stats["invalidations"] += 1
+
+    def connection(self):
+        """
+        現在のスレッドの接続を返す (無い・古い世代なら開く)。
+        呼び出し側では close しないこと。
+        """
+        self._check_changed()
+        local = self._local
+        conn = getattr(local, "conn", None)
+        if conn is not None and local.generation == self._generation:
+            return conn
+        if conn is not None:
+            conn.close()
+        generation = self._generation
+        local.conn = self._open()
+        local.generation = generation
+        with self._lock:
+            self._stats["reopened" if conn is not None else "opened"] += 1
+        return local.conn
+
+    def execute(self, sql, params=()):
+        """現在のスレッドの接続で SQL を実行してカーソルを返す (同じ SQL 文字列はコンパイル済みの文を使う)"""
+        return self.connection().execute(sql, params)
+
+    def close(self):
+        """現在のスレッドの接続を閉じる (スレッドを終えるときなど)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def metrics(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["generation"] = self._generation
+        stats["db_path"] = self.db_path
+        return stats
+
+
+###############################################################################
+# DB パスごとのプール
+###############################################################################
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path):
+    """db_path の ReadOnlyPool を返す (同じパスには同じプール)"""
+    key = os.path.abspath(db_path)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ReadOnlyPool(db_path)
+        return pool
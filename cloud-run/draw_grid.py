@@ -1,10 +1,197 @@
 from PIL import Image, ImageDraw, ImageFont
+import numpy as np
+import contextlib
+import functools
 import os
 import math
 
 def create_font(size=20):  # フォントサイズを大きく
     return ImageFont.load_default()
 
+# 同じ条件のオーバーレイを何枚までキャッシュするか (1920x1080 で 1 枚約 8MB)
+OVERLAY_CACHE_SIZE = int(os.getenv("GRID_OVERLAY_CACHE_SIZE", "8"))
+
+# 描画エンジン: "pil" (ImageDraw + alpha_composite) / "numpy" (配列に直接書き込む)
+RENDER_ENGINE = os.getenv("GRID_RENDER_ENGINE", "pil")
+RENDER_ENGINES = ("pil", "numpy")
+
+# 暗幕の透明度
+DARKEN_ALPHA = 40
+
+# ヒートマップの最大の透明度 (強さ 1.0 のマス)
+HEATMAP_MAX_ALPHA = 150
+
+def iter_cell_labels(width, height, columns, rows, origin_cell, show_cell_numbers, font):
+    """
+    各マスに描くラベルの ((x, y), 文字列) を返す。PIL / NumPy の両エンジンで共通の配置。
+    """
+    cell_width = width / columns
+    cell_height = height / rows
+
+    origin_index = origin_cell - 1
+    origin_row = origin_index // columns
+    origin_col = origin_index % columns
+
+    for row in range(rows):
+        for col in range(columns):
+            center_x = (col + 0.5) * cell_width
+            center_y = (row + 0.5) * cell_height
+            cell_number = row * columns + col + 1
+            rel_x = col - origin_col
+            rel_y = row - origin_row
+
+            # 座標を表示
+            coord_text = f"({rel_x},{rel_y})"
+
+            # サイズ計算
+            text_height = 30  # 高さを増やして余裕を持たせる
+
+            # セル番号の処理
+            if show_cell_numbers:
+                # マス番号を描画
+                cell_text = str(cell_number)
+                cell_width_px = font.getsize(cell_text)[0]
+                yield (center_x - cell_width_px/2, center_y - text_height), cell_text
+            else:
+                # 座標のみを描画
+                coord_width_px = font.getsize(coord_text)[0]
+                yield (center_x - coord_width_px/2, center_y - text_height/6), coord_text
+
+@functools.lru_cache(maxsize=OVERLAY_CACHE_SIZE)
+def render_grid_overlay(
+    width,
+    height,
+    columns,
+    rows,
+    origin_cell,
+    line_color,
+    line_width,
+    show_cell_numbers
+):
+    """
+    暗幕 + グリッド線 + マス目ラベルを描いた RGBA レイヤーを作る。
+    同じ引数なら中身は毎回同じなので lru_cache で使い回す (返り値は書き換えないこと)。
+    """
+    # 画像の暗さを軽減（透明度を下げる）
+    overlay = Image.new('RGBA', (width, height), (0, 0, 0, DARKEN_ALPHA))  # 透明度を半分に減らす
+    draw = ImageDraw.Draw(overlay)
+    font = create_font()
+    cell_width = width / columns
+    cell_height = height / rows
+
+    # グリッド線を描画
+    for i in range(columns + 1):
+        x = i * cell_width
+        draw.line([(x, 0), (x, height)], fill=line_color, width=line_width)
+    for i in range(rows + 1):
+        y = i * cell_height
+        draw.line([(0, y), (width, y)], fill=line_color, width=line_width)
+
+    # マス目情報を描画
+    for xy, text in iter_cell_labels(width, height, columns, rows, origin_cell, show_cell_numbers, font):
+        draw.text(xy, text, fill=line_color, font=font)
+    return overlay
+
+def overlay_cache_info():
+    """オーバーレイキャッシュのヒット数・ミス数 (functools の CacheInfo)"""
+    return render_grid_overlay.cache_info()
+
+def clear_overlay_cache():
+    render_grid_overlay.cache_clear()
+    _label_stamps.cache_clear()
+
+###############################################################################
+# NumPy エンジン
+# 暗幕は輝度テーブル 1 回の変換、線はスライス代入、文字は事前にラスタライズした
+# グリフのビットマップを貼るだけにする。
+###############################################################################
+@functools.lru_cache(maxsize=1)
+def _darken_lut():
+    """
+    暗幕 (黒, alpha=40) の合成は各画素を 215/255 倍する処理だが、
+    PIL の alpha_composite と丸めまで一致させるため 0〜255 を実際に合成して対応表を作る。
+    """
+    ramp = Image.frombytes('L', (256, 1), bytes(range(256))).convert('RGBA')
+    shade = Image.new('RGBA', ramp.size, (0, 0, 0, DARKEN_ALPHA))
+    return np.asarray(Image.alpha_composite(ramp, shade))[0, :, 0].copy()
+
+@functools.lru_cache(maxsize=4096)
+def _glyph_mask(text):
+    """ラベル文字列を 1 回だけラスタライズして bool 配列にする"""
+    font = create_font()
+    glyph = Image.new('L', font.getsize(text), 0)
+    ImageDraw.Draw(glyph).text((0, 0), text, fill=255, font=font)
+    return np.asarray(glyph) > 0
+
+@functools.lru_cache(maxsize=OVERLAY_CACHE_SIZE)
+def _label_stamps(width, height, columns, rows, origin_cell, show_cell_numbers):
+    """貼り付け位置 (画像内にクリップ済み) とグリフの切り出しを事前計算しておく"""
+    stamps = []
+    for (x, y), text in iter_cell_labels(width, height, columns, rows, origin_cell, show_cell_numbers, create_font()):
+        mask = _glyph_mask(text)
+        # ImageDraw.text と同じく座標は整数に切り捨てて貼る
+        x0, y0 = int(x), int(y)
+        gh, gw = mask.shape
+        x1, y1 = max(x0, 0), max(y0, 0)
+        x2, y2 = min(x0 + gw, width), min(y0 + gh, height)
+        if x1 >= x2 or y1 >= y2:
+            continue
+        stamps.append((slice(y1, y2), slice(x1, x2), mask[y1 - y0:y2 - y0, x1 - x0:x2 - x0]))
+    return stamps
+
+def _line_span(pos, line_width, limit):
+    """ImageDraw.line (水平/垂直) が塗る範囲 [start, stop) と同じになるように計算する"""
+    start = int(pos) - (line_width - 1) // 2
+    return max(start, 0), min(start + line_width, limit)
+
+def render_grid_numpy(
+    pixels,
+    columns,
+    rows,
+    origin_cell,
+    line_color,
+    line_width,
+    show_cell_numbers
+):
+    """
+    (height, width, 3) の uint8 配列にその場で暗幕・グリッド線・ラベルを描き込む。
+    PIL エンジンと画素単位で同じ結果になる (Pillow の既定ビットマップフォント使用時)。
+    line_width が 0 以下でも ImageDraw.line と同じく 1px の線を引く。
+    """
+    height, width = pixels.shape[:2]
+    line_width = max(line_width, 1)
+    color = np.asarray(line_color, dtype=np.uint8)
+    cell_width = width / columns
+    cell_height = height / rows
+
+    # 暗幕
+    np.take(_darken_lut(), pixels, out=pixels)
+
+    # グリッド線
+    for i in range(columns + 1):
+        x1, x2 = _line_span(i * cell_width, line_width, width)
+        pixels[:, x1:x2] = color
+    for i in range(rows + 1):
+        y1, y2 = _line_span(i * cell_height, line_width, height)
+        pixels[y1:y2, :] = color
+
+    # マス目情報
+    for ys, xs, mask in _label_stamps(width, height, columns, rows, origin_cell, show_cell_numbers):
+        pixels[ys, xs][mask] = color
+    return pixels
+
+def heatmap_layer(heatmap, width, height, color=(255, 0, 0), max_alpha=HEATMAP_MAX_ALPHA):
+    """
+    (rows, columns) の強さ (0〜1、NaN は 0) から、マスごとに color を塗った RGBA レイヤーを作る。
+    マス数ぶんの小さな画像を NEAREST で画像サイズに拡大するので、マスの境界はグリッド線と揃う。
+    """
+    strength = np.nan_to_num(np.asarray(heatmap, dtype=float), nan=0.0).clip(0.0, 1.0)
+    rows, columns = strength.shape
+    cells = np.zeros((rows, columns, 4), dtype=np.uint8)
+    cells[..., :3] = np.asarray(color, dtype=np.uint8)
+    cells[..., 3] = np.round(strength * max_alpha).astype(np.uint8)
+    return Image.fromarray(cells, 'RGBA').resize((width, height), Image.NEAREST)
+
 def draw_grid_with_relative_coords(
     image_path,
     output_path,
@@ -13,72 +200,49 @@ def draw_grid_with_relative_coords(
     origin_cell=347,
     line_color=(255, 255, 255),
     line_width=2,  # 線を太く
-    show_cell_numbers=True  # 新しいパラメータ
+    show_cell_numbers=True,  # 新しいパラメータ
+    engine=None,
+    image=None,
+    heatmap=None,
+    heatmap_color=(255, 0, 0)
 ):
-    with Image.open(image_path) as img:
+    """
+    engine: "pil" / "numpy" (省略時は環境変数 GRID_RENDER_ENGINE、未設定なら "pil")
+    image: デコード済みの PIL 画像 (指定時は image_path を開き直さない。中身は書き換えない)
+    heatmap: (rows, columns) のマスごとの強さ 0〜1 (指定時はグリッドの下に heatmap_color で塗る)
+    戻り値: 元画像の (width, height)
+    """
+    engine = engine or RENDER_ENGINE
+    if engine not in RENDER_ENGINES:
+        raise ValueError(f"engine は {', '.join(RENDER_ENGINES)} のいずれかを指定してください")
+
+    source = contextlib.nullcontext(image) if image is not None else Image.open(image_path)
+    with source as img:
         if img.mode != 'RGB':
             img = img.convert('RGB')
         width, height = img.size
-        cell_width = width / columns
-        cell_height = height / rows
-
-        # 画像の暗さを軽減（透明度を下げる）
-        overlay = Image.new('RGBA', img.size, (0, 0, 0, 40))  # 透明度を半分に減らす
-        img = Image.alpha_composite(img.convert('RGBA'), overlay).convert('RGB')
-        draw = ImageDraw.Draw(img)
-        font = create_font()
-        
-        origin_index = origin_cell - 1
-        origin_row = origin_index // columns
-        origin_col = origin_index % columns
-
-        # グリッド線を描画
-        for i in range(columns + 1):
-            x = i * cell_width
-            draw.line([(x, 0), (x, height)], fill=line_color, width=line_width)
-        for i in range(rows + 1):
-            y = i * cell_height
-            draw.line([(0, y), (width, y)], fill=line_color, width=line_width)
-
-        # マス目情報を描画
-        for row in range(rows):
-            for col in range(columns):
-                center_x = (col + 0.5) * cell_width
-                center_y = (row + 0.5) * cell_height
-                cell_number = row * columns + col + 1
-                rel_x = col - origin_col
-                rel_y = row - origin_row
-
-                # 座標を表示
-                coord_text = f"({rel_x},{rel_y})"
-                coord_width_px = font.getsize(coord_text)[0]
+        if heatmap is not None:
+            img = Image.alpha_composite(
+                img.convert('RGBA'), heatmap_layer(heatmap, width, height, heatmap_color)
+            ).convert('RGB')
 
-                # サイズ計算
-                text_height = 30  # 高さを増やして余裕を持たせる
-
-                # セル番号の処理
-                if show_cell_numbers:
-                    cell_text = str(cell_number)
-                    cell_width_px = font.getsize(cell_text)[0]
-                    text_width = max(cell_width_px, coord_width_px)
-
-                    # マス番号を描画
-                    draw.text(
-                        (center_x - cell_width_px/2, center_y - text_height),
-                        cell_text,
-                        fill=line_color,
-                        font=font
-                    )
-                else:
-                    # 座標のみを描画
-                    draw.text(
-                        (center_x - coord_width_px/2, center_y - text_height/6),
-                        coord_text,
-                        fill=line_color,
-                        font=font
-                    )
+        if engine == "numpy":
+            pixels = np.array(img)
+            render_grid_numpy(
+                pixels, columns, rows, origin_cell,
+                tuple(line_color), line_width, show_cell_numbers
+            )
+            img = Image.fromarray(pixels)
+        else:
+            # 暗幕・線・文字はキャッシュ済みのレイヤーを 1 回合成するだけ
+            overlay = render_grid_overlay(
+                width, height, columns, rows, origin_cell,
+                tuple(line_color), line_width, show_cell_numbers
+            )
+            img = Image.alpha_composite(img.convert('RGBA'), overlay).convert('RGB')
 
         img.save(output_path, quality=95)
+    return width, height
 
 if __name__ == "__main__":
     draw_grid_with_relative_coords(
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+gemini_pool.py
+
+プロセス全体で共有する Gemini モデルのプール。
+
+calc_distance は毎回 ImageAnalyzer() を、chat は毎回 genai.GenerativeModel(...) を作っていたが、
+モデルオブジェクトとその下の gRPC クライアント (トランスポート) は使い回せる。
+ModelPool.get(name) は初回だけモデルを作り (遅延初期化)、以降は同じインスタンスを返す。
+warmup() を起動時に呼べば、最初のリクエストでクライアント作成を待たされることもない。
+
+GEMINI_BACKEND=fake にすると、ネットワークに出ずに決まった文字列を返す FakeGenerativeModel を使う
+(オフラインでのベンチマーク・動作確認用。GOOGLE_API_KEY も不要)。
+"""
+
+import os
+import threading
+import time
+
+###############################################################################
+# 設定 (環境変数)
+###############################################################################
+GEMINI_BACKEND = os.getenv("GEMINI_BACKEND", "google")
+GEMINI_MODEL_NAME = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
+# fake バックエンドの応答にかける疑似レイテンシ (秒)
+GEMINI_FAKE_LATENCY = float(os.getenv("GEMINI_FAKE_LATENCY", "0"))
+# fake バックエンドでプロンプト 1000 文字ごとに追加するレイテンシ (秒)。入力の長さによる遅延の再現用
+GEMINI_FAKE_LATENCY_PER_KCHAR = float(os.getenv("GEMINI_FAKE_LATENCY_PER_KCHAR", "0"))
+# 1 にすると generate_content(stream=True) で回答を断片ごとに受け取る (0 で一括)
+GEMINI_STREAM = os.getenv("GEMINI_STREAM", "1") == "1"
+# fake バックエンドのストリーミングで 1 断片に入れる文字数
+FAKE_CHUNK_CHARS = 16
+
+GEMINI_BACKENDS = ("google", "fake")
+
+
+###############################################################################
+# ローカルの偽モデル (generate_content の戻り値の .text だけ真似る)
+###############################################################################
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeGenerativeModel:
+    def __init__(self, model_name, latency=GEMINI_FAKE_LATENCY, latency_per_kchar=GEMINI_FAKE_LATENCY_PER_KCHAR):
+        self.model_name = model_name
+        self.latency = latency
+        self.latency_per_kchar = latency_per_kchar
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        prompt = next((c for c in contents if isinstance(c, str)), "")
+        delay = self.latency + self.latency_per_kchar * len(prompt) / 1000
+        n_images = sum(1 for c in contents if not isinstance(c, str))
+        text = f"(ローカル応答: {self.model_name}) プロンプト {len(prompt)} 文字 / 画像 {n_images} 枚を受け取りました。"
+        if stream:
+            return self._stream(text, delay)
+        if delay:
+            time.sleep(delay)
+        return FakeResponse(text)
+
+    def _stream(self, text, delay):
+        # 生成にかかる時間を断片ごとに均等に割り振る
+        chunks = [text[i:i + FAKE_CHUNK_CHARS] for i in range(0, len(text), FAKE_CHUNK_CHARS)]
+        for chunk in chunks:
+            if delay:
+                time.sleep(delay / len(chunks))
+            yield FakeResponse(chunk)
+
+
+def _create_google_model(model_name):
+    import google.generativeai as genai
+    return genai.GenerativeModel(model_name)
+
+
+def _warmup_google_model(model):
+    # GenerativeModel は最初の generate_content で gRPC クライアントを作るので、先に作って持たせておく
+    from google.generativeai import client
+    if getattr(model, "_client", "unsupported") is None:
+        model._client = client.get_default_generative_client()
+
+
+###############################################################################
+# モデルプール
+###############################################################################
+class ModelPool:
+    def __init__(self, backend=GEMINI_BACKEND):
+        if backend not in GEMINI_BACKENDS:
+            raise ValueError(f"GEMINI_BACKEND は {', '.join(GEMINI_BACKENDS)} のいずれかを指定してください")
+        self.backend = backend
+        self._models = {}
+        self._lock = threading.Lock()
+        self.created = 0
+
+    def get(self, model_name=GEMINI_MODEL_NAME):
+        """model_name のモデルを返す。無ければ 1 回だけ作る (スレッドセーフ)"""
+        model = self._models.get(model_name)
+        if model is not None:
+            return model
+        with self._lock:
+            model = self._models.get(model_name)
+            if model is None:
+                if self.backend == "fake":
+                    model = FakeGenerativeModel(model_name)
+                else:
+                    model = _create_google_model(model_name)
+                self._models[model_name] = model
+                self.created += 1
+        return model
+
+    def warmup(self, model_names=(GEMINI_MODEL_NAME,)):
+        """起動時にモデルとクライアントを作っておく"""
+        for name in model_names:
+            model = self.get(name)
+            if self.backend == "google":
+                _warmup_google_model(model)
+
+
+def iter_text(model, contents, stream=GEMINI_STREAM):
+    """
+    generate_content の回答テキストを断片ごとに返すジェネレータ。
+    stream=False なら回答全体を 1 つの断片として返す。
+    """
+    if not stream:
+        yield model.generate_content(contents).text
+        return
+    for chunk in model.generate_content(contents, stream=True):
+        yield chunk.text
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+grid_geometry.py
+
+画像上のピクセル座標 -> マス目 (マス番号・列・行・原点からの相対座標) の変換と、2 点間の距離の計算。
+calc_distance と動画解析 (video_pipeline.py) で同じ式を使うためにまとめたもの。
+ブラウザでマス目を描くための JSON (grid_layout) もここで作る (draw_grid.py と同じ線の位置・ラベル)。
+
+マスの大きさは 画像の幅 / columns, 画像の高さ / rows、マス番号は左上から 1 始まり、
+相対座標は origin_cell のマスを (0, 0) とした (列の差, 行の差)。
+
+【使い方】
+  p1 = locate_cell(x1, y1, width, height, columns=33, rows=16, origin_cell=347)
+  p2 = locate_cell(x2, y2, width, height, columns=33, rows=16, origin_cell=347)
+  dx, dy, dist = cell_offset(p1, p2)
+  layout = grid_layout(1920, 1080, columns=33, rows=16, origin_cell=347)   # /api/grid_geometry の中身
+"""
+
+import functools
+from collections import namedtuple
+
+
+class CellPosition(namedtuple("CellPosition", ["cell", "col", "row", "rel_x", "rel_y"])):
+    """
+    cell: マス番号 (1 始まり)
+    col / row: 列・行 (0 始まり)
+    rel_x / rel_y: origin_cell からの相対座標
+    """
+
+    __slots__ = ()
+
+
+def origin_col_row(origin_cell, columns):
+    """origin_cell の (列, 行)"""
+    origin_index = origin_cell - 1
+    return origin_index % columns, origin_index // columns
+
+
+def locate_cell(x, y, width, height, columns, rows, origin_cell):
+    """
+    ピクセル座標 (x, y) がどのマスにあるかを返す。
+
+    Args:
+        x, y (float): 画像上のピクセル座標
+        width, height (int): 画像の大きさ
+        columns, rows (int): マス目の数
+        origin_cell (int): 相対座標の原点にするマス番号
+    Returns:
+        CellPosition
+    """
+    cell_width = width / columns
+    cell_height = height / rows
+    origin_col, origin_row = origin_col_row(origin_cell, columns)
+    col = int(x // cell_width)
+    row = int(y // cell_height)
+    return CellPosition(row * columns + col + 1, col, row, col - origin_col, row - origin_row)
+
+
+def cell_offset(p1, p2):
+    """
+    p1 から見た p2 のマス目上の差分と、ユークリッド距離 (マス単位)。
+
+    Returns:
+        tuple: (dx, dy, dist)
+    """
+    dx = p2.rel_x - p1.rel_x
+    dy = p2.rel_y - p1.rel_y
+    return dx, dy, (dx**2 + dy**2) ** 0.5
+
+
+@functools.lru_cache(maxsize=64)
+def _grid_layout(width, height, columns, rows, origin_cell, show_cell_numbers):
+    cell_width = width / columns
+    cell_height = height / rows
+    origin_col, origin_row = origin_col_row(origin_cell, columns)
+    if show_cell_numbers:
+        labels = [str(n) for n in range(1, columns * rows + 1)]
+    else:
+        labels = [f"({col - origin_col},{row - origin_row})" for row in range(rows) for col in range(columns)]
+    return {
+        "width": width,
+        "height": height,
+        "columns": columns,
+        "rows": rows,
+        "origin_cell": origin_cell,
+        "origin": {
+            "col": origin_col,
+            "row": origin_row,
+            "rect": [round(origin_col * cell_width, 2), round(origin_row * cell_height, 2),
+                     round(cell_width, 2), round(cell_height, 2)],
+        },
+        "x_lines": [round(i * cell_width, 2) for i in range(columns + 1)],
+        "y_lines": [round(i * cell_height, 2) for i in range(rows + 1)],
+        "labels": labels,
+    }
+
+
+def grid_layout(width, height, columns, rows, origin_cell, show_cell_numbers=False):
+    """
+    ブラウザでマス目を描くための JSON にできる辞書 (draw_grid.py のマス目と同じ位置)。
+    マス (col, row) の矩形は x_lines[col]〜x_lines[col + 1], y_lines[row]〜y_lines[row + 1]、
+    labels は左上から行ごとの順 (マス番号 - 1 番目) に、マスの中央に描く文字列。
+    同じ引数なら同じ辞書を返すので書き換えないこと。
+
+    Returns:
+        dict: {"width", "height", "columns", "rows", "origin_cell",
+               "origin": {"col", "row", "rect": [x, y, w, h]}, "x_lines", "y_lines", "labels"}
+    """
+    return _grid_layout(width, height, columns, rows, origin_cell, bool(show_cell_numbers))
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+hitbox.py
+
+技の横リーチ (_x) ・縦リーチ (_y) とキャラの大きさ (characters.size_x / size_y) から、
+「マス目上の差分 (dx, dy) にいる相手に、どの技が当たるか」を判定する 2D の当たり判定モデル。
+
+recommend_actions は距離 sqrt(dx^2 + dy^2) を全数値カラムと比べるので、
+fair_damage や jab_startup まで「届く」扱いになり、横と縦のリーチの違いも無視される。
+HitboxModel は技ごとに次の 2 つの箱が重なるかで判定する (どちらも軸に平行、境界を含む)。
+
+  攻撃側の技の判定: 攻撃側の中心から横 ±reach_x、縦 ±reach_y の箱
+                    (向きはデータに無いので左右・上下とも対称に扱う)
+  相手のやられ判定: 相手の中心 (dx, dy) から横 ±size_x/2、縦 ±size_y/2 の箱
+
+  当たる <=> |dx| <= reach_x + 相手の size_x / 2  かつ  |dy| <= reach_y + 相手の size_y / 2
+
+リーチ・大きさ・dx / dy はすべてマス単位 (calc_distance の距離と同じ単位) として扱う。
+横か縦の片方だけ値がある技は、もう片方のリーチを 0 とする。どちらも無い技は存在しない扱い。
+
+全キャラ × 全技のリーチを (キャラ数, 技数) の配列で持ち、判定は NumPy のブロードキャストで行う。
+1 キャラについての判定は技数ぶんの比較だけなので、登録キャラが 2 人でも 87 人でも時間は変わらない。
+
+【使い方】
+  model = move_index.hitbox                    # MoveIndex が DB の読み込み時に作る
+  hits = model.connecting_moves(1, 2, dx=4, dy=-1, k=5)
+  mask = model.hit_mask(1, 2, dxs, dys)        # (len(dxs), 技数) の bool 配列
+  everyone = model.hit_mask_all(2, dx=4, dy=-1)  # (キャラ数, 技数): 全キャラの技が当たるか
+  heat = model.threat_map(1, 2, attacker_col=10, attacker_row=8)  # 全マスの当たる技の数・最大ダメージ・最速発生
+"""
+
+import numpy as np
+
+# 並び替えキー: startup=発生の早い順 / damage=ダメージの大きい順 / reach=リーチの短い順
+SORT_KEYS = ("startup", "damage", "reach")
+
+
+class HitboxModel:
+    """
+    全キャラの技のリーチ・ダメージ・発生フレームを (キャラ数, 技数) の配列で持つ当たり判定モデル。
+
+    moves[j]: j 番目の技の (カテゴリ, 技名)
+    reach_x / reach_y: 技の判定の半幅・半高 (技を持たないキャラは NaN)
+    damage / startup: 技のダメージ・発生フレーム (値が無ければ NaN)
+    sizes: {キャラID: (size_x, size_y)} (値が無ければ 0)
+    """
+
+    def __init__(self, character_ids, sizes, moves, move_values):
+        """
+        Args:
+            character_ids (list): キャラIDのリスト (行の並び)
+            sizes (dict): {キャラID: (size_x, size_y)}
+            moves (list): (カテゴリ, 技名) のリスト (列の並び。投げ・ダッシュの基本技の技名は "")
+            move_values (dict): {(キャラID, 技の列番号): (reach_x, reach_y, damage, startup)} (無い値は None)
+        """
+        self.character_ids = list(character_ids)
+        self.row_of = {cid: i for i, cid in enumerate(self.character_ids)}
+        self.moves = list(moves)
+        shape = (len(self.character_ids), len(self.moves))
+        self.reach_x = np.full(shape, np.nan)
+        self.reach_y = np.full(shape, np.nan)
+        self.damage = np.full(shape, np.nan)
+        self.startup = np.full(shape, np.nan)
+        for (cid, j), (reach_x, reach_y, damage, startup) in move_values.items():
+            r = self.row_of[cid]
+            if reach_x is None and reach_y is None:
+                continue
+            self.reach_x[r, j] = reach_x if reach_x is not None else 0.0
+            self.reach_y[r, j] = reach_y if reach_y is not None else 0.0
+            self.damage[r, j] = damage if damage is not None else np.nan
+            self.startup[r, j] = startup if startup is not None else np.nan
+        self.sizes = {cid: (size_x or 0.0, size_y or 0.0) for cid, (size_x, size_y) in sizes.items()}
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.reach_x, self.reach_y, self.damage, self.startup))
+
+    def defender_size(self, defender_id):
+        """相手の (size_x, size_y)。未登録のキャラは大きさ 0 (点) として扱う"""
+        return self.sizes.get(defender_id, (0.0, 0.0))
+
+    def hit_mask(self, attacker_id, defender_id, dxs, dys):
+        """
+        攻撃側の各技が、差分 (dxs[i], dys[i]) にいる相手に当たるか。
+
+        Args:
+            attacker_id (int): 攻撃側のキャラID
+            defender_id (int): 相手のキャラID (大きさに使う)
+            dxs, dys (array-like or number): 相手までのマス目上の差分 (同じ形)
+        Returns:
+            numpy.ndarray: dxs の形 + (技数,) の bool 配列 (未登録の攻撃側はすべて False)
+        """
+        dxs = np.abs(np.asarray(dxs, dtype=float))
+        dys = np.abs(np.asarray(dys, dtype=float))
+        r = self.row_of.get(attacker_id)
+        if r is None:
+            return np.zeros(dxs.shape + (len(self.moves),), dtype=bool)
+        size_x, size_y = self.defender_size(defender_id)
+        # NaN (技を持たない) との比較は False になるので、存在しない技は自動的に外れる
+        return ((dxs[..., None] <= self.reach_x[r] + size_x / 2)
+                & (dys[..., None] <= self.reach_y[r] + size_y / 2))
+
+    def hit_mask_all(self, defender_id, dx, dy):
+        """
+        全キャラを攻撃側として、差分 (dx, dy) にいる相手に各技が当たるか。
+
+        Returns:
+            numpy.ndarray: (キャラ数, 技数) の bool 配列 (行の並びは character_ids)
+        """
+        size_x, size_y = self.defender_size(defender_id)
+        return ((abs(dx) <= self.reach_x + size_x / 2)
+                & (abs(dy) <= self.reach_y + size_y / 2))
+
+    def connecting_moves(self, attacker_id, defender_id, dx, dy, k=None, sort_key="startup"):
+        """
+        差分 (dx, dy) にいる相手に当たる技の一覧。
+
+        Args:
+            attacker_id (int): 攻撃側のキャラID
+            defender_id (int): 相手のキャラID
+            dx, dy (int): 相手までのマス目上の差分
+            k (int): 件数 (None なら全部)
+            sort_key (str): "startup" (発生の早い順) / "damage" (ダメージの大きい順) / "reach" (リーチの短い順)
+        Returns:
+            list: {"カテゴリ", "行動", "横リーチ", "縦リーチ", "ダメージ", "発生"} の辞書のリスト
+        """
+        if sort_key not in SORT_KEYS:
+            raise ValueError(f"sort_key は {', '.join(SORT_KEYS)} のいずれかを指定してください")
+        r = self.row_of.get(attacker_id)
+        if r is None:
+            return []
+        hits = np.flatnonzero(self.hit_mask(attacker_id, defender_id, dx, dy))
+        if sort_key == "startup":
+            keys = np.where(np.isnan(self.startup[r, hits]), np.inf, self.startup[r, hits])
+        elif sort_key == "damage":
+            keys = np.where(np.isnan(self.damage[r, hits]), np.inf, -self.damage[r, hits])
+        else:
+            keys = np.maximum(self.reach_x[r, hits], self.reach_y[r, hits])
+        # 同じキーどうしは技の並び (テーブル・カラムの順) を保つ
+        hits = hits[np.argsort(keys, kind="stable")]
+        if k is not None:
+            hits = hits[:k]
+        return [self._to_dict(r, j) for j in hits.tolist()]
+
+    def threat_map(self, attacker_id, defender_id, attacker_col, attacker_row, columns=33, rows=16):
+        """
+        攻撃側が (attacker_col, attacker_row) のマスにいるとき、盤面の全マスについて
+        そこにいる相手に当たる技の数・最大ダメージ・最速の発生フレームを求める。
+        全マス × 全技の判定を 1 回のブロードキャストで行う。
+
+        Args:
+            attacker_id (int): 攻撃側のキャラID
+            defender_id (int): 相手のキャラID
+            attacker_col, attacker_row (int): 攻撃側のマスの列・行 (0 始まり)
+            columns, rows (int): 盤面のマス数
+        Returns:
+            dict: "count" (当たる技の数), "best_damage" (当たる技の最大ダメージ),
+                  "fastest_startup" (当たる技の最小の発生フレーム)。どれも (rows, columns) の配列で、
+                  当たる技が無い (値が無い) マスは best_damage / fastest_startup が NaN
+        """
+        dxs = np.arange(columns)[None, :] - attacker_col
+        dys = np.arange(rows)[:, None] - attacker_row
+        mask = self.hit_mask(attacker_id, defender_id, *np.broadcast_arrays(dxs, dys))
+        r = self.row_of.get(attacker_id)
+        if r is None:
+            nan = np.full((rows, columns), np.nan)
+            return {"count": np.zeros((rows, columns), dtype=np.int32), "best_damage": nan, "fastest_startup": nan}
+        # NaN の値は集計から外す (当たる技があっても値が無ければ NaN のまま)
+        damage = np.where(mask & ~np.isnan(self.damage[r]), self.damage[r], -np.inf).max(axis=-1, initial=-np.inf)
+        startup = np.where(mask & ~np.isnan(self.startup[r]), self.startup[r], np.inf).min(axis=-1, initial=np.inf)
+        return {
+            "count": mask.sum(axis=-1, dtype=np.int32),
+            "best_damage": np.where(np.isinf(damage), np.nan, damage),
+            "fastest_startup": np.where(np.isinf(startup), np.nan, startup),
+        }
+
+    def _to_dict(self, r, j):
+        category, name = self.moves[j]
+        return {
+            "カテゴリ": category,
+            "行動": name,
+            "横リーチ": _number(self.reach_x[r, j]),
+            "縦リーチ": _number(self.reach_y[r, j]),
+            "ダメージ": _number(self.damage[r, j]),
+            "発生": _number(self.startup[r, j]),
+        }
+
+
+def _number(val):
+    # JSON に返すので NaN は None、整数値は int にする
+    val = float(val)
+    if np.isnan(val):
+        return None
+    return int(val) if val.is_integer() else val
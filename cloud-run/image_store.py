@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+image_store.py
+
+images/ フォルダ (アップロード画像の作業用コピーと、マス目・ヒートマップを描いた出力画像) の保存と寿命の管理。
+Cloud Run のファイルシステムはメモリ上にあるので、書いたまま消さないとインスタンスのメモリを食い続ける。
+
+- ファイル名は中身のハッシュ (sha256 の先頭 32 文字) + 拡張子。同じスクリーンショットは 1 回だけ保存する
+- 出力画像は「元画像の名前 + 描画の設定」から決まる名前で、作り方 (build) を登録しておく。
+  消された後に要求されたら、その場で作り直す (register / ensure)
+- 合計サイズが IMAGE_STORE_MAX_BYTES を超えたら、最後に使ってから長いものから消す (LRU)。
+  作り直せる出力画像を先に消し、足りなければ元画像も消す (元画像が消えると、その出力画像も作り直せなくなる)
+- 作り方の登録は IMAGE_STORE_MAX_RECIPES 件までの LRU。あふれた出力画像はファイルも消す (作り直せないため)
+- バックグラウンドのスレッドが IMAGE_STORE_SWEEP_INTERVAL 秒ごとにフォルダを見直し、上限を超えていれば消す
+
+作り方の登録はプロセス内なので、gunicorn のワーカーを増やした場合は登録したワーカー以外では作り直せない
+(その場合は 404 になり、再アップロードしてもらう)。
+ファイル名がハッシュの形をしていないファイルは管理しない。
+
+【使い方】
+  store = ImageStore(IMAGES_FOLDER)
+  name = store.put(data, ".jpg")                         # 中身のハッシュの名前で保存
+  out = store.derived_name(name, ".jpg", "grid", 33, 16)  # 設定から決まる出力画像の名前
+  store.register(out, name, lambda path, image=None: draw(..., output_path=path))
+  store.ensure(out)                                      # 無ければ作る (あれば使った時刻だけ更新)
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+###############################################################################
+# 設定 (環境変数)
+###############################################################################
+IMAGE_STORE_MAX_BYTES = int(os.getenv("IMAGE_STORE_MAX_BYTES", str(256 * 1024 * 1024)))
+IMAGE_STORE_SWEEP_INTERVAL = float(os.getenv("IMAGE_STORE_SWEEP_INTERVAL", "60"))
+# 書きかけの一時ファイルをこれより古ければ消す (秒)
+IMAGE_STORE_TMP_MAX_AGE = float(os.getenv("IMAGE_STORE_TMP_MAX_AGE", "600"))
+# 作り方 (register) を覚えておく出力画像の数。ヒートマップは (マス, キャラの組, 指標) ごとに登録され、
+# 作り方が配列を持つので、使われ続ける元画像でも増え続けないよう上限を超えたら古いものから忘れる
+IMAGE_STORE_MAX_RECIPES = int(os.getenv("IMAGE_STORE_MAX_RECIPES", "1024"))
+
+STORE_NAME = re.compile(r"^[0-9a-f]{32}\.\w+$")
+TMP_PREFIX = ".tmp-"
+
+
+def content_name(data, ext):
+    """中身のハッシュから決まるファイル名"""
+    return hashlib.sha256(data).hexdigest()[:32] + ext
+
+
+class ImageStore:
+    def __init__(self, folder, max_bytes=IMAGE_STORE_MAX_BYTES, sweep_interval=IMAGE_STORE_SWEEP_INTERVAL,
+                 max_recipes=IMAGE_STORE_MAX_RECIPES):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.max_recipes = max_recipes
+        self.sweep_interval = sweep_interval
+        os.makedirs(folder, exist_ok=True)
+        self._lock = threading.Lock()
+        # 名前 -> バイト数 (使った順。先頭が最も古い)
+        self._files = OrderedDict()
+        self._bytes = 0
+        # 出力画像の名前 -> (元画像の名前, build) (使った順。先頭が最も古い)
+        self._recipes = OrderedDict()
+        # 同じ出力画像を複数のスレッドが同時に作らないためのロック
+        self._build_locks = {}
+        self._stats = {"puts": 0, "dedup_hits": 0, "builds": 0, "evictions": 0, "evicted_bytes": 0,
+                       "recipe_evictions": 0}
+        self._sweeper = None
+        self._stop = threading.Event()
+        self.rescan()
+
+    def path(self, name):
+        return os.path.join(self.folder, name)
+
+    def _count(self, name, n=1):
+        self._stats[name] += n
+
+    ###########################################################################
+    # 保存
+    ###########################################################################
+    def put(self, data, ext):
+        """
+        data を中身のハッシュの名前で保存し、その名前を返す (同じ中身が既にあれば書かない)。
+        """
+        name = content_name(data, ext)
+        with self._lock:
+            self._count("puts")
+            if name in self._files and os.path.exists(self.path(name)):
+                self._files.move_to_end(name)
+                self._count("dedup_hits")
+                return name
+        self._write(name, lambda path: _write_bytes(path, data))
+        return name
+
+    def _write(self, name, build, *args, **kwargs):
+        # 一時ファイルに書いてから置き換えるので、配信中のファイルが書きかけになることはない
+        base, ext = os.path.splitext(name)
+        tmp_path = self.path(f"{TMP_PREFIX}{uuid.uuid4().hex[:8]}-{base}{ext}")
+        try:
+            build(tmp_path, *args, **kwargs)
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, self.path(name))
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        with self._lock:
+            self._bytes += size - self._files.pop(name, 0)
+            self._files[name] = size
+            over = self._bytes > self.max_bytes
+        if over:
+            # 書いたばかりのファイルは消さない
+            self.evict(keep=name)
+
+    ###########################################################################
+    # 出力画像 (作り方を登録しておき、無ければ作る)
+    ###########################################################################
+    @staticmethod
+    def derived_name(source_name, ext, *params):
+        """元画像の名前と描画の設定から決まる出力画像の名前"""
+        key = json.dumps([source_name, *params], sort_keys=True, default=str)
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()[:32] + ext
+
+    def register(self, name, source_name, build):
+        """
+        出力画像 name の作り方を登録する。
+
+        Args:
+            name (str): 出力画像の名前 (derived_name)
+            source_name (str): 元画像の名前。これが消えたら作り方の登録も消す
+            build (callable): build(path, *args, **kwargs) で path に画像を書き出す
+        """
+        with self._lock:
+            self._recipes.pop(name, None)
+            self._recipes[name] = (source_name, build)
+            victims = []
+            while len(self._recipes) > self.max_recipes:
+                victim, _ = self._recipes.popitem(last=False)
+                self._count("recipe_evictions")
+                # 作り方を忘れた出力画像は作り直せないので、ファイルも消す
+                if victim in self._files:
+                    self._bytes -= self._files.pop(victim)
+                    victims.append(victim)
+        self._remove_files(victims)
+
+    def ensure(self, name, *args, **kwargs):
+        """
+        name のファイルがあれば使った時刻を更新して True。
+        無ければ登録された作り方で作って True (元画像も無い・作り方が無いなら False)。
+        args / kwargs は build にそのまま渡す (デコード済みの画像を渡して開き直しを省くなど)。
+        """
+        with self._lock:
+            if name in self._files:
+                self._files.move_to_end(name)
+                # 出力画像が使われている間は、作り直しに必要な元画像・作り方も使われているものとして扱う
+                if name in self._recipes:
+                    self._recipes.move_to_end(name)
+                    if self._recipes[name][0] in self._files:
+                        self._files.move_to_end(self._recipes[name][0])
+                if os.path.exists(self.path(name)):
+                    return True
+                # 他のプロセスなどに消されていた
+                self._bytes -= self._files.pop(name)
+            recipe = self._recipes.get(name)
+            if recipe is None:
+                return False
+            self._recipes.move_to_end(name)
+            source_name, build = recipe
+            if source_name not in self._files:
+                return False
+            self._files.move_to_end(source_name)
+            build_lock = self._build_locks.setdefault(name, threading.Lock())
+        with build_lock:
+            with self._lock:
+                if name in self._files:
+                    return True
+            try:
+                self._write(name, build, *args, **kwargs)
+            finally:
+                with self._lock:
+                    self._build_locks.pop(name, None)
+            with self._lock:
+                self._count("builds")
+        return True
+
+    def touch(self, name):
+        with self._lock:
+            if name in self._files:
+                self._files.move_to_end(name)
+
+    ###########################################################################
+    # 削除 (LRU) と見直し
+    ###########################################################################
+    def evict(self, keep=None):
+        """合計サイズが上限を下回るまで、使ってから長いものから消す (keep は消さない)。消した数を返す"""
+        with self._lock:
+            if self._bytes <= self.max_bytes:
+                return 0
+            # 作り直せる出力画像を先に、次に元画像を (それぞれ古い順に)
+            order = [n for n in self._files if n in self._recipes] + [n for n in self._files if n not in self._recipes]
+            victims = []
+            for name in order:
+                if self._bytes <= self.max_bytes:
+                    break
+                if name == keep:
+                    continue
+                size = self._files.pop(name)
+                self._bytes -= size
+                victims.append(name)
+                self._count("evictions")
+                self._count("evicted_bytes", size)
+            self._forget_recipes(set(victims))
+        return self._remove_files(victims)
+
+    def _forget_recipes(self, gone_sources):
+        # 元画像が消えたら、その出力画像は作り直せないので作り方も消す (self._lock を持って呼ぶ)
+        for derived in [n for n, (source, _) in self._recipes.items() if source in gone_sources]:
+            del self._recipes[derived]
+
+    def _remove_files(self, names):
+        removed = 0
+        for name in names:
+            try:
+                os.remove(self.path(name))
+                removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+    def rescan(self):
+        """フォルダの中身と管理している一覧を合わせ、古い一時ファイルを消す"""
+        now = time.time()
+        found = []
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                if entry.name.startswith(TMP_PREFIX):
+                    try:
+                        if now - entry.stat().st_mtime > IMAGE_STORE_TMP_MAX_AGE:
+                            os.remove(entry.path)
+                    except FileNotFoundError:
+                        pass
+                elif STORE_NAME.match(entry.name):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    found.append((stat.st_mtime, entry.name, stat.st_size))
+        with self._lock:
+            on_disk = {name: size for _, name, size in found}
+            for name in [n for n in self._files if n not in on_disk]:
+                self._bytes -= self._files.pop(name)
+            # 元画像がフォルダから消えていた (他のプロセスに消された・再起動前に消えたなど) 出力画像の作り方も消す
+            self._forget_recipes({source for source, _ in self._recipes.values() if source not in on_disk})
+            # 知らないファイル (再起動前のものなど) は更新時刻の古い順に、一覧の古い側へ入れる
+            unknown = [(mtime, name, size) for mtime, name, size in sorted(found) if name not in self._files]
+            known = list(self._files.items())
+            self._files = OrderedDict([(name, size) for _, name, size in unknown] + known)
+            self._bytes = sum(self._files.values())
+
+    def sweep(self):
+        self.rescan()
+        return self.evict()
+
+    def start_sweeper(self):
+        """sweep を sweep_interval 秒ごとに実行するバックグラウンドスレッドを起動する"""
+        if self._sweeper is not None or self.sweep_interval <= 0:
+            return
+
+        def run():
+            while not self._stop.wait(self.sweep_interval):
+                try:
+                    self.sweep()
+                except OSError:
+                    # フォルダが一時的に読めないなど。次の回にやり直す
+                    pass
+
+        self._sweeper = threading.Thread(target=run, name="image-store-sweeper", daemon=True)
+        self._sweeper.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def metrics(self):
+        """ファイル数・合計バイト数・重複の数・出力画像を作った数・削除数"""
+        with self._lock:
+            return {
+                **self._stats,
+                "files": len(self._files),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "recipes": len(self._recipes),
+            }
+
+
+def _write_bytes(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
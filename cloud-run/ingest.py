@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+ingest.py
+
+アップロード画像の取り込み。元のファイルは保存せず、次の処理を 1 回のデコードで行う。
+
+1. ヘッダーだけ読んで大きさを確認する (INGEST_MAX_PIXELS を超える画像はデコードしない)
+2. JPEG は draft() で作業用の大きさ以上の範囲で縮小デコードする (12MP の写真でも 1/2〜1/4 でデコード)
+3. EXIF の向き (スマホで撮った TV の写真など) を反映する
+4. 長辺を INGEST_MAX_SIDE まで縮小する
+5. 作業用のコピー (JPEG / WebP) を image_store に保存する (同じ画像は 1 回だけ)
+
+以降のマス目描画・位置の自動検出・Gemini 送信・ヒートマップはすべて作業用のコピーを使う。
+クリック座標も作業用のコピー上のピクセル座標で扱い、元画像の座標で来たものは scale を掛けて直す。
+
+HEIC は pillow-heif がインストールされていれば読める (無ければ他の形式と同じく読めない画像として扱う)。
+
+【使い方】
+  result = ingest_upload(request.files["image_file"], image_store)
+  result.image          # 作業用の RGB 画像
+  result.name           # 保存した作業用のコピーの名前 (中身のハッシュ + INGEST_FORMAT の拡張子)
+  result.path           # そのパス
+  result.scale          # 作業用の大きさ / 元の大きさ (向きを反映した後の大きさで比べる)
+"""
+
+import io
+import os
+from collections import namedtuple
+
+from PIL import Image, ImageOps
+
+try:
+    from pillow_heif import register_heif_opener
+    register_heif_opener()
+except ImportError:
+    pass
+
+###############################################################################
+# 設定 (環境変数)
+###############################################################################
+# 作業用のコピーの長辺 (px)。これより小さい画像は縮小しない
+INGEST_MAX_SIDE = int(os.getenv("INGEST_MAX_SIDE", "1920"))
+# 作業用のコピーの形式 (JPEG / WEBP) と画質
+INGEST_FORMAT = os.getenv("INGEST_FORMAT", "JPEG").upper()
+INGEST_QUALITY = int(os.getenv("INGEST_QUALITY", "90"))
+# デコードを許す最大の画素数 (元画像)。これを超える画像は取り込まない
+INGEST_MAX_PIXELS = int(os.getenv("INGEST_MAX_PIXELS", str(64 * 1000 * 1000)))
+
+INGEST_EXTENSIONS = {"JPEG": ".jpg", "WEBP": ".webp"}
+
+
+class IngestError(ValueError):
+    """画像として読めない・大きすぎるアップロード"""
+
+
+class IngestResult(namedtuple("IngestResult", ["image", "name", "path", "original_size", "scale"])):
+    """
+    image: 作業用の RGB 画像
+    name / path: 保存した作業用のコピーの名前とパス
+    original_size: 向きを反映した元画像の (幅, 高さ)
+    scale: 作業用の大きさ / 元の大きさ (1.0 なら縮小していない)
+    """
+
+    __slots__ = ()
+
+
+def working_size(size, max_side=INGEST_MAX_SIDE):
+    """長辺が max_side に収まる大きさ (縦横比は保つ。小さい画像はそのまま)"""
+    width, height = size
+    longest = max(width, height)
+    if longest <= max_side:
+        return width, height
+    ratio = max_side / longest
+    return max(1, round(width * ratio)), max(1, round(height * ratio))
+
+
+def _transposed(size, img):
+    # EXIF の向きが 90 度回転 (5〜8) なら縦横が入れ替わる
+    orientation = img.getexif().get(0x0112, 1)
+    return (size[1], size[0]) if orientation in (5, 6, 7, 8) else size
+
+
+def ingest_upload(source, store, max_side=INGEST_MAX_SIDE, image_format=INGEST_FORMAT,
+                  quality=INGEST_QUALITY, max_pixels=INGEST_MAX_PIXELS):
+    """
+    アップロード画像を作業用の大きさでデコードし、作業用のコピーを保存する。
+
+    Args:
+        source: ファイルパスまたはファイルオブジェクト (Flask の FileStorage も可)
+        store (ImageStore): 作業用のコピーの保存先
+        max_side (int): 作業用のコピーの長辺
+        image_format (str): JPEG / WEBP
+        quality (int): 作業用のコピーの画質
+        max_pixels (int): デコードを許す最大の画素数
+    Returns:
+        IngestResult
+    Raises:
+        IngestError: 画像として読めない・大きすぎる
+    """
+    if image_format not in INGEST_EXTENSIONS:
+        raise ValueError(f"INGEST_FORMAT は {', '.join(INGEST_EXTENSIONS)} のいずれかを指定してください")
+    stream = getattr(source, "stream", source)
+    try:
+        img = Image.open(stream)
+    except (OSError, Image.DecompressionBombError):
+        raise IngestError("画像として読み込めません (対応していない形式か、壊れたファイルです)")
+    with img:
+        if img.width * img.height > max_pixels:
+            raise IngestError(f"画像が大きすぎます ({img.width}x{img.height})")
+        original_size = _transposed(img.size, img)
+        target = working_size(original_size, max_side)
+        # draft は向きを反映する前の大きさで指定する
+        img.draft("RGB", _transposed(target, img))
+        try:
+            work = ImageOps.exif_transpose(img)
+        except OSError:
+            raise IngestError("画像として読み込めません (対応していない形式か、壊れたファイルです)")
+        if work.mode != "RGB":
+            work = work.convert("RGB")
+        if work.size != target:
+            work = work.resize(target, Image.BICUBIC, reducing_gap=2.0)
+
+    buf = io.BytesIO()
+    work.save(buf, format=image_format, quality=quality)
+    name = store.put(buf.getvalue(), INGEST_EXTENSIONS[image_format])
+    return IngestResult(work, name, store.path(name), original_size, target[0] / original_size[0])
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+llm_jobs.py
+
+Gemini 呼び出し (generate_content) を Flask のリクエストスレッドから切り離すジョブキュー。
+
+gunicorn --threads 8 の構成では、遅い LLM 呼び出しが 8 本並ぶとクリック記録すら応答しなくなる。
+LLMJobQueue.submit() は呼び出しをバックグラウンドのスレッドプールに積んでジョブIDをすぐ返し、
+結果はジョブIDでポーリング (/api/jobs/<id>) するか SSE (/api/jobs/<id>/events) で受け取る。
+SSE は接続中ずっとリクエストスレッドを使うので、同期ワーカーの構成ではポーリングを使う。
+
+- 同時実行数: LLM_MAX_CONCURRENCY
+- 実行待ちの上限: LLM_MAX_PENDING
+- 上限を超えたときの動作 (バックプレッシャー): LLM_BACKPRESSURE
+    reject … すぐに JobQueueFull を送出 (HTTP 429 を返す)
+    block  … LLM_BLOCK_TIMEOUT 秒まで空きを待ち、それでも空かなければ JobQueueFull
+
+ジョブの状態はセッションストアに保存するので、SESSION_STORE=sqlite なら
+どのワーカーにポーリングが来ても結果を返せる (実行は受け付けたプロセスで行う)。
+
+ジョブ本体がジェネレータ (テキストの断片を yield する) の場合はストリーミングジョブになり、
+iter_stream() で生成途中の断片を受け取れる (/api/jobs/<id>/stream)。
+ポーリングでは partial_text() でここまでの全文を返す (/api/jobs/<id> の partial)。
+断片を連結したものがジョブの result になる。
+"""
+
+import inspect
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+###############################################################################
+# 設定 (環境変数)
+###############################################################################
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+LLM_MAX_PENDING = int(os.getenv("LLM_MAX_PENDING", "32"))
+LLM_BACKPRESSURE = os.getenv("LLM_BACKPRESSURE", "reject")
+LLM_BLOCK_TIMEOUT = float(os.getenv("LLM_BLOCK_TIMEOUT", "5"))
+
+BACKPRESSURE_POLICIES = ("reject", "block")
+
+
+class JobQueueFull(Exception):
+    """実行待ちが上限に達していてジョブを受け付けられない"""
+
+
+class _JobStream:
+    """ストリーミングジョブの生成途中の断片 (このプロセス内だけで共有する)"""
+
+    def __init__(self):
+        self.chunks = []
+        self.finished = False
+        self.cond = threading.Condition()
+
+    def append(self, chunk):
+        with self.cond:
+            self.chunks.append(chunk)
+            self.cond.notify_all()
+
+    def finish(self):
+        with self.cond:
+            self.finished = True
+            self.cond.notify_all()
+
+
+class LLMJobQueue:
+    def __init__(self, store, max_concurrency=LLM_MAX_CONCURRENCY, max_pending=LLM_MAX_PENDING,
+                 policy=LLM_BACKPRESSURE, block_timeout=LLM_BLOCK_TIMEOUT):
+        """
+        Args:
+            store: ジョブの状態を保存するセッションストア (session_store.create_session_store)
+            max_concurrency (int): 同時に実行する LLM 呼び出しの数
+            max_pending (int): 実行待ちで積んでおけるジョブの数
+            policy (str): "reject" / "block"
+            block_timeout (float): policy="block" のときに空きを待つ秒数
+        """
+        if policy not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"LLM_BACKPRESSURE は {', '.join(BACKPRESSURE_POLICIES)} のいずれかを指定してください")
+        self.store = store
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="llm-job")
+        # 実行中 + 実行待ちの合計を制限する
+        self._slots = threading.BoundedSemaphore(max_concurrency + max_pending)
+        # このプロセスで実行中のジョブの完了通知 (SSE で待つ用)
+        self._events = {}
+        self._events_lock = threading.Lock()
+        # このプロセスで実行中のストリーミングジョブの断片
+        self._streams = {}
+        self._stats_lock = threading.Lock()
+        self._stats = {"submitted": 0, "rejected": 0, "completed": 0, "failed": 0, "running": 0}
+
+    def _count(self, name, n=1):
+        with self._stats_lock:
+            self._stats[name] += n
+
+    def metrics(self):
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def submit(self, kind, fn, *args, **kwargs):
+        """
+        fn(*args, **kwargs) をバックグラウンドで実行するジョブを登録し、ジョブIDを返す。
+        fn の戻り値 (JSON にできる値) がジョブの result になる。
+
+        Raises:
+            JobQueueFull: 実行待ちが上限を超えている
+        """
+        if self.policy == "block":
+            acquired = self._slots.acquire(timeout=self.block_timeout)
+        else:
+            acquired = self._slots.acquire(blocking=False)
+        if not acquired:
+            self._count("rejected")
+            raise JobQueueFull("LLMジョブの実行待ちが上限に達しています")
+
+        job_id = uuid.uuid4().hex
+        self.store.set(job_id, {"kind": kind, "status": "queued", "created_at": time.time()})
+        event = threading.Event()
+        with self._events_lock:
+            self._events[job_id] = event
+            self._streams[job_id] = _JobStream()
+        self._count("submitted")
+        try:
+            self._executor.submit(self._run, job_id, event, fn, args, kwargs)
+        except BaseException:
+            self._finish(job_id, event)
+            raise
+        return job_id
+
+    def _finish(self, job_id, event):
+        self._slots.release()
+        event.set()
+        with self._events_lock:
+            self._events.pop(job_id, None)
+            stream = self._streams.pop(job_id, None)
+        if stream is not None:
+            stream.finish()
+
+    def _set_status(self, job_id, **fields):
+        self.store.update(job_id, lambda job: {**job, **fields})
+
+    def _run(self, job_id, event, fn, args, kwargs):
+        self._count("running")
+        self._set_status(job_id, status="running", started_at=time.time())
+        try:
+            result = fn(*args, **kwargs)
+            if inspect.isgenerator(result):
+                result = self._consume(job_id, result)
+        except Exception as e:
+            self._count("failed")
+            self._set_status(job_id, status="error", error=str(e), finished_at=time.time())
+        else:
+            self._count("completed")
+            self._set_status(job_id, status="done", result=result, finished_at=time.time())
+        finally:
+            self._count("running", -1)
+            self._finish(job_id, event)
+
+    def _consume(self, job_id, chunks):
+        # ストリーミングジョブ: 断片を iter_stream の待ち手に渡しつつ連結する
+        with self._events_lock:
+            stream = self._streams.get(job_id)
+        parts = []
+        for chunk in chunks:
+            if not chunk:
+                continue
+            if not parts:
+                # 最初の断片が出るまでの時間 (TTFB) を記録する
+                self._set_status(job_id, first_chunk_at=time.time())
+            parts.append(chunk)
+            stream.append(chunk)
+        return "".join(parts)
+
+    def get(self, job_id):
+        """ジョブの状態 {"kind", "status", "result" / "error", ...}。無ければ None"""
+        return self.store.get(job_id)
+
+    def partial_text(self, job_id):
+        """このプロセスで実行中のストリーミングジョブの、ここまでに生成された全文 (無ければ None)"""
+        with self._events_lock:
+            stream = self._streams.get(job_id)
+        if stream is None:
+            return None
+        with stream.cond:
+            return "".join(stream.chunks)
+
+    def wait(self, job_id, timeout):
+        """
+        ジョブが終わる (done / error) か timeout 秒経つまで待ち、その時点の状態を返す。
+        このプロセスで実行中なら完了通知を待ち、そうでなければストアをポーリングする。
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is None or job["status"] in ("done", "error"):
+                return job
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return job
+            with self._events_lock:
+                event = self._events.get(job_id)
+            if event is not None:
+                event.wait(remaining)
+            else:
+                time.sleep(min(0.2, remaining))
+
+    def iter_stream(self, job_id, timeout):
+        """
+        ストリーミングジョブの断片を生成された順に返すジェネレータ。ジョブが終わったら止まる。
+        timeout 秒新しい断片が来なければ None を返す (接続維持に使う)。
+        このプロセスで実行中でない (終わっている・他ワーカーで実行中) ジョブは、
+        終わるのを待って result を 1 つの断片として返す。
+        """
+        with self._events_lock:
+            stream = self._streams.get(job_id)
+        if stream is None:
+            while True:
+                job = self.wait(job_id, timeout)
+                if job is None or job["status"] == "error":
+                    return
+                if job["status"] == "done":
+                    if job.get("result"):
+                        yield job["result"]
+                    return
+                yield None
+
+        sent = 0
+        while True:
+            with stream.cond:
+                if sent == len(stream.chunks) and not stream.finished:
+                    stream.cond.wait(timeout)
+                chunks = stream.chunks[sent:]
+                finished = stream.finished
+            sent += len(chunks)
+            if not chunks and not finished:
+                yield None
+            for chunk in chunks:
+                yield chunk
+            if finished:
+                return
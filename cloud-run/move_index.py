@@ -0,0 +1,565 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+move_index.py
+
+smash_characters.db の技テーブル (B_moves / air_moves / ...) を起動時に一度だけ読み込み、
+キャラ × テーブルごとに「数値カラムの値」を昇順ソートした配列として保持するインデックス。
+
+recommend_actions は毎リクエスト sqlite3 に接続して 6 テーブルを SELECT * し、
+全カラムを distance と比較していたが、MoveIndex.recommend は
+テーブルごとに 1 回の二分探索 (bisect) で distance <= 値 の範囲を切り出すだけになる。
+返すレコード (内容・順序) は recommend_actions と完全に同じ。
+
+【使い方】
+  index = MoveIndex("smash_characters.db")
+  recommended = index.recommend(character_id=1, distance=12.5)
+  top3 = select_top_moves(index.iter_recommend(1, 12.5), k=3, sort_key="startup")
+  top5_lists = index.recommend_batch([1, 2, 1], [3.0, 10.5, 40.0], k=5)
+  top5 = index.top_moves(character_id=1, dx=-5, dy=3)  # マス目上の差分から O(1) で引く
+  hits = index.connecting_moves(1, 2, dx=-5, dy=3)      # 横・縦のリーチと大きさで当たる技 (hitbox.py)
+  index.reload()  # DBを更新したら再読み込み (DBファイルの更新は top_moves が自動で検知する)
+
+盤面は 33 x 16 マス固定なので、距離 sqrt(dx^2 + dy^2) は |dx| < 33, |dy| < 16 の有限個の値しかとらない。
+DistanceTable は全キャラ × その全距離の Top-k を読み込み時に計算しておき、
+calc_distance からは (キャラ, |dx|, |dy|) で配列を引くだけにする。
+"""
+
+import bisect
+import heapq
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from db_pool import db_stamp, get_pool
+from hitbox import HitboxModel
+
+###############################################################################
+# テーブル名と日本語の対応付け (recommend_actions と共通)
+###############################################################################
+TABLE_LABELS = {
+    "B_moves": "必殺技",
+    "air_moves": "空中攻撃",
+    "dash_moves": "ダッシュ攻撃",
+    "kyou_zyaku_moves": "通常攻撃",
+    "smash_moves": "スマッシュ攻撃",
+    "throw_moves": "投げ技"
+}
+
+# 比較対象から外すカラム
+SKIP_COLUMNS = ("id", "character_id")
+
+# 事前計算する盤面の大きさ (マス数) と Top-k の件数
+BOARD_COLUMNS = 33
+BOARD_ROWS = 16
+TABLE_K = 5
+# DBファイルが更新されていないか確認する間隔 (秒)
+MOVE_INDEX_CHECK_INTERVAL = float(os.getenv("MOVE_INDEX_CHECK_INTERVAL", "1.0"))
+
+# 技カラムの接尾辞 (fair_x, fair_damage, ... / throw_moves などは x, damage, ...)
+MOVE_ATTRIBUTES = ("x", "y", "damage", "startup", "weapon", "tobi")
+
+
+def _is_number(val):
+    return val is not None and isinstance(val, (int, float))
+
+
+def move_name(col):
+    """カラム名から技名を取り出す (例: "fair_damage" -> "fair", "d_x" -> "d", "x" -> "")"""
+    for attr in MOVE_ATTRIBUTES:
+        if col == attr:
+            return ""
+        if col.endswith("_" + attr):
+            return col[:-len(attr) - 1]
+    return col
+
+
+def attribute_column(name, attr):
+    """技名と属性からカラム名を作る (move_name の逆)"""
+    return f"{name}_{attr}" if name else attr
+
+
+###############################################################################
+# 推奨行動の候補と Top-k 選択
+###############################################################################
+class MoveCandidate(namedtuple("MoveCandidate", ["category", "move", "range", "startup", "damage"])):
+    """
+    推奨行動の候補 1 件。辞書にするのは Top-k に残ったものだけにする。
+
+    range: distance と比較したカラムの値 (従来の「適用距離」)
+    startup / damage: 同じ技の発生フレーム・ダメージ (無ければ None)
+    """
+
+    __slots__ = ()
+
+    def to_dict(self):
+        return {
+            "カテゴリ": self.category,
+            "行動": self.move,
+            "適用距離": self.range
+        }
+
+
+def _or_inf(val):
+    return val if _is_number(val) else float("inf")
+
+
+# 並び替えキー: range=適用距離の昇順 / startup=発生の早い順 / damage=ダメージの大きい順
+SORT_KEYS = {
+    "range": lambda c: c.range,
+    "startup": lambda c: (_or_inf(c.startup), c.range),
+    "damage": lambda c: (-c.damage if _is_number(c.damage) else float("inf"), c.range),
+}
+
+
+def select_top_moves(candidates, k=5, sort_key="range"):
+    """
+    候補を 1 件ずつ受け取りながら、サイズ k のヒープで上位 k 件だけを残す。
+    同じキーどうしは入力順を保つ (sorted(...)[:k] と同じ結果)。
+
+    Args:
+        candidates (iterable): MoveCandidate (または従来の推奨行動辞書) の iterable / generator
+        k (int): 残す件数
+        sort_key (str): "range" / "startup" / "damage"
+    Returns:
+        list: {"カテゴリ", "行動", "適用距離"} の辞書のリスト
+    """
+    if sort_key not in SORT_KEYS:
+        raise ValueError(f"sort_key は {', '.join(SORT_KEYS)} のいずれかを指定してください")
+    candidates = (
+        MoveCandidate(c["カテゴリ"], c["行動"], c["適用距離"], None, None) if isinstance(c, dict) else c
+        for c in candidates
+    )
+    return [c.to_dict() for c in heapq.nsmallest(k, candidates, key=SORT_KEYS[sort_key])]
+
+
+class _TableIndex:
+    """
+    1キャラ × 1テーブル分のインデックス。
+
+    values: 数値カラムの値を昇順に並べた配列 (二分探索用)
+    entries: values と同じ並びの (元の出現順, カラム名, 値, 発生フレーム, ダメージ)
+    """
+
+    __slots__ = ("label", "values", "entries")
+
+    def __init__(self, label, items):
+        # items は (元の出現順, カラム名, 値, 発生, ダメージ) のリスト。値で安定ソートしておく
+        items = sorted(items, key=lambda item: item[2])
+        self.label = label
+        self.values = [item[2] for item in items]
+        self.entries = items
+
+    def query(self, distance):
+        # distance <= 値 を満たすのは values[bisect_left(values, distance):]
+        start = bisect.bisect_left(self.values, distance)
+        if start == len(self.values):
+            return []
+        # 元の SELECT * の行順・カラム順に並べ直す
+        return sorted(self.entries[start:])
+
+
+def _read_move_tables(db_path):
+    """
+    DBの全技テーブルを一度だけ読み込む。
+
+    Returns:
+        list: TABLE_LABELS の順に (ラベル, カラム名リスト, {character_id: [行の値リスト, ...]})
+              行の並びは SELECT * の順 (= recommend_actions の走査順)
+    """
+    tables = []
+    if not os.path.exists(db_path):
+        # DBファイルが無くても (空のインデックスで) 起動できるようにする
+        return tables
+    # 読み込み専用の共有プールから読む。差し替え後の内容を読むよう、先に全スレッドの接続を開き直させる
+    pool = get_pool(db_path)
+    pool.invalidate()
+    c = pool.connection().cursor()
+    for table, label in TABLE_LABELS.items():
+        try:
+            c.execute(f"SELECT * FROM {table}")
+        except sqlite3.OperationalError:
+            # テーブルが未作成のDBでも起動できるようにする
+            continue
+        columns = [d[0] for d in c.description]
+        char_pos = columns.index("character_id")
+        keep = [i for i, col in enumerate(columns) if col not in SKIP_COLUMNS]
+        rows_by_character = {}
+        for row in c.fetchall():
+            rows_by_character.setdefault(row[char_pos], []).append([row[i] for i in keep])
+        tables.append((label, [columns[i] for i in keep], rows_by_character))
+    return tables
+
+
+def _read_character_sizes(db_path):
+    """{character_id: (size_x, size_y)} (characters テーブルが無ければ空)"""
+    if not os.path.exists(db_path):
+        return {}
+    try:
+        rows = get_pool(db_path).execute("SELECT id, size_x, size_y FROM characters").fetchall()
+    except sqlite3.OperationalError:
+        return {}
+    return {cid: (size_x, size_y) for cid, size_x, size_y in rows}
+
+
+def _build_hitbox_model(tables, sizes):
+    """技テーブルの _x / _y / _damage / _startup カラムを技ごとにまとめて HitboxModel を作る"""
+    moves = []
+    move_values = {}
+    for label, columns, rows_by_character in tables:
+        positions = {col: i for i, col in enumerate(columns)}
+        names = list(dict.fromkeys(move_name(col) for col in columns))
+        first = len(moves)
+        moves.extend((label, name) for name in names)
+        for cid, rows in rows_by_character.items():
+            if cid is None or not rows:
+                continue
+            # キャラ 1 人 1 行 (複数行あれば最初の行)
+            values = rows[0]
+            for j, name in enumerate(names, start=first):
+                attrs = []
+                for attr in ("x", "y", "damage", "startup"):
+                    pos = positions.get(attribute_column(name, attr))
+                    val = values[pos] if pos is not None else None
+                    attrs.append(val if _is_number(val) else None)
+                move_values[(cid, j)] = tuple(attrs)
+    character_ids = sorted({cid for cid, _ in move_values} | set(sizes))
+    return HitboxModel(character_ids, sizes, moves, move_values)
+
+
+def attribute_positions(columns):
+    """カラムごとに、同じ技の startup / damage カラムの位置 (無ければ None) を返す"""
+    positions = {col: i for i, col in enumerate(columns)}
+    result = []
+    for col in columns:
+        name = move_name(col)
+        result.append((positions.get(attribute_column(name, "startup")),
+                       positions.get(attribute_column(name, "damage"))))
+    return result
+
+
+def _attribute(values, pos):
+    return values[pos] if pos is not None else None
+
+
+def _build_table_indexes(tables):
+    """{character_id: [_TableIndex, ...]} を作る (テーブルの並びは TABLE_LABELS の順)"""
+    per_character = {}
+    for label, columns, rows_by_character in tables:
+        attr_pos = attribute_positions(columns)
+        for character_id, rows in rows_by_character.items():
+            items = []
+            order = 0
+            for values in rows:
+                for col, val, (startup_pos, damage_pos) in zip(columns, values, attr_pos):
+                    if _is_number(val):
+                        items.append((order, col, val,
+                                      _attribute(values, startup_pos), _attribute(values, damage_pos)))
+                    order += 1
+            per_character.setdefault(character_id, []).append(_TableIndex(label, items))
+    return per_character
+
+
+###############################################################################
+# バッチ推奨用の密行列 (キャラ × 技スロット)
+###############################################################################
+class MoveMatrix:
+    """
+    全キャラの技データを (キャラ数, スロット数) の密行列にしたもの。
+
+    スロットは (テーブル, 行番号, カラム) の組で、並びは recommend_actions の走査順。
+    数値でないセル・そのキャラに存在しない行は NaN (どの距離でも対象外) になる。
+    """
+
+    def __init__(self, tables):
+        slots = []       # スロットごとの (カテゴリ, 行動)
+        slot_blocks = []  # テーブルごとの (先頭スロット, カラム数, rows_by_character)
+        for label, columns, rows_by_character in tables:
+            max_rows = max((len(rows) for rows in rows_by_character.values()), default=0)
+            slot_blocks.append((len(slots), len(columns), rows_by_character))
+            for _ in range(max_rows):
+                slots.extend((label, col) for col in columns)
+
+        character_ids = sorted({cid for _, _, rows_by_character in tables for cid in rows_by_character
+                                if cid is not None})
+        self.row_of = {cid: i for i, cid in enumerate(character_ids)}
+        self.slots = slots
+        self.values = np.full((len(character_ids), len(slots)), np.nan)
+        # JSONに返すときは元の int / float のまま返したいので別に保持する
+        self.raw_values = np.empty((len(character_ids), len(slots)), dtype=object)
+
+        for first_slot, n_columns, rows_by_character in slot_blocks:
+            for cid, rows in rows_by_character.items():
+                if cid is None:
+                    continue
+                r = self.row_of[cid]
+                for row_pos, values in enumerate(rows):
+                    base = first_slot + row_pos * n_columns
+                    for offset, val in enumerate(values):
+                        if _is_number(val):
+                            self.values[r, base + offset] = val
+                            self.raw_values[r, base + offset] = val
+
+    def top_k(self, character_ids, distances, k=5, chunk_size=4096):
+        """
+        (キャラID, 距離) の組ごとに、distance <= 値 のスロットを値の昇順に最大 k 個選ぶ。
+        同じ値どうしは元の走査順 (get_top5_moves の安定ソートと同じ) になる。
+
+        Args:
+            character_ids (array-like): キャラIDの配列
+            distances (array-like): 距離の配列 (character_ids と同じ長さ)
+            k (int): 1組あたりの最大件数
+        Returns:
+            tuple: (rows, slot_indices, counts)
+                   rows[i] は行列の行 (未登録キャラは -1)、
+                   slot_indices[i, :counts[i]] が i 番目の組の Top-k スロット
+        """
+        character_ids = np.asarray(character_ids)
+        distances = np.asarray(distances, dtype=float)
+        n_pairs = len(character_ids)
+        k = max(0, min(int(k), len(self.slots)))
+
+        rows = np.array([self.row_of.get(int(cid), -1) for cid in character_ids], dtype=np.intp)
+        slot_indices = np.zeros((n_pairs, k), dtype=np.intp)
+        counts = np.zeros(n_pairs, dtype=np.intp)
+        if k == 0 or len(self.row_of) == 0:
+            return rows, slot_indices, counts
+
+        for start in range(0, n_pairs, chunk_size):
+            stop = min(start + chunk_size, n_pairs)
+            chunk_rows = rows[start:stop]
+            vals = self.values[np.maximum(chunk_rows, 0)]
+            # NaN との比較は False になるので欠損スロットは自動的に除外される
+            hit = (vals >= distances[start:stop, None]) & (chunk_rows[:, None] >= 0)
+            keys = np.where(hit, vals, np.inf)
+            order = np.argsort(keys, axis=1, kind="stable")[:, :k]
+            slot_indices[start:stop] = order
+            counts[start:stop] = np.minimum(hit.sum(axis=1), k)
+        return rows, slot_indices, counts
+
+
+###############################################################################
+# 距離 -> Top-k の事前計算テーブル
+###############################################################################
+def grid_distance(dx, dy):
+    """マス目上の差分からユークリッド距離を計算する (calc_distance と同じ式)"""
+    return (dx**2 + dy**2) ** 0.5
+
+
+class DistanceTable:
+    """
+    全キャラ × 盤面上でとりうる全距離の Top-k スロットを事前計算した配列。
+
+    distances: とりうる距離 (昇順、重複なし)
+    dist_index[|dx|, |dy|]: distances の添字
+    slots[キャラの行, 距離の添字, :counts[...]]: MoveMatrix のスロット番号 (適用距離の昇順)
+    """
+
+    def __init__(self, matrix, columns=BOARD_COLUMNS, rows=BOARD_ROWS, k=TABLE_K):
+        self.matrix = matrix
+        self.k = k
+        distance_of = {(dx, dy): grid_distance(dx, dy) for dx in range(columns) for dy in range(rows)}
+        distances = sorted(set(distance_of.values()))
+        position = {d: i for i, d in enumerate(distances)}
+        self.distances = np.array(distances)
+        self.dist_index = np.empty((columns, rows), dtype=np.int32)
+        for (dx, dy), d in distance_of.items():
+            self.dist_index[dx, dy] = position[d]
+
+        n_characters = len(matrix.row_of)
+        character_ids = sorted(matrix.row_of, key=matrix.row_of.get)
+        _, slot_indices, counts = matrix.top_k(
+            np.repeat(character_ids, len(distances)), np.tile(self.distances, n_characters), k=k
+        )
+        slot_dtype = np.int16 if len(matrix.slots) <= np.iinfo(np.int16).max else np.int32
+        self.slots = slot_indices.reshape(n_characters, len(distances), slot_indices.shape[1]).astype(slot_dtype)
+        self.counts = counts.reshape(n_characters, len(distances)).astype(np.int8)
+
+    @property
+    def nbytes(self):
+        return self.distances.nbytes + self.dist_index.nbytes + self.slots.nbytes + self.counts.nbytes
+
+    def covers(self, dx, dy, k):
+        return k <= self.k and abs(dx) < self.dist_index.shape[0] and abs(dy) < self.dist_index.shape[1]
+
+    def lookup(self, character_id, dx, dy, k=TABLE_K):
+        """
+        (キャラ, dx, dy) の Top-k を返す。covers(dx, dy, k) を満たすこと。
+
+        Returns:
+            list: {"カテゴリ", "行動", "適用距離"} の辞書のリスト
+        """
+        row = self.matrix.row_of.get(character_id)
+        if row is None:
+            return []
+        d = self.dist_index[abs(dx), abs(dy)]
+        count = min(int(self.counts[row, d]), k)
+        moves = []
+        for slot in self.slots[row, d, :count].tolist():
+            label, col = self.matrix.slots[slot]
+            moves.append({
+                "カテゴリ": label,
+                "行動": col,
+                "適用距離": self.matrix.raw_values[row, slot]
+            })
+        return moves
+
+
+###############################################################################
+# 推奨行動インデックス
+###############################################################################
+class MoveIndex:
+    def __init__(self, db_path, check_interval=MOVE_INDEX_CHECK_INTERVAL):
+        self.db_path = db_path
+        self.check_interval = check_interval
+        self._reload_lock = threading.Lock()
+        self._tables = {}
+        self.matrix = None
+        self.distance_table = None
+        # (読み込みの世代, HitboxModel)。世代は読み込むたびに増え、読み込み結果に依存するキャッシュのキーに使う。
+        # 別々の属性にすると読み込み中に「新しい世代 + 古いモデル」の組を読めてしまうので、1 つのタプルで差し替える
+        self._hitbox_snapshot = (0, None)
+        self._stamp = None
+        self._next_check = 0.0
+        self.reload()
+
+    def reload(self):
+        """
+        DBを読み直してインデックスを作り直す。
+        構築が終わってから参照を差し替えるので、読み込み中のリクエストは古いインデックスで応答する。
+        """
+        with self._reload_lock:
+            self._reload_locked()
+
+    def _reload_locked(self):
+        # 読み込み中の更新も次の確認で拾えるよう、読み込む前の状態を記録する
+        self._stamp = db_stamp(self.db_path)
+        tables = _read_move_tables(self.db_path)
+        tables_by_character = _build_table_indexes(tables)
+        matrix = MoveMatrix(tables)
+        distance_table = DistanceTable(matrix)
+        hitbox = _build_hitbox_model(tables, _read_character_sizes(self.db_path))
+        self._tables, self.matrix, self.distance_table = tables_by_character, matrix, distance_table
+        self._hitbox_snapshot = (self._hitbox_snapshot[0] + 1, hitbox)
+
+    @property
+    def generation(self):
+        return self._hitbox_snapshot[0]
+
+    @property
+    def hitbox(self):
+        return self._hitbox_snapshot[1]
+
+    def refresh_if_changed(self):
+        """
+        DBファイルが更新されていたら作り直す (確認は check_interval 秒に 1 回)。
+        他のスレッドが作り直している間は待たずに古いインデックスを使う。
+
+        Returns:
+            bool: 作り直したら True
+        """
+        now = time.monotonic()
+        if now < self._next_check:
+            return False
+        self._next_check = now + self.check_interval
+        if db_stamp(self.db_path) == self._stamp:
+            return False
+        if not self._reload_lock.acquire(blocking=False):
+            return False
+        try:
+            self._reload_locked()
+        finally:
+            self._reload_lock.release()
+        return True
+
+    def character_ids(self):
+        return list(self._tables.keys())
+
+    def iter_recommend(self, character_id, distance):
+        """
+        distance <= 値 を満たす候補を MoveCandidate として recommend_actions と同じ順に返すジェネレータ。
+        select_top_moves / get_top5_moves にそのまま渡せる。
+        """
+        for table_index in self._tables.get(character_id, ()):
+            label = table_index.label
+            for _, col, val, startup, damage in table_index.query(distance):
+                yield MoveCandidate(label, col, val, startup, damage)
+
+    def recommend(self, character_id, distance):
+        """
+        recommend_actions(db_path, character_id, distance) と同じ結果を返す。
+
+        Args:
+            character_id (int): characters.id
+            distance (float): マス単位の距離
+        Returns:
+            list: {"カテゴリ", "行動", "適用距離"} の辞書のリスト
+        """
+        return [c.to_dict() for c in self.iter_recommend(character_id, distance)]
+
+    def top_moves(self, character_id, dx, dy, k=TABLE_K):
+        """
+        マス目上の差分 (dx, dy) にいる相手への Top-k 推奨行動。
+        get_top5_moves(iter_recommend(character_id, grid_distance(dx, dy))) と同じ結果を、
+        盤面内なら事前計算テーブルから O(1) で返す (盤面外・k が大きいときは従来の方法で計算)。
+        """
+        self.refresh_if_changed()
+        table = self.distance_table
+        if table.covers(dx, dy, k):
+            return table.lookup(character_id, dx, dy, k)
+        return select_top_moves(self.iter_recommend(character_id, grid_distance(dx, dy)), k=k)
+
+    def connecting_moves(self, attacker_id, defender_id, dx, dy, k=TABLE_K, sort_key="startup"):
+        """
+        マス目上の差分 (dx, dy) にいる相手に、横・縦のリーチとキャラの大きさで判定して当たる技 (hitbox.py)。
+
+        Returns:
+            list: {"カテゴリ", "行動", "横リーチ", "縦リーチ", "ダメージ", "発生"} の辞書のリスト
+        """
+        self.refresh_if_changed()
+        return self.hitbox.connecting_moves(attacker_id, defender_id, dx, dy, k=k, sort_key=sort_key)
+
+    def threat_map(self, attacker_id, defender_id, attacker_col, attacker_row, columns=BOARD_COLUMNS, rows=BOARD_ROWS):
+        """
+        盤面の全マスについて、そこにいる相手に当たる技の数・最大ダメージ・最速の発生 (HitboxModel.threat_map)。
+
+        Returns:
+            tuple: (読み込みの世代, HitboxModel.threat_map の結果)
+        """
+        self.refresh_if_changed()
+        generation, hitbox = self._hitbox_snapshot
+        return generation, hitbox.threat_map(attacker_id, defender_id, attacker_col, attacker_row, columns, rows)
+
+    def recommend_batch(self, character_ids, distances, k=5):
+        """
+        大量の (キャラID, 距離) の組に対して、recommend + get_top5_moves (k件) と同じ結果を
+        NumPy でまとめて計算する。
+
+        Args:
+            character_ids (array-like): キャラIDの配列
+            distances (array-like): 距離の配列
+            k (int): 1組あたりの件数
+        Returns:
+            list: 組ごとの推奨行動 (辞書のリスト) のリスト
+        """
+        if len(character_ids) != len(distances):
+            raise ValueError("character_ids と distances の長さが一致しません")
+        matrix = self.matrix
+        rows, slot_indices, counts = matrix.top_k(character_ids, distances, k=k)
+        results = []
+        for row, slots, count in zip(rows.tolist(), slot_indices.tolist(), counts.tolist()):
+            moves = []
+            for slot in slots[:count]:
+                label, col = matrix.slots[slot]
+                moves.append({
+                    "カテゴリ": label,
+                    "行動": col,
+                    "適用距離": matrix.raw_values[row, slot]
+                })
+            results.append(moves)
+        return results
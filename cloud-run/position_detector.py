@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+position_detector.py
+
+試合画面から各プレイヤーの位置を自動で見つけ、calc_distance 用の「クリック」として返す検出器。
+CPU だけで動き、外部のモデルやネットワークは使わない。
+
+スマブラSP ではファイターの頭上にプレイヤー色のタグ (1P 赤 / 2P 青 / 3P 黄 / 4P 緑) が出るので、
+縮小した画面を HSV に変換し、プレイヤー色ごとに「彩度・明度が高く、色相がその色の範囲にある画素」を
+抜き出して、画素が最も密集している場所をタグの位置とする。
+ファイターはタグの少し下にいるので、marker_offset (画面の高さに対する割合) だけ下にずらした点を返す。
+画面下部のダメージ表示 (同じプレイヤー色のパネル) は exclude_bottom で除外する。
+
+1080p の 1 フレームあたり、デコード込みで 20〜30ms 程度 (JPEG は draft() で縮小デコードする)。
+
+【使い方】
+  positions = detect_positions(img)          # PIL 画像 -> {"P1": Detection, "P2": Detection, ...}
+  clicks = positions_to_clicks(positions)   # record_click と同じ形式 (1P -> 1 回目, 2P -> 2 回目)
+
+  # フォルダ内のスクリーンショットをまとめて検出 (JSON Lines で出力)
+  python position_detector.py screenshots/ --out positions.jsonl
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from collections import namedtuple
+
+import numpy as np
+from PIL import Image
+
+###############################################################################
+# 設定 (環境変数)
+###############################################################################
+# 検出に使う縮小画像の幅 (px)
+DETECT_WORK_WIDTH = int(os.getenv("DETECT_WORK_WIDTH", "480"))
+# タグからファイターまでのずれ (画面の高さに対する割合)
+DETECT_MARKER_OFFSET = float(os.getenv("DETECT_MARKER_OFFSET", "0.06"))
+# 画面下部のダメージ表示を除外する割合
+DETECT_EXCLUDE_BOTTOM = float(os.getenv("DETECT_EXCLUDE_BOTTOM", "0.2"))
+# タグとみなす最小の画素数 (縮小画像上)
+DETECT_MIN_PIXELS = int(os.getenv("DETECT_MIN_PIXELS", "12"))
+
+# プレイヤー色の色相の範囲 (PIL の HSV は 0〜255)。赤は 0 をまたぐので 2 つの範囲で表す
+PLAYER_HUES = {
+    "P1": ((0, 8), (245, 255)),   # 赤
+    "P2": ((145, 175),),          # 青
+    "P3": ((28, 45),),            # 黄
+    "P4": ((75, 100),),           # 緑
+}
+MIN_SATURATION = 150
+MIN_VALUE = 150
+
+# 画素を数えるブロックの大きさ (縮小画像上の px) と、タグの大きさとして足し合わせるブロック数
+BLOCK = 4
+WINDOW_BLOCKS = 3
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+
+
+class Detection(namedtuple("Detection", ["x", "y", "score"])):
+    """
+    検出した位置 (元画像のピクセル座標) と、タグの画素数 (score)。
+    """
+
+    __slots__ = ()
+
+    def to_dict(self):
+        return {"x": round(self.x, 1), "y": round(self.y, 1), "score": self.score}
+
+
+def open_for_detection(path, work_width=DETECT_WORK_WIDTH):
+    """
+    検出用に画像を開く。JPEG は draft() で縮小したままデコードする (元のサイズも返す)。
+
+    Returns:
+        tuple: (PIL 画像, (元の幅, 元の高さ))
+    """
+    img = Image.open(path)
+    size = img.size
+    # draft は 1/2, 1/4, 1/8 の縮小デコード。検出用の幅を下回らない範囲で小さくする
+    img.draft("RGB", (max(work_width, 1), max(work_width * size[1] // max(size[0], 1), 1)))
+    img.load()
+    return img, size
+
+
+def _hsv_work_image(img, work_width):
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    if img.width > work_width:
+        img = img.resize((work_width, max(1, round(img.height * work_width / img.width))), Image.BILINEAR)
+    return np.asarray(img.convert("HSV"))
+
+
+def _densest_blob(mask, min_pixels):
+    """
+    mask の画素が最も密集しているタグ大の領域を探し、その中の画素の重心と画素数を返す (無ければ None)。
+    BLOCK px 四方ごとに数えて WINDOW_BLOCKS 四方で足し合わせるので、ラベリングより軽い。
+    """
+    height, width = mask.shape
+    bh, bw = height // BLOCK, width // BLOCK
+    if bh == 0 or bw == 0:
+        return None
+    blocks = mask[:bh * BLOCK, :bw * BLOCK].reshape(bh, BLOCK, bw, BLOCK).sum(axis=(1, 3))
+    # 累積和で WINDOW_BLOCKS 四方の合計を求める
+    padded = np.zeros((bh + 1, bw + 1), dtype=np.int64)
+    padded[1:, 1:] = blocks.cumsum(axis=0).cumsum(axis=1)
+    n = min(WINDOW_BLOCKS, bh, bw)
+    window = padded[n:, n:] - padded[:-n, n:] - padded[n:, :-n] + padded[:-n, :-n]
+    by, bx = np.unravel_index(np.argmax(window), window.shape)
+    if window[by, bx] < min_pixels:
+        return None
+    y0, x0 = by * BLOCK, bx * BLOCK
+    ys, xs = np.nonzero(mask[y0:y0 + n * BLOCK, x0:x0 + n * BLOCK])
+    return x0 + xs.mean() + 0.5, y0 + ys.mean() + 0.5, int(window[by, bx])
+
+
+def detect_positions(img, original_size=None, players=("P1", "P2"), work_width=DETECT_WORK_WIDTH,
+                     marker_offset=DETECT_MARKER_OFFSET, exclude_bottom=DETECT_EXCLUDE_BOTTOM,
+                     min_pixels=DETECT_MIN_PIXELS):
+    """
+    画面からプレイヤーごとの位置を検出する。
+
+    Args:
+        img (PIL.Image): 試合画面 (縮小済みでもよい)
+        original_size (tuple): 座標を返す元画像の (幅, 高さ) (省略時は img のサイズ)
+        players (tuple): 検出するプレイヤー ("P1" 〜 "P4")
+        work_width (int): 検出に使う縮小画像の幅
+        marker_offset (float): タグからファイターまでのずれ (画面の高さに対する割合)
+        exclude_bottom (float): 除外する画面下部の割合 (ダメージ表示)
+        min_pixels (int): タグとみなす最小の画素数
+    Returns:
+        dict: {プレイヤー: Detection} (見つからなかったプレイヤーは含まない)
+    """
+    width, height = original_size or img.size
+    hsv = _hsv_work_image(img, work_width)
+    work_height, work_w = hsv.shape[:2]
+    search_rows = max(0, int(work_height * (1.0 - exclude_bottom)))
+    hue, sat, val = (hsv[:search_rows, :, i] for i in range(3))
+    vivid = (sat >= MIN_SATURATION) & (val >= MIN_VALUE)
+
+    scale_x, scale_y = width / work_w, height / work_height
+    positions = {}
+    for player in players:
+        hue_mask = np.zeros_like(vivid)
+        for low, high in PLAYER_HUES[player]:
+            hue_mask |= (hue >= low) & (hue <= high)
+        blob = _densest_blob(vivid & hue_mask, min_pixels)
+        if blob is None:
+            continue
+        x, y, score = blob
+        positions[player] = Detection(
+            float(min(x * scale_x, width - 1)), float(min(y * scale_y + marker_offset * height, height - 1)), score
+        )
+    return positions
+
+
+def positions_to_clicks(positions, players=("P1", "P2")):
+    """
+    検出結果を record_click と同じ形式のクリックのリストにする (players の順に 1 回目, 2 回目, ...)。
+    どれか 1 人でも見つからなければ None (手動クリックに任せる)。
+    """
+    if any(player not in positions for player in players):
+        return None
+    return [{"click_number": i, "x": positions[player].x, "y": positions[player].y, "source": "auto"}
+            for i, player in enumerate(players, start=1)]
+
+
+def detect_file(path, players=("P1", "P2")):
+    """画像ファイルから検出する (JPEG は縮小デコード)"""
+    img, size = open_for_detection(path)
+    with img:
+        return detect_positions(img, original_size=size, players=players)
+
+
+def iter_image_files(folder):
+    for name in sorted(os.listdir(folder)):
+        if name.lower().endswith(IMAGE_EXTENSIONS):
+            yield os.path.join(folder, name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="スクリーンショットからプレイヤーの位置をまとめて検出する")
+    parser.add_argument("paths", nargs="+", help="画像ファイルまたはフォルダ")
+    parser.add_argument("--players", nargs="+", default=["P1", "P2"], choices=sorted(PLAYER_HUES))
+    parser.add_argument("--out", help="結果を書き出す JSON Lines ファイル (省略時は標準出力)")
+    args = parser.parse_args()
+
+    files = []
+    for path in args.paths:
+        files.extend(iter_image_files(path) if os.path.isdir(path) else [path])
+
+    out = open(args.out, "w", encoding="utf-8") if args.out else sys.stdout
+    found = 0
+    start = time.perf_counter()
+    try:
+        for path in files:
+            t0 = time.perf_counter()
+            positions = detect_file(path, players=tuple(args.players))
+            elapsed_ms = (time.perf_counter() - t0) * 1000
+            found += len(positions) == len(args.players)
+            out.write(json.dumps({
+                "file": path,
+                "positions": {player: d.to_dict() for player, d in positions.items()},
+                "ms": round(elapsed_ms, 2)
+            }, ensure_ascii=False) + "\n")
+    finally:
+        if args.out:
+            out.close()
+    total = time.perf_counter() - start
+    if files:
+        print(f"{len(files)} 枚 ({found} 枚で全員検出) {total * 1000 / len(files):.1f}ms/枚", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
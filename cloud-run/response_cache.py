@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+response_cache.py
+
+calc_distance の状況分析 (Gemini の回答) のキャッシュ。
+
+situation_prompt はキャラ・マス番号・相対座標・Top5・距離だけで決まり、コーチング中は
+同じ状況が何度も出てくる。そこで
+  - 状況を正規化した JSON の SHA-256 (situation_key)
+  - アップロード画像の知覚ハッシュ (image_dhash。再エンコードや多少の縮小では変わらない)
+を組み合わせたキーで回答をキャッシュし、ヒットすれば Gemini を呼ばずに数 ms で返す。
+
+保存先は 2 段構成 (どちらも session_store のストアを使う)。
+  - memory: プロセス内の LRU + TTL
+  - sqlite: ディスク上の SQLite。再起動後・他ワーカーでも使える。ヒットしたら memory に載せる
+
+【設定 (環境変数)】
+  LLM_CACHE_TIERS           使う段 (カンマ区切り、既定 "memory,sqlite"。空にすると無効)
+  LLM_CACHE_TTL_SECONDS     回答の有効期限 (既定 24 時間)
+  LLM_CACHE_MAX_ENTRIES     memory 段の件数上限
+  LLM_CACHE_DISK_MAX_ENTRIES sqlite 段の件数上限
+  LLM_CACHE_DB_PATH         sqlite 段のファイル
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+from PIL import Image
+
+from session_store import MemorySessionStore, SQLiteSessionStore
+
+###############################################################################
+# 設定 (環境変数)
+###############################################################################
+LLM_CACHE_TIERS = os.getenv("LLM_CACHE_TIERS", "memory,sqlite")
+LLM_CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", str(24 * 60 * 60)))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1000"))
+LLM_CACHE_DISK_MAX_ENTRIES = int(os.getenv("LLM_CACHE_DISK_MAX_ENTRIES", "100000"))
+LLM_CACHE_DB_PATH = os.getenv("LLM_CACHE_DB_PATH", "llm_cache.db")
+
+# 距離はプロンプトに小数 2 桁で載るので、キーもその精度で丸める
+DISTANCE_DECIMALS = 2
+
+
+###############################################################################
+# キーの作成
+###############################################################################
+def image_dhash(img, hash_size=8):
+    """
+    画像の差分ハッシュ (dHash) を 16 進文字列で返す。
+    グレースケールで (hash_size+1) x hash_size に縮小し、横に隣り合う画素の大小をビットにする。
+
+    Args:
+        img (PIL.Image): 画像
+        hash_size (int): 1 辺のビット数 (8 なら 64bit)
+    """
+    small = img.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR)
+    pixels = list(small.getdata())
+    bits = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            bits = (bits << 1) | (left > right)
+    return f"{bits:0{hash_size * hash_size // 4}x}"
+
+
+def _quantize(value):
+    if isinstance(value, float):
+        return round(value, DISTANCE_DECIMALS)
+    if isinstance(value, dict):
+        return {k: _quantize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_quantize(v) for v in value]
+    return value
+
+
+def situation_key(state, image_hash=None):
+    """
+    状況 (キャラ・マス番号・相対座標・Top5・距離など) を正規化してハッシュしたキャッシュキー。
+    キーの順序や float の端数の違いでは変わらない。
+
+    Args:
+        state (dict): JSON にできる状況データ
+        image_hash (str): image_dhash の値 (画像を区別しない場合は None)
+    """
+    canonical = json.dumps(
+        {"state": _quantize(state), "image": image_hash},
+        ensure_ascii=False, sort_keys=True, separators=(",", ":")
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+###############################################################################
+# 2 段キャッシュ
+###############################################################################
+class ResponseCache:
+    def __init__(self, tiers=LLM_CACHE_TIERS, ttl_seconds=LLM_CACHE_TTL_SECONDS,
+                 max_entries=LLM_CACHE_MAX_ENTRIES, disk_max_entries=LLM_CACHE_DISK_MAX_ENTRIES,
+                 db_path=LLM_CACHE_DB_PATH):
+        """
+        Args:
+            tiers (str): "memory,sqlite" のように使う段をカンマ区切りで指定 (空なら無効)
+            ttl_seconds (float): 回答の有効期限
+            max_entries (int): memory 段の件数上限
+            disk_max_entries (int): sqlite 段の件数上限
+            db_path (str): sqlite 段のファイル
+        """
+        names = [t.strip() for t in tiers.split(",") if t.strip()]
+        for name in names:
+            if name not in ("memory", "sqlite"):
+                raise ValueError(f"未対応の LLM_CACHE_TIERS です: {name}")
+        self.memory = None
+        self.disk = None
+        if "memory" in names:
+            # 回答は短い文字列なのでバイト数の上限は件数上限に任せる
+            self.memory = MemorySessionStore("llm_cache", ttl_seconds=ttl_seconds,
+                                             max_entries=max_entries, max_bytes=float("inf"))
+        if "sqlite" in names:
+            self.disk = SQLiteSessionStore("llm_cache", db_path=db_path, ttl_seconds=ttl_seconds,
+                                           max_entries=disk_max_entries)
+        self._stats_lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "sets": 0}
+
+    @property
+    def enabled(self):
+        return self.memory is not None or self.disk is not None
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def get(self, key):
+        """キャッシュ済みの回答を返す。無い・期限切れなら None"""
+        if self.memory is not None:
+            value = self.memory.get(key)
+            if value is not None:
+                self._count("memory_hits")
+                return value
+        if self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self._count("disk_hits")
+                if self.memory is not None:
+                    self.memory.set(key, value)
+                return value
+        self._count("misses")
+        return None
+
+    def set(self, key, value):
+        if self.memory is not None:
+            self.memory.set(key, value)
+        if self.disk is not None:
+            self.disk.set(key, value)
+        self._count("sets")
+
+    def metrics(self):
+        """段ごとのヒット数とヒット率、各段の件数・削除数"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_ratio"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        stats["tiers"] = {}
+        for store in (self.memory, self.disk):
+            if store is not None:
+                stats["tiers"][store.backend] = store.metrics()
+        return stats
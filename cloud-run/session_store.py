@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+session_store.py
+
+click_data_storage / conversation_history のようなセッションデータの保存先。
+モジュール変数の dict に溜め続けるとインスタンスが長生きするほどメモリを食い、
+gunicorn の --workers を増やすとワーカー間で共有もできないため、以下の 2 種類を用意する。
+
+- MemorySessionStore: プロセス内の LRU + TTL。件数・バイト数の上限を超えたら古い順に捨てる
+- SQLiteSessionStore: SQLite (WAL) のファイルに保存。複数ワーカープロセスで共有できる
+
+どちらも get / set / update / delete / metrics の同じインターフェースを持つ。
+TTL は最後に書き込んだ (set / update) 時刻から数える。
+
+【使い方】
+  store = create_session_store("clicks")   # 環境変数 SESSION_STORE=memory|sqlite で切り替え
+  store.set(key, {"clicks": []})
+  store.update(key, lambda rec: {**rec, "clicks": rec["clicks"] + [click]})
+  record = store.get(key)                  # 無い・期限切れなら None
+"""
+
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+###############################################################################
+# 設定 (環境変数)
+###############################################################################
+SESSION_STORE = os.getenv("SESSION_STORE", "memory")
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "sessions.db")
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", str(6 * 60 * 60)))
+SESSION_MAX_ENTRIES = int(os.getenv("SESSION_MAX_ENTRIES", "1000"))
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", str(256 * 1024 * 1024)))
+
+
+class SessionStore:
+    """セッションストアの共通部分 (メトリクスの集計)"""
+
+    def __init__(self, namespace, ttl_seconds, max_entries):
+        self.namespace = namespace
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "sets": 0,
+            "expired_evictions": 0,
+            "capacity_evictions": 0,
+        }
+
+    def _count(self, name, n=1):
+        if n:
+            with self._stats_lock:
+                self._stats[name] += n
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def metrics(self):
+        """ヒット数・ミス数・期限切れ/容量超過による削除数と現在の件数"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["backend"] = self.backend
+        stats["namespace"] = self.namespace
+        stats.update(self._size_stats())
+        return stats
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value):
+        raise NotImplementedError
+
+    def update(self, key, fn):
+        """
+        key の値に fn を適用した結果を保存して返す (読み込み〜保存はアトミック)。
+        key が無い・期限切れなら何もせず None を返す。
+        """
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def _size_stats(self):
+        raise NotImplementedError
+
+
+###############################################################################
+# プロセス内 LRU + TTL
+###############################################################################
+class MemorySessionStore(SessionStore):
+    backend = "memory"
+
+    def __init__(self, namespace, ttl_seconds=SESSION_TTL_SECONDS,
+                 max_entries=SESSION_MAX_ENTRIES, max_bytes=SESSION_MAX_BYTES):
+        super().__init__(namespace, ttl_seconds, max_entries)
+        self.max_bytes = max_bytes
+        self._lock = threading.RLock()
+        # key -> (値, 期限, 推定バイト数)。並びは古い順 (LRU)
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+    @staticmethod
+    def _estimate_size(value):
+        # pickle 後のサイズを目安にする。set / update のたびに値全体を pickle するので、
+        # 大きな値 (画像データなど) は頻繁に書き換える記録に入れず、別のキーで 1 回だけ保存すること
+        return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def _drop(self, key):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def _lookup(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] < now:
+            self._drop(key)
+            self._count("expired_evictions")
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _evict(self, now):
+        expired = [k for k, (_, expires_at, _) in self._entries.items() if expires_at < now]
+        for k in expired:
+            self._drop(k)
+        self._count("expired_evictions", len(expired))
+
+        evicted = 0
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            self._drop(next(iter(self._entries)))
+            evicted += 1
+        self._count("capacity_evictions", evicted)
+
+    def _store(self, key, value, now):
+        if key in self._entries:
+            self._drop(key)
+        size = self._estimate_size(value)
+        self._entries[key] = (value, now + self.ttl_seconds, size)
+        self._bytes += size
+        self._count("sets")
+        self._evict(now)
+
+    def get(self, key):
+        """値を返す (書き換えずに update を使うこと)。無い・期限切れなら None"""
+        with self._lock:
+            entry = self._lookup(key, time.time())
+        self._count("hits" if entry is not None else "misses")
+        return entry[0] if entry is not None else None
+
+    def set(self, key, value):
+        with self._lock:
+            self._store(key, value, time.time())
+
+    def update(self, key, fn):
+        with self._lock:
+            now = time.time()
+            entry = self._lookup(key, now)
+            if entry is None:
+                self._count("misses")
+                return None
+            self._count("hits")
+            value = fn(entry[0])
+            self._store(key, value, now)
+            return value
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+
+    def _size_stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes}
+
+
+###############################################################################
+# SQLite (WAL) に保存するストア。複数プロセスで同じファイルを共有できる
+###############################################################################
+class SQLiteSessionStore(SessionStore):
+    backend = "sqlite"
+
+    def __init__(self, namespace, db_path=SESSION_DB_PATH, ttl_seconds=SESSION_TTL_SECONDS,
+                 max_entries=SESSION_MAX_ENTRIES):
+        super().__init__(namespace, ttl_seconds, max_entries)
+        self.db_path = db_path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS sessions (
+            namespace TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value BLOB NOT NULL,
+            expires_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (namespace, key)
+        )""")
+        conn.execute("CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (namespace, updated_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS sessions_expires ON sessions (expires_at)")
+
+    def _conn(self):
+        # sqlite3 の接続はスレッドをまたいで使えないのでスレッドごとに持つ
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _select(self, conn, key, now):
+        row = conn.execute(
+            "SELECT value, expires_at FROM sessions WHERE namespace=? AND key=?",
+            (self.namespace, key)
+        ).fetchone()
+        if row is None:
+            return None
+        if row[1] < now:
+            conn.execute("DELETE FROM sessions WHERE namespace=? AND key=?", (self.namespace, key))
+            self._count("expired_evictions")
+            return None
+        return pickle.loads(row[0])
+
+    def _write(self, conn, key, value, now):
+        conn.execute(
+            "INSERT OR REPLACE INTO sessions (namespace, key, value, expires_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (self.namespace, key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL),
+             now + self.ttl_seconds, now)
+        )
+        self._count("sets")
+
+    def _evict(self, conn, now):
+        cur = conn.execute("DELETE FROM sessions WHERE namespace=? AND expires_at < ?", (self.namespace, now))
+        self._count("expired_evictions", max(cur.rowcount, 0))
+        (count,) = conn.execute("SELECT COUNT(*) FROM sessions WHERE namespace=?", (self.namespace,)).fetchone()
+        if count > self.max_entries:
+            # 最後の書き込みが古いものから捨てる
+            cur = conn.execute(
+                "DELETE FROM sessions WHERE namespace=? AND key IN ("
+                " SELECT key FROM sessions WHERE namespace=? ORDER BY updated_at LIMIT ?)",
+                (self.namespace, self.namespace, count - self.max_entries)
+            )
+            self._count("capacity_evictions", max(cur.rowcount, 0))
+
+    def get(self, key):
+        value = self._select(self._conn(), key, time.time())
+        self._count("hits" if value is not None else "misses")
+        return value
+
+    def set(self, key, value):
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._write(conn, key, value, now)
+            self._evict(conn, now)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def update(self, key, fn):
+        conn = self._conn()
+        now = time.time()
+        # BEGIN IMMEDIATE で書き込みロックを先に取り、他プロセスの update と直列化する
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            value = self._select(conn, key, now)
+            if value is None:
+                self._count("misses")
+            else:
+                self._count("hits")
+                value = fn(value)
+                self._write(conn, key, value, now)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return value
+
+    def delete(self, key):
+        self._conn().execute("DELETE FROM sessions WHERE namespace=? AND key=?", (self.namespace, key))
+
+    def _size_stats(self):
+        (count, size) = self._conn().execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(value)), 0) FROM sessions WHERE namespace=?",
+            (self.namespace,)
+        ).fetchone()
+        return {"entries": count, "bytes": size}
+
+
+def create_session_store(namespace, backend=None, **kwargs):
+    """
+    環境変数 SESSION_STORE (memory / sqlite) に応じたストアを作る。
+
+    Args:
+        namespace (str): 用途ごとの名前 (SQLite では同じファイル内で区別する)
+        backend (str): 明示的にバックエンドを指定する場合
+    """
+    backend = backend or SESSION_STORE
+    if backend == "memory":
+        return MemorySessionStore(namespace, **kwargs)
+    if backend == "sqlite":
+        return SQLiteSessionStore(namespace, **kwargs)
+    raise ValueError(f"未対応の SESSION_STORE です: {backend}")
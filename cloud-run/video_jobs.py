@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+video_jobs.py
+
+/api/analyze_video の動画解析 (video_pipeline.VideoPipeline) を、Gemini のジョブキュー (llm_jobs) とは別の
+スレッドプールで実行するジョブ管理。
+
+- 解析は 1 本の動画の間ずっと続くので、LLM の同時実行枠は使わない (VIDEO_MAX_CONCURRENCY 本まで並列)。
+  キーフレームのコメントだけを 1 件ずつ llm_jobs に投入する (queued_commentator)。
+  コメントの同時実行数・待ち行列の上限は他の Gemini 呼び出しと共有される
+- 結果 (キーフレーム・コメント・集計) は 1 行 1 件の JSON としてジョブごとのファイルに書き出し、メモリには溜めない。
+  クライアントは read(job_id, offset) で前回の続きから読む (/api/video_jobs/<job_id>?offset=...)
+- 終わったジョブの結果ファイルは VIDEO_RESULT_TTL 秒後に消す
+
+ジョブの状態はプロセス内にだけあるので、gunicorn のワーカーを増やした場合は受け付けたワーカー以外では読めない。
+
+【使い方】
+  jobs = VideoJobs()
+  job_id = jobs.submit(pipeline, video_path)      # 解析が終わったら video_path は消す
+  page = jobs.read(job_id, offset=0)              # {"status", "events", "next_offset", "finished", ...}
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from llm_jobs import JobQueueFull
+from video_pipeline import json_default
+
+###############################################################################
+# 設定 (環境変数)
+###############################################################################
+# 同時に解析する動画の数 (デコードと位置の検出で CPU を使うので少なめ)
+VIDEO_MAX_CONCURRENCY = int(os.getenv("VIDEO_MAX_CONCURRENCY", "1"))
+# 解析待ちの上限 (これを超えると JobQueueFull)
+VIDEO_MAX_PENDING = int(os.getenv("VIDEO_MAX_PENDING", "4"))
+# 終わったジョブの結果を残しておく時間 (秒)
+VIDEO_RESULT_TTL = float(os.getenv("VIDEO_RESULT_TTL", "3600"))
+# read 1 回で返す結果の上限 (バイト)
+VIDEO_READ_MAX_BYTES = int(os.getenv("VIDEO_READ_MAX_BYTES", str(64 * 1024)))
+# キーフレーム 1 件のコメントを待つ時間 (秒)
+VIDEO_COMMENTARY_TIMEOUT = float(os.getenv("VIDEO_COMMENTARY_TIMEOUT", "60"))
+
+
+def queued_commentator(llm_jobs, commentator, timeout=VIDEO_COMMENTARY_TIMEOUT):
+    """
+    commentator の呼び出しを 1 件ずつ llm_jobs のジョブとして実行し、終わるまで待つ commentator を返す。
+    待ち行列が一杯 (JobQueueFull)・失敗・時間切れのときは例外になり、パイプラインはそのキーフレームの
+    コメントを error として返す。
+    """
+    def run(situation_text, image_payload):
+        job_id = llm_jobs.submit("video_commentary", commentator, situation_text, image_payload)
+        job = llm_jobs.wait(job_id, timeout)
+        if job is not None and job["status"] == "done":
+            return job["result"]
+        if job is not None and job["status"] == "error":
+            raise RuntimeError(job["error"])
+        raise TimeoutError("コメントの生成が時間内に終わりませんでした")
+    return run
+
+
+class VideoJobs:
+    def __init__(self, folder=None, max_concurrency=VIDEO_MAX_CONCURRENCY, max_pending=VIDEO_MAX_PENDING,
+                 result_ttl=VIDEO_RESULT_TTL):
+        """
+        Args:
+            folder (str): 結果ファイルを置くフォルダ (省略時は一時フォルダ。公開フォルダは使わないこと)
+            max_concurrency (int): 同時に解析する動画の数
+            max_pending (int): 解析待ちの上限
+            result_ttl (float): 終わったジョブの結果を残しておく時間 (秒)
+        """
+        self.folder = folder or tempfile.mkdtemp(prefix="video_jobs_")
+        os.makedirs(self.folder, exist_ok=True)
+        self.result_ttl = result_ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="video-job")
+        # 実行中 + 待ちの数の上限
+        self._slots = threading.BoundedSemaphore(max_concurrency + max_pending)
+        self._lock = threading.Lock()
+        # job_id -> {"status", "path", "created_at", "finished_at", "error", "summary"}
+        self._jobs = {}
+        self._stats = {"submitted": 0, "completed": 0, "failed": 0, "rejected": 0, "expired": 0}
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._stats[name] += n
+
+    def submit(self, pipeline, video_path):
+        """
+        pipeline.run(video_path) を実行するジョブを登録し、ジョブIDを返す。
+        video_path は解析が終わったら (受け付けられなかったときも) 消す。
+
+        Raises:
+            JobQueueFull: 解析待ちが上限を超えている
+        """
+        self._expire()
+        if not self._slots.acquire(blocking=False):
+            self._count("rejected")
+            os.remove(video_path)
+            raise JobQueueFull("動画解析の待ちが上限に達しています")
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._jobs[job_id] = {"status": "queued", "path": os.path.join(self.folder, f"{job_id}.jsonl"),
+                                  "created_at": time.time()}
+        self._count("submitted")
+        self._executor.submit(self._run, job_id, pipeline, video_path)
+        return job_id
+
+    def _set(self, job_id, **fields):
+        with self._lock:
+            self._jobs[job_id].update(fields)
+
+    def _run(self, job_id, pipeline, video_path):
+        with self._lock:
+            path = self._jobs[job_id]["path"]
+        self._set(job_id, status="running", started_at=time.time())
+        summary = None
+        try:
+            with open(path, "w", encoding="utf-8") as out:
+                for event in pipeline.run(video_path):
+                    if event["type"] == "frame" and not event["keyframe"]:
+                        continue
+                    if event["type"] == "summary":
+                        summary = event
+                    # 1 件ずつ書き出すので、読み手は解析中でもここまでの結果を読める
+                    out.write(json.dumps(event, ensure_ascii=False, default=json_default) + "\n")
+                    out.flush()
+        except Exception as e:
+            self._count("failed")
+            self._set(job_id, status="error", error=str(e), finished_at=time.time())
+        else:
+            self._count("completed")
+            self._set(job_id, status="done", summary=summary, finished_at=time.time())
+        finally:
+            self._slots.release()
+            try:
+                os.remove(video_path)
+            except FileNotFoundError:
+                pass
+
+    def read(self, job_id, offset=0, max_bytes=VIDEO_READ_MAX_BYTES):
+        """
+        結果を offset バイト目から、行の区切りで max_bytes 程度まで読む。無いジョブなら None。
+
+        Returns:
+            dict: {"status", "events": [...], "next_offset": 次に渡す offset,
+                   "finished": ジョブが終わっていて結果を最後まで読んだか, "error" (失敗時)}
+        """
+        self._expire()
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            job = dict(job)
+        events = []
+        next_offset = offset
+        at_end = True
+        if os.path.exists(job["path"]):
+            with open(job["path"], "rb") as f:
+                f.seek(offset)
+                read = 0
+                while True:
+                    if read >= max_bytes:
+                        at_end = False
+                        break
+                    line = f.readline()
+                    # 書きかけの行は次回に読む
+                    if not line.endswith(b"\n"):
+                        break
+                    events.append(json.loads(line))
+                    read += len(line)
+                next_offset = offset + read
+        result = {"status": job["status"], "events": events, "next_offset": next_offset,
+                  "finished": job["status"] in ("done", "error") and at_end}
+        if job.get("error"):
+            result["error"] = job["error"]
+        return result
+
+    def _expire(self):
+        # 終わってから result_ttl 秒経ったジョブの結果を消す
+        now = time.time()
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job.get("finished_at") is not None and now - job["finished_at"] > self.result_ttl]
+            paths = [self._jobs.pop(job_id)["path"] for job_id in expired]
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        if expired:
+            self._count("expired", len(expired))
+
+    def metrics(self):
+        """受け付け・完了・失敗・拒否・期限切れの数と、現在の実行中・待ちの数"""
+        with self._lock:
+            stats = dict(self._stats)
+            statuses = [job["status"] for job in self._jobs.values()]
+        stats["running"] = statuses.count("running")
+        stats["queued"] = statuses.count("queued")
+        stats["jobs"] = len(statuses)
+        return stats
+
+    def close(self):
+        """実行中の解析を待ってから結果ファイルを消す"""
+        self._executor.shutdown(wait=True)
+        shutil.rmtree(self.folder, ignore_errors=True)
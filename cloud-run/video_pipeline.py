@@ -0,0 +1,436 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+video_pipeline.py
+
+試合の動画ファイルを 1 フレームずつ読み、一定間隔で抜き出したフレームごとに
+位置の検出 -> マス目・距離の計算 (calc_distance と同じ grid_geometry の式) -> 推奨行動 を行うパイプライン。
+
+- 動画は先頭から順に必要な分だけデコードする (全フレームをメモリに載せない)
+- デコード (生産者スレッド) と解析 (消費者) の間は上限付きのキューでつなぐので、
+  動画の長さによらずメモリに載るフレームは queue_size 枚まで
+- 状況 (両者のマス) が前のキーフレームから変わったフレームだけをキーフレームとし、
+  LLM のコメントはキーフレームでだけ作る。コメントも上限付きのキューで別スレッドが作る
+
+動画の読み込みは次のいずれかを使う (VIDEO_BACKEND で指定、省略時は使えるものを自動で選ぶ)。
+  opencv … cv2.VideoCapture (opencv-python-headless がインストールされていれば。requirements.txt に含む)
+  ffmpeg … ffmpeg / ffprobe コマンドの rawvideo 出力をパイプで読む
+  pil    … Pillow で開ける複数フレーム画像 (アニメーション GIF / WebP など)
+
+【使い方】
+  pipeline = VideoPipeline(move_index, char1_id=1, char2_id=2)
+  for event in pipeline.run("match.mp4"):
+      print(event)   # {"type": "frame", ...} / {"type": "commentary", ...} / {"type": "summary", ...}
+
+  python video_pipeline.py match.mp4 --db smash_characters.db --char1 1 --char2 2 --fps 2 --out analysis.jsonl
+"""
+
+import argparse
+import io
+import json
+import os
+import queue
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+from PIL import Image, ImageSequence
+
+from grid_geometry import cell_offset, locate_cell
+from position_detector import detect_positions, positions_to_clicks
+
+###############################################################################
+# 設定 (環境変数)
+###############################################################################
+VIDEO_BACKEND = os.getenv("VIDEO_BACKEND", "")
+# 1 秒あたりに解析するフレーム数
+VIDEO_SAMPLE_FPS = float(os.getenv("VIDEO_SAMPLE_FPS", "2"))
+# デコード済みフレームを貯めておける枚数 (これを超えるとデコードを待たせる)
+VIDEO_QUEUE_SIZE = int(os.getenv("VIDEO_QUEUE_SIZE", "8"))
+# キーフレームどうしの最短の間隔 (秒)。これより短い間の変化はコメントしない
+VIDEO_MIN_KEYFRAME_INTERVAL = float(os.getenv("VIDEO_MIN_KEYFRAME_INTERVAL", "1.0"))
+# 解析に使うフレームの幅 (px)。大きいフレームはデコード後すぐにこの幅まで縮小する
+VIDEO_WORK_WIDTH = int(os.getenv("VIDEO_WORK_WIDTH", "960"))
+
+VIDEO_BACKENDS = ("opencv", "ffmpeg", "pil")
+# 読み込みバックエンドごとに受け付ける拡張子 (pil は複数フレーム画像だけ)
+VIDEO_EXTENSIONS = (".mp4", ".m4v", ".mov", ".mkv", ".webm", ".avi", ".gif")
+MULTIFRAME_IMAGE_EXTENSIONS = (".gif", ".webp", ".png")
+
+Frame = namedtuple("Frame", ["index", "time", "image"])
+
+
+class VideoReadError(RuntimeError):
+    """動画を開けない・読めない"""
+
+
+###############################################################################
+# フレームの読み込み (バックエンドごと)
+###############################################################################
+def _opencv_frames(path):
+    import cv2
+
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise VideoReadError(f"動画を開けません: {path}")
+    fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+    try:
+        index = 0
+        while True:
+            ok, bgr = capture.read()
+            if not ok:
+                break
+            yield index / fps, lambda bgr=bgr: Image.fromarray(bgr[:, :, ::-1])
+            index += 1
+    finally:
+        capture.release()
+
+
+def _ffmpeg_frames(path, sample_fps):
+    probe = subprocess.run(
+        ["ffprobe", "-v", "error", "-select_streams", "v:0", "-show_entries", "stream=width,height",
+         "-of", "json", path], capture_output=True, text=True
+    )
+    if probe.returncode != 0:
+        raise VideoReadError(f"動画を開けません: {path}: {probe.stderr.strip()}")
+    stream = json.loads(probe.stdout)["streams"][0]
+    width, height = stream["width"], stream["height"]
+    frame_bytes = width * height * 3
+    # 間引きは ffmpeg の fps フィルタで行い、必要なフレームだけをパイプで受け取る
+    process = subprocess.Popen(
+        ["ffmpeg", "-v", "error", "-i", path, "-vf", f"fps={sample_fps}", "-f", "rawvideo", "-pix_fmt", "rgb24", "-"],
+        stdout=subprocess.PIPE
+    )
+    try:
+        index = 0
+        while True:
+            data = process.stdout.read(frame_bytes)
+            if len(data) < frame_bytes:
+                break
+            yield index / sample_fps, lambda data=data: Image.frombytes("RGB", (width, height), data)
+            index += 1
+    finally:
+        process.stdout.close()
+        process.kill()
+        process.wait()
+
+
+def _pil_frames(path):
+    try:
+        img = Image.open(path)
+    except OSError as e:
+        raise VideoReadError(f"動画を開けません: {path}: {e}")
+    with img:
+        t = 0.0
+        for frame in ImageSequence.Iterator(img):
+            yield t / 1000.0, lambda frame=frame: frame.convert("RGB")
+            t += frame.info.get("duration", 100) or 100
+
+
+def available_backend():
+    """使える読み込みバックエンドを返す (opencv -> ffmpeg -> pil の順)"""
+    try:
+        import cv2  # noqa: F401
+        return "opencv"
+    except ImportError:
+        pass
+    if shutil.which("ffmpeg") and shutil.which("ffprobe"):
+        return "ffmpeg"
+    return "pil"
+
+
+def supported_extensions(backend=None):
+    """backend (省略時は VIDEO_BACKEND か使えるもの) で読める動画ファイルの拡張子"""
+    backend = backend or VIDEO_BACKEND or available_backend()
+    return MULTIFRAME_IMAGE_EXTENSIONS if backend == "pil" else VIDEO_EXTENSIONS
+
+
+def iter_frames(path, sample_fps=VIDEO_SAMPLE_FPS, backend=None, work_width=VIDEO_WORK_WIDTH):
+    """
+    動画から 1 秒あたり sample_fps 枚のフレームを順に返すジェネレータ。
+    間引かれるフレームは画像に変換しない (PIL 画像を作るのは返すフレームだけ)。
+
+    Yields:
+        Frame: (抜き出したフレームの通し番号, 動画内の時刻 [秒], PIL 画像 (幅は work_width まで))
+    """
+    backend = backend or VIDEO_BACKEND or available_backend()
+    if backend not in VIDEO_BACKENDS:
+        raise ValueError(f"VIDEO_BACKEND は {', '.join(VIDEO_BACKENDS)} のいずれかを指定してください")
+    if backend == "opencv":
+        source = _opencv_frames(path)
+    elif backend == "ffmpeg":
+        source = _ffmpeg_frames(path, sample_fps)
+    else:
+        source = _pil_frames(path)
+
+    interval = 1.0 / sample_fps
+    next_time = 0.0
+    index = 0
+    for t, decode in source:
+        # 浮動小数点の誤差で 1 枚飛ばさないよう少しだけ余裕を持たせる
+        if t + 1e-6 < next_time:
+            continue
+        next_time = (int(t / interval + 1e-6) + 1) * interval
+        image = decode()
+        if image.width > work_width:
+            image = image.resize((work_width, round(image.height * work_width / image.width)), Image.BILINEAR)
+        yield Frame(index, t, image)
+        index += 1
+
+
+###############################################################################
+# パイプライン
+###############################################################################
+_DONE = object()
+
+
+def encode_frame(image, max_side=1024, quality=85):
+    """キーフレームを Gemini に送る JPEG の画像データにする (app.encode_image_payload と同じ形式)"""
+    preview = image.copy()
+    preview.thumbnail((max_side, max_side))
+    buf = io.BytesIO()
+    preview.save(buf, format="JPEG", quality=quality)
+    return {"mime_type": "image/jpeg", "data": buf.getvalue()}
+
+
+class VideoPipeline:
+    def __init__(self, move_index, char1_id, char2_id, columns=33, rows=16, origin_cell=347,
+                 sample_fps=VIDEO_SAMPLE_FPS, queue_size=VIDEO_QUEUE_SIZE,
+                 min_keyframe_interval=VIDEO_MIN_KEYFRAME_INTERVAL, commentator=None, backend=None):
+        """
+        Args:
+            move_index (MoveIndex): 推奨行動の計算に使うインデックス
+            char1_id, char2_id (int): 1P / 2P のキャラID
+            columns, rows, origin_cell: マス目の設定 (アップロード画面と同じ)
+            sample_fps (float): 1 秒あたりに解析するフレーム数
+            queue_size (int): デコード済みフレーム・コメント待ちキーフレームを貯めておける数
+            min_keyframe_interval (float): キーフレームどうしの最短の間隔 (秒)
+            commentator (callable): commentator(situation_text, image_payload) -> コメント文字列。
+                                    None ならコメントは作らない
+            backend (str): 動画の読み込みバックエンド
+        """
+        self.move_index = move_index
+        self.char1_id, self.char2_id = char1_id, char2_id
+        self.columns, self.rows, self.origin_cell = columns, rows, origin_cell
+        self.sample_fps = sample_fps
+        self.queue_size = queue_size
+        self.min_keyframe_interval = min_keyframe_interval
+        self.commentator = commentator
+        self.backend = backend
+
+    def analyze_frame(self, frame):
+        """
+        1 フレームを解析する (位置の検出 -> マス目 -> 差分・距離 -> 推奨行動)。
+
+        Returns:
+            dict: 1P・2P が両方見つかればマス・距離・推奨行動、見つからなければ positions=None
+        """
+        image = frame.image
+        clicks = positions_to_clicks(detect_positions(image))
+        result = {"type": "frame", "index": frame.index, "time": round(frame.time, 3)}
+        if clicks is None:
+            result["positions"] = None
+            return result
+        width, height = image.size
+        p1, p2 = (locate_cell(c["x"], c["y"], width, height, self.columns, self.rows, self.origin_cell)
+                  for c in clicks)
+        dx, dy, dist = cell_offset(p1, p2)
+        result.update({
+            "positions": [{"x": round(c["x"], 1), "y": round(c["y"], 1)} for c in clicks],
+            "cells": [p1.cell, p2.cell],
+            "relative": [[p1.rel_x, p1.rel_y], [p2.rel_x, p2.rel_y]],
+            "dx": dx,
+            "dy": dy,
+            "distance": round(dist, 2),
+            "top5": [self.move_index.top_moves(self.char1_id, dx, dy),
+                     self.move_index.top_moves(self.char2_id, dx, dy)],
+            "hits": [self.move_index.connecting_moves(self.char1_id, self.char2_id, dx, dy),
+                     self.move_index.connecting_moves(self.char2_id, self.char1_id, -dx, -dy)],
+        })
+        return result
+
+    @staticmethod
+    def situation_text(result):
+        """キーフレームの状況をコメント用の文章にする"""
+        def moves(hits):
+            return "、".join(f"{h['カテゴリ']} {h['行動']}".strip() for h in hits) or "(当たる技なし)"
+        return (
+            f"動画の {result['time']:.1f} 秒時点の状況です。\n"
+            f"1P: マス {result['cells'][0]} (相対座標 {tuple(result['relative'][0])})\n"
+            f"2P: マス {result['cells'][1]} (相対座標 {tuple(result['relative'][1])})\n"
+            f"ユークリッド距離: {result['distance']:.2f} マス\n"
+            f"1P の当たる技: {moves(result['hits'][0])}\n"
+            f"2P の当たる技: {moves(result['hits'][1])}\n"
+            "この状況で 1P が取るべき行動を短く提案してください。"
+        )
+
+    def run(self, path):
+        """
+        動画を解析し、イベントを順に返すジェネレータ。
+
+        Yields:
+            dict: {"type": "frame", ...} (解析したフレームごと。キーフレームは "keyframe": True)
+                  {"type": "commentary", "index", "time", "text"} (キーフレームのコメント。作れた順)
+                  {"type": "summary", ...} (最後に 1 回)
+        """
+        frames = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+        errors = []
+
+        def produce():
+            try:
+                for frame in iter_frames(path, self.sample_fps, backend=self.backend):
+                    # 消費側が止まったらデコードもやめる
+                    while not stop.is_set():
+                        try:
+                            frames.put(frame, timeout=0.1)
+                            break
+                        except queue.Full:
+                            continue
+                    if stop.is_set():
+                        return
+            except Exception as e:
+                errors.append(e)
+            finally:
+                frames.put(_DONE)
+
+        comments_in = queue.Queue(maxsize=self.queue_size)
+        comments_out = queue.Queue()
+
+        def comment():
+            while True:
+                item = comments_in.get()
+                if item is _DONE:
+                    return
+                result, payload = item
+                try:
+                    text = self.commentator(self.situation_text(result), payload)
+                except Exception as e:
+                    text = None
+                    comments_out.put({"type": "commentary", "index": result["index"], "time": result["time"],
+                                      "error": str(e)})
+                if text is not None:
+                    comments_out.put({"type": "commentary", "index": result["index"], "time": result["time"],
+                                      "text": text})
+
+        producer = threading.Thread(target=produce, name="video-decode", daemon=True)
+        producer.start()
+        commenter = None
+        if self.commentator is not None:
+            commenter = threading.Thread(target=comment, name="video-commentary", daemon=True)
+            commenter.start()
+
+        def drain_comments():
+            while True:
+                try:
+                    yield comments_out.get_nowait()
+                except queue.Empty:
+                    return
+
+        stats = {"frames": 0, "detected": 0, "keyframes": 0}
+        start = time.perf_counter()
+        last_key, last_key_time = None, None
+        try:
+            while True:
+                frame = frames.get()
+                if frame is _DONE:
+                    break
+                result = self.analyze_frame(frame)
+                stats["frames"] += 1
+                situation = tuple(result["cells"]) if result["positions"] is not None else None
+                keyframe = (
+                    situation is not None and situation != last_key
+                    and (last_key_time is None or frame.time - last_key_time >= self.min_keyframe_interval)
+                )
+                result["keyframe"] = keyframe
+                if situation is not None:
+                    stats["detected"] += 1
+                if keyframe:
+                    stats["keyframes"] += 1
+                    last_key, last_key_time = situation, frame.time
+                    if commenter is not None:
+                        # コメント待ちが溜まっていたら空くまで待つ (解析がコメントを追い越しすぎない)
+                        comments_in.put((result, encode_frame(frame.image)))
+                yield result
+                yield from drain_comments()
+        finally:
+            stop.set()
+            # 生産者が put で待っていても抜けられるよう、残りを捨てる
+            while producer.is_alive():
+                try:
+                    frames.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            if commenter is not None:
+                comments_in.put(_DONE)
+                commenter.join()
+        yield from drain_comments()
+        if errors:
+            raise errors[0]
+        elapsed = time.perf_counter() - start
+        yield {"type": "summary", **stats, "seconds": round(elapsed, 3),
+               "frames_per_second": round(stats["frames"] / elapsed, 1) if elapsed > 0 else None}
+
+
+def gemini_commentator(model):
+    """gemini_pool のモデルでキーフレームのコメントを作る commentator"""
+    from gemini_pool import iter_text
+
+    def commentator(situation_text, image_payload):
+        return "".join(iter_text(model, [situation_text, image_payload], stream=False))
+    return commentator
+
+
+def json_default(value):
+    # 推奨行動の値に NumPy の数値が混ざることがある
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"{type(value).__name__} は JSON にできません")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="動画を読みながら位置・距離・推奨行動を解析する")
+    parser.add_argument("video")
+    parser.add_argument("--db", default="smash_characters.db")
+    parser.add_argument("--char1", type=int, default=1, help="1P のキャラID")
+    parser.add_argument("--char2", type=int, default=2, help="2P のキャラID")
+    parser.add_argument("--fps", type=float, default=VIDEO_SAMPLE_FPS, help="1 秒あたりに解析するフレーム数")
+    parser.add_argument("--columns", type=int, default=33)
+    parser.add_argument("--rows", type=int, default=16)
+    parser.add_argument("--origin-cell", type=int, default=347)
+    parser.add_argument("--backend", choices=VIDEO_BACKENDS)
+    parser.add_argument("--commentary", action="store_true", help="キーフレームで Gemini のコメントを作る")
+    parser.add_argument("--keyframes-only", action="store_true", help="キーフレームとコメントだけを出力する")
+    parser.add_argument("--out", help="結果を書き出す JSON Lines ファイル (省略時は標準出力)")
+    args = parser.parse_args()
+
+    from move_index import MoveIndex
+
+    commentator = None
+    if args.commentary:
+        from gemini_pool import ModelPool
+        commentator = gemini_commentator(ModelPool().get())
+    pipeline = VideoPipeline(MoveIndex(args.db), args.char1, args.char2, columns=args.columns, rows=args.rows,
+                             origin_cell=args.origin_cell, sample_fps=args.fps, commentator=commentator,
+                             backend=args.backend)
+    out = open(args.out, "w", encoding="utf-8") if args.out else sys.stdout
+    try:
+        for event in pipeline.run(args.video):
+            if args.keyframes_only and event["type"] == "frame" and not event["keyframe"]:
+                continue
+            out.write(json.dumps(event, ensure_ascii=False, default=json_default) + "\n")
+            if event["type"] == "summary":
+                print(f"{event['frames']} フレーム (検出 {event['detected']}, キーフレーム {event['keyframes']}) "
+                      f"{event['seconds']}s, {event['frames_per_second']} フレーム/秒", file=sys.stderr)
+    finally:
+        if args.out:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
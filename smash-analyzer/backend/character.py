@@ -1,7 +1,7 @@
 import sqlite3
 
-def create_smash_db():
-   conn = sqlite3.connect('smash_characters.db')
+def create_smash_db(db_path='smash_characters.db'):
+   conn = sqlite3.connect(db_path)
    cursor = conn.cursor()
    
    # キャラ情報
@@ -164,5 +164,33 @@ def create_smash_db():
    conn.commit()
    conn.close()
 
+def create_moves_table(cursor):
+   # 技ごとに 1 行の縦持ちテーブル (moves_table.py で上の横持ちテーブルから移行する)
+   # category は元のテーブル名、move は技名 (fair, up_b, ... / 投げ・ダッシュの基本技は "")
+   cursor.execute('''
+   CREATE TABLE IF NOT EXISTS moves (
+       character_id INTEGER NOT NULL,
+       category TEXT NOT NULL,
+       move TEXT NOT NULL,
+       range_x FLOAT,
+       range_y FLOAT,
+       damage INTEGER,
+       startup INTEGER,
+       weapon FLOAT,
+       projectile FLOAT,
+       PRIMARY KEY (character_id, category, move),
+       FOREIGN KEY (character_id) REFERENCES characters (id)
+   )''')
+
+   # 距離での絞り込み用。推奨行動の取得がテーブルを読まずにインデックスだけで済むよう必要な列を含める
+   cursor.execute('''
+   CREATE INDEX IF NOT EXISTS moves_range_x
+   ON moves (character_id, range_x, category, move, damage, startup)
+   ''')
+   cursor.execute('''
+   CREATE INDEX IF NOT EXISTS moves_range_y
+   ON moves (character_id, range_y, category, move, damage, startup)
+   ''')
+
 if __name__ == "__main__":
    create_smash_db()
\ No newline at end of file
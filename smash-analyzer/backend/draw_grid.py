@@ -24,42 +24,45 @@ draw_grid.py
 上記コマンドを実行すると、
 images/test.jpg を読み込んで
 images/output_xxxxxxxx.jpg（xxxxxxxx=ランダム文字列）で出力されるします！！！
+
+【バッチモード】
+フォルダ (サブフォルダも含む) やグロブで指定した画像をまとめて、CPU コア数のプロセスで並列に描画するします！！！
+  python draw_grid.py --batch screenshots/ "archive/**/*.png" --output_dir images/grid --workers 8
+
+- 出力は output_dir 以下に、入力と同じフォルダ構成で「{元の名前}_grid_{設定のハッシュ}.{拡張子}」として保存
+  (同じ入力・同じ設定なら毎回同じ名前になるします！！！)
+  入力のルート (フォルダ・グロブ) が複数あるときは、ルートごとに「{ルートのフォルダ名}/」の下に分ける
+  (フォルダ名がかぶったら「{フォルダ名}_{絶対パスのハッシュ}/」)
+- 出力が既にあって入力より新しければ描き直さない (--skip_by hash なら入力の中身のハッシュで判定)
+- 画像を開くウィンドウ (img.show) は出さない
+- 最後に処理枚数と 枚/秒・MB/秒 を表示するします！！！
 """
 
 import argparse
+import functools
+import glob
+import hashlib
+import json
 import os
+import sys
+import time
 import uuid
+from concurrent.futures import ProcessPoolExecutor
 from PIL import Image, ImageDraw, ImageFont
 
-def draw_grid_with_relative_coords(
-    image_path, 
-    output_path, 
-    columns=33, 
-    rows=16, 
-    origin_cell=347,
-    line_color=(255, 255, 255),
-    line_width=1
-):
-    """
-    画像に格子を引き、各マスに対して:
-    - マス番号
-    - origin_cellを(0,0)とした相対座標
-    を描画する関数します！！！
+# 同じ条件のオーバーレイを何枚までキャッシュするか (1920x1080 で 1 枚約 8MB) します！！！
+OVERLAY_CACHE_SIZE = int(os.getenv("GRID_OVERLAY_CACHE_SIZE", "8"))
 
-    image_path: 入力画像ファイル (例: "images/test.jpg")
-    output_path: 出力画像ファイル (例: "images/output_XXXXXX.jpg")
-    columns: 縦方向のマス数
-    rows: 横方向のマス数
-    origin_cell: 原点(0,0)にしたいマス番号
-    line_color: 線と文字の色 (R, G, B)
-    line_width: 線の太さ
+# バッチモードで処理する拡張子
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+# --skip_by hash のとき、入力のハッシュを覚えておくファイル (output_dir 直下)
+MANIFEST_NAME = ".draw_grid_manifest.json"
+
+
+def _draw_grid_and_labels(draw, width, height, columns, rows, origin_cell, line_color, line_width):
+    """
+    draw に格子線と各マスのラベル (マス番号 + 相対座標) を描画する関数します！！！
     """
-    
-    # 画像を読み込み
-    img = Image.open(image_path)
-    draw = ImageDraw.Draw(img)
-    width, height = img.size
-    
     # マスの幅・高さ
     cell_width = width / columns
     cell_height = height / rows
@@ -100,15 +103,237 @@ def draw_grid_with_relative_coords(
             text_y = int(r * cell_height + (cell_height - text_height) / 2)
             
             draw.text((text_x, text_y), label_text, fill=line_color, font=font)
+
+
+@functools.lru_cache(maxsize=OVERLAY_CACHE_SIZE)
+def render_grid_overlay(width, height, columns, rows, origin_cell, line_color, line_width):
+    """
+    格子線とラベルだけを描いた透明な RGBA レイヤーを作る関数します！！！
+    同じ引数なら中身は毎回同じなので lru_cache で使い回す (返り値は書き換えないこと)。
+    """
+    overlay = Image.new("RGBA", (width, height), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(overlay)
+    _draw_grid_and_labels(draw, width, height, columns, rows, origin_cell, line_color, line_width)
+    return overlay
+
+
+def overlay_cache_info():
+    """オーバーレイキャッシュのヒット数・ミス数 (functools の CacheInfo) します！！！"""
+    return render_grid_overlay.cache_info()
+
+
+def clear_overlay_cache():
+    render_grid_overlay.cache_clear()
+
+
+def draw_grid_with_relative_coords(
+    image_path, 
+    output_path, 
+    columns=33, 
+    rows=16, 
+    origin_cell=347,
+    line_color=(255, 255, 255),
+    line_width=1,
+    show=True
+):
+    """
+    画像に格子を引き、各マスに対して:
+    - マス番号
+    - origin_cellを(0,0)とした相対座標
+    を描画する関数します！！！
+
+    image_path: 入力画像ファイル (例: "images/test.jpg")
+    output_path: 出力画像ファイル (例: "images/output_XXXXXX.jpg")
+    columns: 縦方向のマス数
+    rows: 横方向のマス数
+    origin_cell: 原点(0,0)にしたいマス番号
+    line_color: 線と文字の色 (R, G, B)
+    line_width: 線の太さ
+    show: 保存した画像を開いて表示するか (バッチモードでは False)
+    """
+    
+    # 画像を読み込み
+    img = Image.open(image_path)
+    width, height = img.size
+    
+    if img.mode in ("RGB", "RGBA"):
+        # キャッシュ済みの線・ラベルのレイヤーを 1 回貼り付けるだけ
+        overlay = render_grid_overlay(
+            width, height, columns, rows, origin_cell, tuple(line_color), line_width
+        )
+        img.paste(overlay, (0, 0), overlay)
+    else:
+        # パレット画像などは色の扱いが変わるので従来どおり直接描画
+        draw = ImageDraw.Draw(img)
+        _draw_grid_and_labels(draw, width, height, columns, rows, origin_cell, line_color, line_width)
     
     # 出力先に保存
     img.save(output_path)
     
     # 画像を自動で開いて可視化(環境によっては開かない場合もあるします)
+    if show:
+        try:
+            img.show()
+        except:
+            pass
+
+
+###############################################################################
+# バッチモード
+###############################################################################
+def iter_batch_inputs(patterns, exclude_dir=None):
+    """
+    フォルダ (サブフォルダも含む) またはグロブから画像ファイルを集め、(ルート, 相対パス) を名前順に返すします！！！
+    ルートは出力先で同じフォルダ構成を作るための基準。exclude_dir (出力先) の中のファイルは入力にしない。
+    """
+    exclude = os.path.abspath(exclude_dir) + os.sep if exclude_dir else None
+    found = {}
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            root = pattern
+            paths = (os.path.join(d, f) for d, _, files in os.walk(pattern) for f in files)
+        else:
+            # グロブのワイルドカードより前の部分をルートにする
+            root = os.path.dirname(pattern.split("*")[0].split("?")[0].split("[")[0]) or "."
+            paths = glob.glob(pattern, recursive=True)
+        for path in paths:
+            abspath = os.path.abspath(path)
+            if exclude and abspath.startswith(exclude):
+                continue
+            if path.lower().endswith(IMAGE_EXTENSIONS) and os.path.isfile(path):
+                found.setdefault(abspath, (root, os.path.relpath(path, root)))
+    return sorted(found.values(), key=lambda item: item[1])
+
+
+def settings_key(columns, rows, origin_cell, line_color, line_width):
+    """描画の設定から決まる短いハッシュ (出力ファイル名に入れる) します！！！"""
+    text = json.dumps([columns, rows, origin_cell, list(line_color), line_width])
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:8]
+
+
+def batch_root_prefixes(roots):
+    """
+    ルートごとの出力先のサブフォルダ名を返すします！！！
+    ルートが 1 つならサブフォルダは作らない ("")。複数あるときはルートのフォルダ名を使い、
+    フォルダ名がかぶるルートには絶対パスの短いハッシュを付けて、別のルートの同じ相対パスが同じ出力にならないようにする。
+    """
+    roots = sorted({os.path.abspath(root) for root in roots})
+    if len(roots) <= 1:
+        return {root: "" for root in roots}
+    names = {root: os.path.basename(root) for root in roots}
+    counts = {}
+    for name in names.values():
+        counts[name] = counts.get(name, 0) + 1
+    prefixes = {}
+    for root, name in names.items():
+        if not name or counts[name] > 1:
+            digest = hashlib.sha1(root.encode("utf-8")).hexdigest()[:8]
+            name = f"{name}_{digest}" if name else digest
+        prefixes[root] = name
+    return prefixes
+
+
+def batch_output_path(output_dir, relpath, key, prefix=""):
+    stem, ext = os.path.splitext(relpath)
+    return os.path.join(output_dir, prefix, f"{stem}_grid_{key}{ext}")
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _render_batch_item(task):
+    """
+    ワーカープロセスで 1 枚描画する。
+    Returns:
+        tuple: (入力パス, 出力パス, 入力のバイト数, エラーメッセージまたは None)
+    """
+    input_path, output_path, settings = task
+    # 書きかけのファイルを「最新」と見なさないよう、一時ファイルに書いてから置き換える
+    stem, ext = os.path.splitext(output_path)
+    tmp_path = f"{stem}.tmp{os.getpid()}{ext}"
     try:
-        img.show()
-    except:
-        pass
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        draw_grid_with_relative_coords(input_path, tmp_path, show=False, **settings)
+        os.replace(tmp_path, output_path)
+        return input_path, output_path, os.path.getsize(input_path), None
+    except Exception as e:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return input_path, output_path, 0, f"{type(e).__name__}: {e}"
+
+
+def run_batch(patterns, output_dir, columns=33, rows=16, origin_cell=347, line_color=(255, 255, 255),
+              line_width=1, workers=None, skip_by="mtime", force=False):
+    """
+    patterns の画像をまとめて描画するします！！！
+
+    Returns:
+        dict: {"total", "rendered", "skipped", "failed", "seconds", "images_per_sec", "mb_per_sec"}
+    """
+    settings = {"columns": columns, "rows": rows, "origin_cell": origin_cell,
+                "line_color": tuple(line_color), "line_width": line_width}
+    key = settings_key(columns, rows, origin_cell, line_color, line_width)
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    manifest = {}
+    if skip_by == "hash" and os.path.exists(manifest_path):
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+
+    start = time.perf_counter()
+    inputs = iter_batch_inputs(patterns, exclude_dir=output_dir)
+    prefixes = batch_root_prefixes(root for root, _ in inputs)
+    tasks, hashes, skipped = [], {}, 0
+    for root, relpath in inputs:
+        input_path = os.path.join(root, relpath)
+        # スキップの判定もマニフェストのキーも、ルートで分けたこの出力パスを使う
+        output_path = batch_output_path(output_dir, relpath, key, prefixes[os.path.abspath(root)])
+        if not force and os.path.exists(output_path):
+            if skip_by == "hash":
+                hashes[output_path] = file_hash(input_path)
+                if manifest.get(os.path.relpath(output_path, output_dir)) == hashes[output_path]:
+                    skipped += 1
+                    continue
+            elif os.path.getmtime(output_path) >= os.path.getmtime(input_path):
+                skipped += 1
+                continue
+        elif skip_by == "hash":
+            hashes[output_path] = file_hash(input_path)
+        tasks.append((input_path, output_path, settings))
+
+    rendered = failed = 0
+    total_bytes = 0
+    if tasks:
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as executor:
+            chunksize = max(1, len(tasks) // (workers * 4))
+            for input_path, output_path, size, error in executor.map(_render_batch_item, tasks, chunksize=chunksize):
+                if error is not None:
+                    failed += 1
+                    print(f"失敗: {input_path}: {error}", file=sys.stderr)
+                    continue
+                rendered += 1
+                total_bytes += size
+                if skip_by == "hash":
+                    manifest[os.path.relpath(output_path, output_dir)] = hashes[output_path]
+    if skip_by == "hash" and rendered:
+        with open(manifest_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=0, sort_keys=True)
+
+    seconds = time.perf_counter() - start
+    return {
+        "total": len(inputs),
+        "rendered": rendered,
+        "skipped": skipped,
+        "failed": failed,
+        "seconds": round(seconds, 3),
+        "images_per_sec": round(rendered / seconds, 2) if seconds > 0 else None,
+        "mb_per_sec": round(total_bytes / 2**20 / seconds, 2) if seconds > 0 else None,
+    }
 
 
 def main():
@@ -119,8 +344,24 @@ def main():
     parser.add_argument("--origin_cell", type=int, default=347, help="このマスを(0,0)にしたいします！！！")
     parser.add_argument("--line_color", nargs=3, type=int, default=[255, 255, 255], help="線・文字の色(R G B)を指定してほしいします！！！")
     parser.add_argument("--line_width", type=int, default=1, help="線の太さを指定してほしいします！！！")
+    parser.add_argument("--batch", nargs="+", metavar="DIR_OR_GLOB", help="まとめて描画するフォルダまたはグロブ (バッチモード) します！！！")
+    parser.add_argument("--output_dir", default=os.path.join("images", "grid"), help="バッチモードの出力先します！！！")
+    parser.add_argument("--workers", type=int, default=None, help="バッチモードのプロセス数 (省略時は CPU コア数) します！！！")
+    parser.add_argument("--skip_by", choices=["mtime", "hash"], default="mtime", help="描画済みかの判定方法します！！！")
+    parser.add_argument("--force", action="store_true", help="描画済みでも描き直すします！！！")
     
     args = parser.parse_args()
+
+    if args.batch:
+        summary = run_batch(
+            args.batch, args.output_dir, columns=args.columns, rows=args.rows, origin_cell=args.origin_cell,
+            line_color=tuple(args.line_color), line_width=args.line_width, workers=args.workers,
+            skip_by=args.skip_by, force=args.force
+        )
+        print(f"{summary['total']} 枚中 描画 {summary['rendered']} / スキップ {summary['skipped']} / 失敗 {summary['failed']} "
+              f"({summary['seconds']}s, {summary['images_per_sec']} 枚/秒, {summary['mb_per_sec']} MB/秒) します！！！")
+        print(f"出力: {args.output_dir} !!!")
+        sys.exit(1 if summary["failed"] else 0)
     
     # 画像を置くフォルダ
     images_folder = "images"
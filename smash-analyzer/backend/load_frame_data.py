@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+load_frame_data.py
+
+CSV / JSON のフレームデータを smash_characters.db にまとめて取り込むツール。
+
+mario.py / link.py は insert_* 関数ごとに接続・コミットし、値も SQL に直書きしているので、
+全 87 ファイターに広げると数百回の接続・コミットと手書きのスクリプトが必要になる。
+このツールは何人分のファイルでも、1 回の接続・1 トランザクションの executemany で
+characters と moves (縦持ちの技テーブル。moves_table.py 参照) に upsert する。
+同じファイルを何度取り込んでも結果は変わらない (既存の行は上書き)。
+
+取り込む前に character.py のスキーマ作成と moves_table.py の移行を行うので、
+空の DB にも、移行前の DB にもそのまま取り込める (横持ちテーブルは互換ビューで読める)。
+
+【ファイル形式】
+  JSON: キャラのリスト
+    [{"id": 1, "name": "Mario", "size_x": 8, "size_y": 14, "weight": 98,
+      "moves": [{"category": "air_moves", "move": "fair", "range_x": 6, "range_y": 5,
+                 "damage": 14.4, "startup": 16, "weapon": 0, "projectile": null}, ...]}, ...]
+  CSV: 技 1 つにつき 1 行 (キャラ情報の列は同じキャラの行で同じ値にする)
+    character_id,name,size_x,size_y,weight,category,move,range_x,range_y,damage,startup,weapon,projectile
+
+【使い方】
+  python load_frame_data.py data/mario.json data/link.json --db smash_characters.db
+  python load_frame_data.py fighters.csv
+  python load_frame_data.py --export data/all.json   # DB の内容を JSON に書き出す
+"""
+
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import time
+
+from character import create_smash_db
+from moves_table import MOVE_COLUMNS, UPSERT_SQL, WIDE_TABLES, migrate
+
+CHARACTER_COLUMNS = ("id", "name", "size_x", "size_y", "weight")
+
+CHARACTER_UPSERT_SQL = """
+INSERT INTO characters (id, name, size_x, size_y, weight) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (id) DO UPDATE SET
+name=excluded.name, size_x=excluded.size_x, size_y=excluded.size_y, weight=excluded.weight
+"""
+
+# 取り込み中だけ使う設定。1 トランザクションなので同期はコミット時の 1 回で足りる。
+# journal_mode=WAL は DB ファイルに保存されるので、取り込みが終わったら元のモードに戻す
+BULK_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-65536",
+)
+
+
+class FrameDataError(ValueError):
+    """入力ファイルの内容が不正"""
+
+
+def _number(value, path, field):
+    # CSV は文字列なので数値に直す (空欄は NULL)。整数で表せるものは int にする
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        number = float(value)
+    except ValueError:
+        raise FrameDataError(f"{path}: {field} が数値ではありません: {value!r}")
+    return int(number) if number.is_integer() and "." not in value else number
+
+
+def _move_row(character_id, move, path):
+    category = move.get("category")
+    if category not in WIDE_TABLES:
+        raise FrameDataError(f"{path}: 未対応の category です: {category!r}")
+    return (character_id, category, move.get("move") or "",
+            *(_number(move.get(col), path, col) for col in MOVE_COLUMNS))
+
+
+def read_json(path):
+    """JSON ファイルから (キャラの行リスト, 技の行リスト) を読む"""
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = [data]
+    characters, moves = [], []
+    for character in data:
+        character_id = _number(character.get("id"), path, "id")
+        if character_id is None or not character.get("name"):
+            raise FrameDataError(f"{path}: キャラの id と name は必須です")
+        characters.append((character_id, character["name"],
+                           *(_number(character.get(col), path, col) for col in CHARACTER_COLUMNS[2:])))
+        moves.extend(_move_row(character_id, move, path) for move in character.get("moves", []))
+    return characters, moves
+
+
+def read_csv(path):
+    """CSV ファイル (技 1 つにつき 1 行) から (キャラの行リスト, 技の行リスト) を読む"""
+    characters, moves = {}, []
+    with open(path, encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f):
+            character_id = _number(row.get("character_id"), path, "character_id")
+            if character_id is None:
+                raise FrameDataError(f"{path}: character_id は必須です")
+            if row.get("name"):
+                characters[character_id] = (character_id, row["name"],
+                                            *(_number(row.get(col), path, col) for col in CHARACTER_COLUMNS[2:]))
+            if row.get("category"):
+                moves.append(_move_row(character_id, row, path))
+    return list(characters.values()), moves
+
+
+def read_frame_data(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".json":
+        return read_json(path)
+    if ext == ".csv":
+        return read_csv(path)
+    raise FrameDataError(f"{path}: .json か .csv のファイルを指定してください")
+
+
+def load_frame_data(db_path, paths):
+    """
+    ファイル群を読み込み、1 トランザクションで characters / moves に upsert する。
+
+    Args:
+        db_path (str): 取り込み先の DB (無ければ作成する)
+        paths (list): JSON / CSV ファイルのパス
+    Returns:
+        dict: {"characters": 行数, "moves": 行数, "seconds": 書き込みにかかった秒数}
+    """
+    characters, moves = [], []
+    for path in paths:
+        c, m = read_frame_data(path)
+        characters.extend(c)
+        moves.extend(m)
+
+    # スキーマ作成と moves への移行 (どちらも済んでいれば何もしない)
+    create_smash_db(db_path)
+    migrate(db_path)
+
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+    try:
+        for pragma in BULK_PRAGMAS:
+            conn.execute(pragma)
+        start = time.perf_counter()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(CHARACTER_UPSERT_SQL, characters)
+            conn.executemany(UPSERT_SQL, moves)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        elapsed = time.perf_counter() - start
+    finally:
+        if journal_mode.lower() != "wal":
+            try:
+                conn.execute(f"PRAGMA journal_mode={journal_mode}")
+            except sqlite3.OperationalError:
+                # 他の接続が開いていると WAL から戻せない (その場合は WAL のまま残る)
+                pass
+        conn.close()
+    return {"characters": len(characters), "moves": len(moves), "seconds": elapsed}
+
+
+def export_frame_data(db_path, path):
+    """DB の characters / moves を取り込みと同じ形式の JSON に書き出す"""
+    conn = sqlite3.connect(db_path)
+    try:
+        data = []
+        for row in conn.execute(f"SELECT {', '.join(CHARACTER_COLUMNS)} FROM characters ORDER BY id"):
+            character = dict(zip(CHARACTER_COLUMNS, row))
+            character["moves"] = [
+                dict(zip(("category", "move") + MOVE_COLUMNS, move))
+                for move in conn.execute(
+                    f"SELECT category, move, {', '.join(MOVE_COLUMNS)} FROM moves "
+                    "WHERE character_id=? ORDER BY rowid", (character["id"],)
+                )
+            ]
+            data.append(character)
+    finally:
+        conn.close()
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    return len(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="フレームデータ (CSV / JSON) を DB に取り込む")
+    parser.add_argument("paths", nargs="*", help="取り込む .json / .csv ファイル")
+    parser.add_argument("--db", default="smash_characters.db")
+    parser.add_argument("--export", metavar="JSON", help="取り込まずに DB の内容を JSON に書き出す")
+    args = parser.parse_args()
+
+    if args.export:
+        n = export_frame_data(args.db, args.export)
+        print(f"{n} キャラを {args.export} に書き出しました")
+        return
+    if not args.paths:
+        parser.error("取り込むファイルを指定してください")
+
+    result = load_frame_data(args.db, args.paths)
+    rows = result["characters"] + result["moves"]
+    print(f"キャラ {result['characters']} 行 / 技 {result['moves']} 行を取り込みました "
+          f"({result['seconds'] * 1000:.1f}ms, {rows / max(result['seconds'], 1e-9):,.0f} 行/秒)")
+
+
+if __name__ == "__main__":
+    main()
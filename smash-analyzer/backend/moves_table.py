@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+moves_table.py
+
+横持ちの技テーブル (air_moves / B_moves / ... : 技 × 属性ごとに 1 カラム) を、
+技ごとに 1 行の縦持ちテーブル moves に移行するツール。
+
+横持ちのままだと推奨行動を出すのに SELECT * で全カラム (ダメージや発生フレームまで) を
+距離と比較するしかないが、moves なら (character_id, range_x) / (character_id, range_y) の
+カバリングインデックスに対する範囲検索だけで済む (recommend_moves)。
+
+移行後は元のテーブル名で「同じカラム・同じ並び」の互換ビューを作るので、
+SELECT * FROM air_moves などの既存の読み込み (MoveIndex / recommend_actions) はそのまま動く。
+ビューには INSTEAD OF INSERT トリガーを付けるので、mario.py / link.py の INSERT も moves に入る。
+
+【使い方】
+  python moves_table.py smash_characters.db            # 移行 (何度実行しても同じ結果)
+  python moves_table.py smash_characters.db --keep-wide # moves を作るだけで元のテーブルは残す
+"""
+
+import argparse
+import sqlite3
+import time
+
+from character import create_moves_table
+
+# 移行する横持ちテーブル
+WIDE_TABLES = ("B_moves", "air_moves", "dash_moves", "kyou_zyaku_moves", "smash_moves", "throw_moves")
+
+# 横持ちのカラムの接尾辞 -> moves のカラム
+ATTRIBUTE_COLUMNS = {
+    "x": "range_x",
+    "y": "range_y",
+    "damage": "damage",
+    "startup": "startup",
+    "weapon": "weapon",
+    "tobi": "projectile",
+}
+MOVE_COLUMNS = ("range_x", "range_y", "damage", "startup", "weapon", "projectile")
+
+
+def split_column(col):
+    """
+    横持ちのカラム名を (技名, moves のカラム) に分ける。
+    例: "fair_damage" -> ("fair", "damage"), "d_x" -> ("d", "range_x"), "x" -> ("", "range_x")
+    """
+    for attr, long_col in ATTRIBUTE_COLUMNS.items():
+        if col == attr:
+            return "", long_col
+        if col.endswith("_" + attr):
+            return col[:-len(attr) - 1], long_col
+    raise ValueError(f"技のカラムではありません: {col}")
+
+
+def _object_type(cursor, name):
+    row = cursor.execute("SELECT type FROM sqlite_master WHERE name=?", (name,)).fetchone()
+    return row[0] if row else None
+
+
+def wide_columns(cursor, table):
+    # id / character_id を除いた技カラム (CREATE TABLE の並び)
+    return [row[1] for row in cursor.execute(f"PRAGMA table_info({table})")
+            if row[1] not in ("id", "character_id")]
+
+
+def group_by_move(columns):
+    """{技名: {moves のカラム: 横持ちのカラム}} (技の並びはカラムの並び)"""
+    moves = {}
+    for col in columns:
+        name, long_col = split_column(col)
+        moves.setdefault(name, {})[long_col] = col
+    return moves
+
+
+UPSERT_SQL = f"""
+INSERT INTO moves (character_id, category, move, {', '.join(MOVE_COLUMNS)})
+VALUES (?, ?, ?, {', '.join('?' for _ in MOVE_COLUMNS)})
+ON CONFLICT (character_id, category, move) DO UPDATE SET
+{', '.join(f'{col}=excluded.{col}' for col in MOVE_COLUMNS)}
+"""
+
+
+def copy_wide_table(cursor, table):
+    """横持ちテーブルの全行を moves に upsert し、書き込んだ行数を返す"""
+    columns = wide_columns(cursor, table)
+    moves = group_by_move(columns)
+    position = {col: i for i, col in enumerate(columns)}
+    params = []
+    for row in cursor.execute(f"SELECT character_id, {', '.join(columns)} FROM {table}").fetchall():
+        character_id, values = row[0], row[1:]
+        for name, attrs in moves.items():
+            move_values = [values[position[attrs[c]]] if c in attrs else None for c in MOVE_COLUMNS]
+            # 値が 1 つも入っていない技は行を作らない (ビューでは NULL のまま見える)
+            if any(v is not None for v in move_values):
+                params.append((character_id, table, name, *move_values))
+    cursor.executemany(UPSERT_SQL, params)
+    return len(params)
+
+
+def create_compat_view(cursor, table, columns):
+    """
+    moves から元の横持ちテーブルと同じカラム・並びのビューと、INSERT 用のトリガーを作る。
+    id は character_id で代用する (元のテーブルもキャラ 1 人 1 行)。
+    """
+    moves = group_by_move(columns)
+    select_cols = []
+    for col in columns:
+        name, long_col = split_column(col)
+        select_cols.append(f"MAX(CASE WHEN move='{name}' THEN {long_col} END) AS {col}")
+    cursor.execute(f"""
+    CREATE VIEW {table} AS
+    SELECT character_id AS id, character_id, {', '.join(select_cols)}
+    FROM moves WHERE category='{table}'
+    GROUP BY character_id ORDER BY character_id
+    """)
+
+    statements = []
+    for name, attrs in moves.items():
+        values = [f"NEW.{attrs[c]}" if c in attrs else "NULL" for c in MOVE_COLUMNS]
+        present = [f"NEW.{attrs[c]} IS NOT NULL" for c in MOVE_COLUMNS if c in attrs]
+        statements.append(f"""
+        INSERT INTO moves (character_id, category, move, {', '.join(MOVE_COLUMNS)})
+        SELECT NEW.character_id, '{table}', '{name}', {', '.join(values)}
+        WHERE {' OR '.join(present)}
+        ON CONFLICT (character_id, category, move) DO UPDATE SET
+        {', '.join(f'{c}=excluded.{c}' for c in MOVE_COLUMNS)};""")
+    cursor.execute(f"""
+    CREATE TRIGGER {table}_insert INSTEAD OF INSERT ON {table}
+    BEGIN {''.join(statements)}
+    END
+    """)
+
+
+def migrate(db_path, keep_wide=False):
+    """
+    moves を作って横持ちテーブルのデータを移し、(keep_wide=False なら) 元のテーブルを互換ビューに置き換える。
+    1 トランザクションで行い、既に移行済みのテーブル (ビュー) は飛ばすので何度実行してもよい。
+
+    Returns:
+        dict: {テーブル名: moves に書き込んだ行数}
+    """
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            create_moves_table(cursor)
+            copied = {}
+            for table in WIDE_TABLES:
+                if _object_type(cursor, table) != "table":
+                    continue
+                columns = wide_columns(cursor, table)
+                copied[table] = copy_wide_table(cursor, table)
+                if not keep_wide:
+                    cursor.execute(f"DROP TABLE {table}")
+                    create_compat_view(cursor, table, columns)
+            cursor.execute("COMMIT")
+        except BaseException:
+            cursor.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+    return copied
+
+
+RECOMMEND_SQL = """
+SELECT category, move, axis, range, damage, startup FROM (
+    SELECT category, move, 'x' AS axis, range_x AS range, damage, startup
+    FROM moves WHERE character_id = :character_id AND range_x >= :distance
+    UNION ALL
+    SELECT category, move, 'y' AS axis, range_y AS range, damage, startup
+    FROM moves WHERE character_id = :character_id AND range_y >= :distance
+)
+ORDER BY range
+LIMIT :k
+"""
+
+
+def recommend_moves(conn, character_id, distance, k=5):
+    """
+    distance 以上の射程 (横 / 縦) を持つ技を射程の短い順に k 件返す。
+    moves_range_x / moves_range_y のインデックスだけで完結する 2 本の範囲検索になる。
+
+    Returns:
+        list: (カテゴリ, 技名, "x" / "y", 射程, ダメージ, 発生フレーム) のリスト
+    """
+    return conn.execute(RECOMMEND_SQL, {"character_id": character_id, "distance": distance, "k": k}).fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="横持ちの技テーブルを moves に移行する")
+    parser.add_argument("db_path", nargs="?", default="smash_characters.db")
+    parser.add_argument("--keep-wide", action="store_true", help="元のテーブルを残す (ビューに置き換えない)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    copied = migrate(args.db_path, keep_wide=args.keep_wide)
+    elapsed = time.perf_counter() - start
+    for table, n in copied.items():
+        print(f"{table}: {n} 行")
+    if not copied:
+        print("移行済みです")
+    print(f"合計 {sum(copied.values())} 行 ({elapsed * 1000:.1f}ms)")
+
+
+if __name__ == "__main__":
+    main()